@@ -1,19 +1,34 @@
-from fastapi import FastAPI, File, UploadFile # type: ignore
+from fastapi import FastAPI, Request # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
 from fastapi.responses import JSONResponse # type: ignore
+from fastapi.concurrency import run_in_threadpool # type: ignore
 import os
 import shutil
 import logging
+from typing import Any, Dict, Optional
+import numpy as np
 import video_to_vaw
 import speech_to_text
 import insert_punctuation
 import parts_of_speech
 import read_volume
+import prosody
 import rate_of_speech
+import predict_flaws
 from done_with_some_llm import grammar_tone, sapling
 # from gramformer import Gramformer # Import Gramformer
 import pose_tracking
 import openface
+import tone_analyzer
+import timestamped_punctuation
+import nlp_document
+import upload_ingest
+from audio_buffer import AudioSource
+from model_registry import registry, models_from_env
+from job_queue import job_queue, Job, JobFailed, JobRejected, DONE, FAILED, STAGE_PENDING
+from stage_graph import PROCESS, Stage, run_stages, shutdown_process_pool
+from result_cache import result_cache
+from http_client import http_pool
 
 # Initialize Gramformer globally
 # models=1 for corrector (default), models=2 for detector
@@ -31,6 +46,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Models are loaded lazily on first use. PRELOAD_MODELS ("all" or a comma-separated list,
+# e.g. "whisper:accurate,punctuation") loads them at import time, so that a pre-forking server
+# (gunicorn --preload) shares the weights between its workers; WARMUP_MODELS loads them
+# in each worker on startup instead of during the first upload.
+preload_models = models_from_env("PRELOAD_MODELS")
+if preload_models is None or preload_models:
+    registry.preload(preload_models)
+
 app = FastAPI()
 
 # Configure CORS to allow requests from your frontend
@@ -50,64 +73,149 @@ app.add_middleware(
 )
 
 # --- Grammar Correction Helper Functions ---
-# Remove Gramformer and related functions
+# The grammar backend (OpenRouter, local Gramformer or none) is chosen by GRAMMAR_BACKEND
 
-def get_grammar_corrections(text: str):
+def get_grammar_corrections(text: str, document: Optional[nlp_document.NlpDocument] = None):
     """
-    Uses get_mistakes_and_text from grammar_tone.py to return mistakes, corrected text, and highlight spans.
+    Uses get_corrections from grammar_tone.py to return mistakes, corrected text, highlight spans
+    and the spans of the mistakes in the checked text (for finding them in the audio).
+    The text is checked per sentence of the job's NlpDocument when one is given.
     """
     logger.info("get_grammar_corrections called")
-    mistakes_lines, corrected_text, correction_spans = grammar_tone.get_mistakes_and_text(text)
-    if mistakes_lines is None:
-        mistakes_lines = []
-    if corrected_text is None:
-        corrected_text = text
-    if correction_spans is None:
-        correction_spans = []
-    return mistakes_lines, corrected_text, correction_spans
+    sentences = document.sentences if document is not None else None
+    return grammar_tone.get_corrections(text, sentences=sentences)
 
-# --- FastAPI Routes ---
+# "sapling": Sapling's API, falling back to the local lexicon when it gives no result
+# "local": tone_analyzer only, offline
+TONE_BACKEND = os.getenv("TONE_BACKEND", "sapling")
+
+# "pcm": decode once with ffmpeg into an AudioBuffer shared in memory by all audio stages
+# "wav": legacy moviepy export of a 44.1 kHz WAV file
+AUDIO_EXTRACTION = os.getenv("AUDIO_EXTRACTION", "pcm")
+
+def extract_audio(video_path: str) -> AudioSource:
+    if AUDIO_EXTRACTION == "wav":
+        # Write the WAV next to the video, inside the job's own directory
+        audio = video_to_vaw.convert_video_to_wav(video_path, output_dir=os.path.dirname(video_path) or '.')
+    else:
+        audio = video_to_vaw.decode_audio(video_path)
+    if audio is None:
+        raise JobFailed("No audio track found in video or conversion failed.", status_code=400)
+    return audio
+
+def join_words(timestamped_transcript_by_words) -> str:
+    # Combine words into a single unpunctuated string and add punctuation to it
+    full_unpunctuated_text = ' '.join(word for _, word in timestamped_transcript_by_words.items())
+    return insert_punctuation.get_punctuated_text(full_unpunctuated_text)
 
-@app.post("/api/upload")
-async def upload_video(file: UploadFile = File(...)):
+def get_disfluencies(timestamped_transcript_by_words) -> Dict[str, Any]:
+    flaws = predict_flaws.detect_disfluencies(timestamped_transcript_by_words,
+                                              speech_to_text.word_probabilities(timestamped_transcript_by_words))
+    return {"flaws": flaws, **predict_flaws.summarize_disfluencies(flaws, timestamped_transcript_by_words)}
+
+def get_volume_points(audio_path: AudioSource):
+    # 2 s segments for the report chart and 50 ms frames for the UI timeline, from one pass over the audio.
+    # The 95th percentile keeps normalized values mostly within the chart's 0-100% range.
+    loudness = read_volume.compute_loudness(audio_path, normalization="percentile")
+    report, ui = loudness["report"], loudness["ui"]
+    volume_points = {f"{ts:g}": value for ts, value in zip(report.times.tolist(), report.normalized.tolist())}
+    loudness_timeline = {
+        "times": np.round(ui.times, 3).tolist(),
+        "dbfs": np.round(ui.dbfs, 2).tolist(),
+    }
+    return volume_points, loudness_timeline
+
+def get_hand_positions(video_path: str) -> Dict[str, Any]:
+    # The result is cached by upload content, so it must not name this upload's file, which is deleted after the job
+    hand_positions = pose_tracking.analyze_hand_positions(video_path, workers=None)
+    hand_positions.pop("video_path", None)
+    return hand_positions
+
+# The audio branch (transcription -> punctuation -> text analyses) and the video
+# branch (pose tracking, OpenFace) only share the uploaded file, so they run concurrently.
+# Expensive stages are cached by upload content and settings; bump a stage's version
+# when its model or output format changes. Settings that change a stage's result are part
+# of its version, so changing them never returns results computed under other settings.
+def settings_version(version: str, **settings) -> str:
+    return version + "".join(f";{name}={value}" for name, value in sorted(settings.items()))
+
+ANALYSIS_STAGES = [
+    Stage("audio_extraction", extract_audio, deps=["video"], version=AUDIO_EXTRACTION),
+    Stage("transcription", lambda audio_path, preset: speech_to_text.speech_to_words(audio_path=audio_path, preset=preset), deps=["audio_extraction", "whisper_preset"],
+          cache=True, version=settings_version("2", long_form_min_sec=speech_to_text.LONG_FORM_MIN_SEC,
+                                               long_form_chunk_sec=speech_to_text.LONG_FORM_CHUNK_SEC,
+                                               long_form_splitter=speech_to_text.LONG_FORM_SPLITTER)),
+    Stage("punctuation", join_words, deps=["transcription"], cache=True,
+          version=settings_version(insert_punctuation.PUNCTUATION_MODE, window=insert_punctuation.PUNCTUATION_WINDOW_WORDS,
+                                   overlap=insert_punctuation.PUNCTUATION_OVERLAP_WORDS)),
+    # Grammar results are cached per sentence by grammar_tone itself, and only when the check succeeded
+    # One spaCy pass (tokens, POS tags, lemmas, sentences) shared by the text analyses
+    Stage("nlp", nlp_document.analyze, deps=["punctuation"]),
+    Stage("grammar", get_grammar_corrections, deps=["punctuation", "nlp"]),
+    Stage("word_alignment", timestamped_punctuation.align_words_to_text, deps=["transcription", "punctuation", "nlp"]),
+    Stage("parts_of_speech", parts_of_speech.parts_of_speech, deps=["nlp"]),
+    Stage("rate_of_speech", rate_of_speech.get_rate_of_speech, deps=["transcription"]),
+    Stage("speech_rate", rate_of_speech.get_speech_rate_metrics, deps=["transcription"]),
+    Stage("disfluencies", get_disfluencies, deps=["transcription"]),
+    Stage("volume", get_volume_points, deps=["audio_extraction"], cache=True),
+    # Pitch tracking is CPU-bound, so it runs in the stage process pool instead of competing for the GIL
+    # with the transcription and text stages; the decoded audio is pickled over to the worker
+    Stage("prosody", prosody.analyze_prosody, deps=["audio_extraction"], kind=PROCESS, cache=True,
+          version=settings_version("1", tracker=prosody.PITCH_TRACKER, fmin=prosody.PITCH_FMIN, fmax=prosody.PITCH_FMAX)),
+    # Only Sapling's answers are cached; an empty list means it could not be reached.
+    # The local analyzer takes milliseconds, so it is not cached.
+    Stage("tone", sapling.get_tone, deps=["punctuation"], cache=True, cache_if=bool) if TONE_BACKEND == "sapling"
+    else Stage("tone", tone_analyzer.get_tone, deps=["punctuation"]),
+    Stage("tone_timeline", tone_analyzer.get_tone_timeline, deps=["word_alignment", "punctuation", "nlp"]),
+    # Pose tracking fans out over its own process pool, one landmarker per time range
+    Stage("hand_positions", get_hand_positions, deps=["video"], cache=True,
+          version=settings_version("3", max_side=pose_tracking.POSE_MAX_SIDE, frame_interval=pose_tracking.POSE_FRAME_INTERVAL_SEC),
+          cache_if=lambda result: "error" not in result),
+    # OpenFace writes its CSV next to the upload, in the job's own directory
+    Stage("openface", lambda video: openface.analyze_face(video, temp_dir=os.path.dirname(video) or None), deps=["video"], cache=True,
+          version=settings_version("2", min_confidence=openface.OPENFACE_MIN_CONFIDENCE, window_sec=openface.FACE_WINDOW_SEC),
+          cache_if=lambda statistics: statistics is not None),
+]
+# Everything but the extracted audio and the NLP document ends up in the response
+ANALYSIS_OUTPUTS = [analysis_stage.name for analysis_stage in ANALYSIS_STAGES if analysis_stage.name not in ("audio_extraction", "nlp")]
+
+def analyze_video(job: Optional[Job], file_path: str, work_dir: Optional[str] = None, preset: Optional[str] = None,
+                  content_hash: Optional[str] = None) -> Dict[str, Any]:
     """
-    Handles video file uploads, processes them for speech analysis,
-    and returns various metrics including grammar correction.
+    Runs the full speech analysis on a saved video file and returns the results
+    as the JSON-serializable dict served to the frontend. Removes the video and
+    the job's working directory when done.
+    preset selects the Whisper quality/latency preset (speech_to_text.WHISPER_PRESETS).
+    content_hash (the upload's SHA-256) enables the result cache: stages already computed
+    for the same video and settings are loaded instead of run.
     """
-    logger.info(f"upload_video called with file: {file.filename}")
-    upload_dir = "uploaded_videos"
-    os.makedirs(upload_dir, exist_ok=True) # Ensure the directory exists
-    if file.filename is None:
-        raise Exception("Filename is None in api/upload")
-    file_path = os.path.join(upload_dir, file.filename)
-    audio_path = None # Initialize audio_path to None for cleanup in finally block
+    logger.info(f"analyze_video called with file: {file_path}, preset: {preset}")
+    results: Dict[str, Any] = {"video": file_path, "whisper_preset": preset}
+    if job is not None:
+        for analysis_stage in ANALYSIS_STAGES:
+            job.set_stage(analysis_stage.name, STAGE_PENDING)
 
     try:
-        # Save the uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        input_keys = None
+        if content_hash is not None:
+            input_keys = {"video": content_hash, "whisper_preset": speech_to_text.get_preset(preset)}
+        results, timings = run_stages(
+            ANALYSIS_STAGES,
+            initial=results,
+            on_stage=job.set_stage if job is not None else None,
+            cache=result_cache if content_hash is not None else None,
+            input_keys=input_keys,
+            outputs=ANALYSIS_OUTPUTS,
+        )
+        logger.info(f"Stage timings for {file_path}: {timings}")
 
-        # Convert video to WAV audio
-        audio_path = video_to_vaw.convert_video_to_wav(file_path)
-        if audio_path is None:
-            return JSONResponse(status_code=400, content={"error": "No audio track found in video or conversion failed."})
+        timestamped_transcript_by_words = results["transcription"]
+        full_text = results["punctuation"]
+        mistakes_lines, corrected_text, correction_spans, original_spans = results["grammar"]
 
-        # Transcribe speech to words with timestamps
-        timestamped_transcript_by_words = speech_to_text.speech_to_words(audio_path=audio_path)
-        
         # Calculate word count
         word_count = rate_of_speech.count_words(timestamped_transcript_by_words)
         
-        # Combine words into a single unpunctuated string
-        # FIX: Changed 'timestamped_transcript_by_items' to 'timestamped_transcript_by_words'
-        full_unpunctuated_text = ' '.join(word for _, word in timestamped_transcript_by_words.items())
-        
-        # Add punctuation to the full text
-        full_text = insert_punctuation.get_punctuated_text(full_unpunctuated_text)
-        
-        # --- Grammar Correction (now using grammar_tone.get_mistakes_and_text) ---
-        mistakes_lines, corrected_text, correction_spans = get_grammar_corrections(full_text)
-        
         # For highlighting, wrap the corrected spans in <c> tags
         highlighted_text = corrected_text
         # Sort spans in reverse order to avoid messing up indices
@@ -118,9 +226,14 @@ async def upload_video(file: UploadFile = File(...)):
                 highlighted_text[end:]
             )
         
-        # Prepare grammar mistakes for frontend (list of [span, suggestion, original])
+        # Prepare grammar mistakes for frontend (list of [span, suggestion, original]);
+        # the i-th mistake line describes the i-th correction span. grammar_mistake_times holds
+        # the [start, end] seconds of each mistake in the video, so the UI can seek to it.
         grammar_mistakes = []
-        for line in mistakes_lines:
+        grammar_mistake_times = []
+        mistake_times = timestamped_punctuation.spans_to_times(original_spans, results["word_alignment"])
+        for line, (start, end), mistake_time in zip(mistakes_lines, correction_spans, mistake_times):
+            mistake_time = list(mistake_time) if mistake_time is not None else None
             if '"' in line and 'should be' in line:
                 try:
                     first_quote = line.find('"')
@@ -131,56 +244,138 @@ async def upload_video(file: UploadFile = File(...)):
                     fourth_quote = line.find('"', third_quote + 1)
                     correct_phrase = line[third_quote + 1:fourth_quote]
                     grammar_mistakes.append([[start, end], correct_phrase, incorrect_phrase])
+                    grammar_mistake_times.append(mistake_time)
                 except Exception:
                     continue
             else:
                 grammar_mistakes.append([[0, 0], line, line])
+                grammar_mistake_times.append(mistake_time)
         
         corrected_transcript_with_highlights = highlighted_text
 
-        # Analyze parts of speech
-        parts_of_speech_dict = parts_of_speech.parts_of_speech(full_text)
-        
-        # Calculate rate of speech points over time
-        rate_of_speech_points = rate_of_speech.get_rate_of_speech(timestamped_transcript_by_words)
-        
-        # Get volume (RMS) points over time
-        volume_points_list = read_volume.get_rms_per_segment(audio_path)
-        volume_points = {str(ts): float(rms) for ts, rms in volume_points_list}
-        
-        # Analyze custom tones (Grammarly-like, now using Sapling)
-        custom_tone_results = sapling.get_tone(full_text)
-
-        # Analyze hand positions
-        hand_position_results_dict = pose_tracking.analyze_hand_positions(file_path)
-        hand_position_results_text = pose_tracking.format_analysis_results(hand_position_results_dict)
+        hand_position_results_text = pose_tracking.format_analysis_results({**results["hand_positions"], "video_path": file_path})
+        hand_position_timeline = results["hand_positions"].get("timeline")
+        face_statistics = results["openface"]
+        if face_statistics is not None:
+            gaze_x, gaze_y = face_statistics["summary"]["gaze_angle_x"], face_statistics["summary"]["gaze_angle_y"]
+            aus_sum = face_statistics["all_aus_sum"]
+            face_details = {key: face_statistics[key] for key in ("frames", "frames_used", "percentiles", "windows")}
+        else:
+            gaze_x = gaze_y = aus_sum = face_details = None
+        volume_points, loudness_timeline = results["volume"]
+        tone_scores = results["tone"]
+        if not tone_scores:
+            logger.info("Sapling returned no tones, using the local tone analyzer")
+            tone_scores = tone_analyzer.get_tone(full_text)
 
-        # OpenFace analysis
-        gaze_x, gaze_y, aus_sum = openface.return_numbers(file_path)
-
-        # Return all analysis results as JSON
-        return JSONResponse(content={
+        # Return all analysis results as a JSON-serializable dict
+        return {
             "word_count": word_count,
-            "parts_of_speech": parts_of_speech_dict,
-            "rate_of_speech_points": rate_of_speech_points,
+            "parts_of_speech": results["parts_of_speech"],
+            "rate_of_speech_points": results["rate_of_speech"],
+            "speech_rate": results["speech_rate"],
+            "disfluencies": results["disfluencies"],
             "volume_points": volume_points,
-            "tone_scores": custom_tone_results,
-            "custom_tone_results": custom_tone_results,
+            "loudness_timeline": loudness_timeline,
+            "prosody": results["prosody"],
+            "tone_scores": tone_scores,
+            "custom_tone_results": tone_scores,
+            "tone_timeline": results["tone_timeline"],
             "transcript": full_text,
             "corrected_transcript": corrected_transcript_with_highlights, # Send the highlighted text
             "grammar_mistakes": grammar_mistakes,                       # Send parsed mistakes
+            "grammar_mistake_times": grammar_mistake_times,
             "hand_position_results": hand_position_results_text,
+            "hand_position_timeline": hand_position_timeline,
             "gaze_angle_x": gaze_x,
             "gaze_angle_y": gaze_y,
             "all_aus_sum": aus_sum,
-        })
+            "face_statistics": face_details,
+        }
     except Exception as e:
-        # Log the error for debugging purposes (consider using a proper logging library like 'logging')
         logger.error(f"Error processing video: {e}", exc_info=True)
-        return JSONResponse(status_code=500, content={"error": f"An error occurred during processing: {str(e)}"})
+        raise
     finally:
         # Clean up temporary files
+        audio_path = results.get("audio_extraction")
         if os.path.exists(file_path):
             os.remove(file_path)
-        if audio_path and os.path.exists(audio_path): # Ensure audio_path was successfully assigned before trying to remove
+        if isinstance(audio_path, str) and os.path.exists(audio_path): # Ensure audio_path was successfully assigned before trying to remove
             os.remove(audio_path)
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+# --- FastAPI Routes ---
+
+@app.post("/api/upload", status_code=202)
+async def upload_video(request: Request):
+    """
+    Streams a video upload (multipart form field "file") into its own job directory
+    and queues it for speech analysis. The optional form field "preset" picks the
+    transcription preset: "fast", "balanced" or "accurate" (default: WHISPER_PRESET).
+    Returns a job id; poll /api/jobs/{job_id} for progress and
+    /api/jobs/{job_id}/result for the analysis results.
+    """
+    logger.info("upload_video called")
+    try:
+        upload = await upload_ingest.ingest_upload(request)
+    except upload_ingest.UploadRejected as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+
+    preset = upload.fields.get("preset") or None
+    if preset is not None and preset not in speech_to_text.WHISPER_PRESETS:
+        upload.cleanup()
+        return JSONResponse(status_code=400, content={"error": f"Unknown preset '{preset}', expected one of {sorted(speech_to_text.WHISPER_PRESETS)}."})
+
+    try:
+        job = job_queue.submit(analyze_video, upload.path, upload.job_dir, preset, upload.sha256, filename=upload.filename)
+    except JobRejected as e:
+        upload.cleanup()
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    return JSONResponse(status_code=202, content=job.to_dict())
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Returns the status and per-stage progress of an analysis job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job: {job_id}"})
+    return JSONResponse(content=job.to_dict())
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    Returns the analysis results of a finished job. Responds with 202 and the
+    job status while the job is still queued or running.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job: {job_id}"})
+    if job.status == FAILED:
+        return JSONResponse(status_code=job.error_status_code, content={"error": job.error})
+    if job.status != DONE:
+        return JSONResponse(status_code=202, content=job.to_dict())
+    return JSONResponse(content=job.result)
+
+@app.get("/api/models")
+async def get_models():
+    """Returns load state, load time and resident memory per model."""
+    return JSONResponse(content=registry.stats())
+
+@app.get("/api/services")
+async def get_services():
+    """Returns the circuit breaker state of each external service."""
+    return JSONResponse(content=http_pool.stats())
+
+@app.on_event("startup")
+async def warm_up_models():
+    warmup_models = models_from_env("WARMUP_MODELS")
+    if warmup_models is None or warmup_models:
+        await run_in_threadpool(registry.warm_up, warmup_models)
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    job_queue.shutdown(wait=False)
+    pose_tracking.shutdown_pose_pool()
+    shutdown_process_pool()
+    http_pool.close()
@@ -0,0 +1,94 @@
+import numpy as np
+from typing import Optional, Union
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 16000
+
+
+class AudioBuffer:
+    """
+    Read-only mono float32 audio shared by all audio analyzers of a job.
+
+    The samples are decoded once; slicing returns views onto the same memory,
+    never copies, so any number of analyzers can read the buffer at no extra cost.
+    """
+
+    __slots__ = ("samples", "sample_rate", "offset_sec")
+
+    def __init__(self, samples: np.ndarray, sample_rate: int = DEFAULT_SAMPLE_RATE, offset_sec: float = 0.0):
+        """
+        Args:
+            samples: 1-D samples in [-1, 1]; converted to float32 only if needed
+            sample_rate: Sample rate in Hz
+            offset_sec: Position of the first sample in the original recording, for slices
+        """
+        samples = np.asarray(samples)
+        if samples.ndim != 1:
+            raise ValueError(f"AudioBuffer expects mono samples, got shape {samples.shape}")
+        if samples.dtype != np.float32:
+            samples = samples.astype(np.float32)
+        if samples.flags.writeable:
+            samples = samples.view()
+            samples.flags.writeable = False
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.offset_sec = offset_sec
+
+    @classmethod
+    def from_wav(cls, path: str) -> "AudioBuffer":
+        """Loads a WAV file, downmixing to mono and scaling integer PCM to [-1, 1]."""
+        from scipy.io import wavfile
+        sample_rate, data = wavfile.read(path)
+        if np.issubdtype(data.dtype, np.integer):
+            scale = float(np.iinfo(data.dtype).max) + 1
+            data = data.astype(np.float32) / scale
+        if data.ndim == 2:
+            data = data.mean(axis=1, dtype=np.float32)
+        return cls(data, sample_rate)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def __repr__(self):
+        return f"AudioBuffer({self.duration:.2f}s @ {self.sample_rate} Hz, offset {self.offset_sec:.2f}s)"
+
+    @property
+    def duration(self) -> float:
+        return len(self.samples) / self.sample_rate
+
+    def index_at(self, seconds: float) -> int:
+        """Sample index of a time relative to the start of this buffer, clamped to its bounds."""
+        return min(max(int(round(seconds * self.sample_rate)), 0), len(self.samples))
+
+    def slice(self, start_sec: float = 0.0, end_sec: Optional[float] = None) -> "AudioBuffer":
+        """Zero-copy view of [start_sec, end_sec) relative to the start of this buffer."""
+        start = self.index_at(start_sec)
+        end = len(self.samples) if end_sec is None else self.index_at(end_sec)
+        end = max(start, end)
+        return AudioBuffer(self.samples[start:end], self.sample_rate, self.offset_sec + start / self.sample_rate)
+
+
+AudioSource = Union[str, np.ndarray, AudioBuffer]
+
+
+def as_audio_buffer(audio: AudioSource, sample_rate: int = DEFAULT_SAMPLE_RATE) -> AudioBuffer:
+    """Accepts an AudioBuffer, raw mono samples at sample_rate, or a WAV path."""
+    if isinstance(audio, AudioBuffer):
+        return audio
+    if isinstance(audio, str):
+        logger.info(f"Loading {audio} into an AudioBuffer")
+        return AudioBuffer.from_wav(audio)
+    return AudioBuffer(audio, sample_rate)
+
+
+def describe(audio: AudioSource) -> str:
+    """Short description of an audio source for log messages."""
+    return audio if isinstance(audio, str) else repr(as_audio_buffer(audio))
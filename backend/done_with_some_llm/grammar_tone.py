@@ -1,7 +1,15 @@
-import requests
 import os
-import json
+import re
+import string
+import difflib
+import importlib.util
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import httpx
+from http_client import ServiceConfig, ServiceUnavailable, http_pool
+from model_registry import registry
+from result_cache import make_key, result_cache
 # import rotateapikeys
 
 # 2. assess the text on scale from 1 to 10 for the following categories: confident, assertive, inspirational, informative, direct.
@@ -20,11 +28,49 @@ logger.info(f"OR_API_KEY: {'Set' if API_KEY else 'Not set'}")
 # almaz = "meta-llama/llama-4-maverick:free"
 almaz = "deepseek/deepseek-chat-v3-0324:free"
 
+# "openrouter", "gramformer" (local, offline), "none", or "auto": OpenRouter when OR_API_KEY is set,
+# else Gramformer when it is installed
+GRAMMAR_BACKEND = os.getenv("GRAMMAR_BACKEND", "auto")
+GRAMFORMER_BATCH_SIZE = int(os.getenv("GRAMFORMER_BATCH_SIZE", "8"))
+GRAMFORMER_WORKERS = int(os.getenv("GRAMFORMER_WORKERS", "2"))
+GRAMFORMER_BEAMS = int(os.getenv("GRAMFORMER_BEAMS", "4"))
+# Longer sentences would be truncated by the model, so they are passed through unchecked
+GRAMFORMER_MAX_TOKENS = 128
+# OpenRouter gets sentence-bounded chunks of at most this many characters, GRAMMAR_WORKERS at a time
+GRAMMAR_CHUNK_CHARS = int(os.getenv("GRAMMAR_CHUNK_CHARS", "1200"))
+GRAMMAR_WORKERS = int(os.getenv("GRAMMAR_WORKERS", "4"))
+
+# (mistakes_lines, corrected_text, correction_spans); spans are [start, end) in corrected_text
+GrammarResult = Tuple[List[str], str, List[Tuple[int, int]]]
+
+
+class Edit(NamedTuple):
+    """Replace text[start:end] with replacement."""
+    start: int
+    end: int
+    replacement: str
+
+
+class Corrections(NamedTuple):
+    """Edits applied to a text; the i-th line, span and original span describe the same correction."""
+    mistakes_lines: List[str]
+    corrected_text: str
+    correction_spans: List[Tuple[int, int]]  # in corrected_text
+    original_spans: List[Tuple[int, int]]    # in the checked text
+
+
+
+def _mock_completion(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={"choices": [{"message": {"content": "No corrections needed"}}]})
+
+
+openrouter_service = http_pool.register(ServiceConfig("openrouter", "https://openrouter.ai/api/v1", timeout_sec=30.,
+                                                      max_concurrency=GRAMMAR_WORKERS, mock=_mock_completion))
+
 def fix_grammar(prompt, model=almaz):
     if not API_KEY:
         return None
         
-    url = "https://openrouter.ai/api/v1/chat/completions"
     headers = {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json"
@@ -41,9 +87,7 @@ IMPORTANT: You must provide the actual corrections, not just a header. For each
     - Format it as: "<incorrect_phrase> should be <correct_phrase>"
     - List each correction on a new line
     - If no mistakes are found, say "No corrections needed"
-    - Only output the corrected mistakes and the corrected text.
-
-After You listed all the mistakes, output the corrected text itself.
+    - Only output the corrected mistakes.
 
 
 Example output:
@@ -56,51 +100,27 @@ Example output:
         "max_tokens": 500
     }
 
-    response = requests.post(url, headers=headers, json=payload, timeout=30)
-    logger.info(f"Raw response text from OpenRouter: {response.text}")
+    # Raises ServiceUnavailable once retries are exhausted or while OpenRouter's circuit is open,
+    # and KeyError, IndexError or TypeError if the answer has no message content
+    data = openrouter_service.post_json("/chat/completions", headers=headers, json=payload)
+    logger.info(f"Raw response from OpenRouter: {data}")
     
-    data = response.json()
     content = data["choices"][0]["message"]["content"]
+    if not isinstance(content, str):
+        raise TypeError(f"OpenRouter message content is {type(content).__name__}, not str")
     return content
 
 
-def get_mistakes_and_text(text_to_check):
-    if not API_KEY:
-        return [], text_to_check, []
-    
-    # EDIT!
-    corrected_unparsed = fix_grammar(text_to_check)
-    
-    corrected_unparsed = corrected_unparsed.strip()
 
-    # corrected_unparsed = "\"despite this being a math -weighted technical major\" should be \"despite this being a math-heavy technical major\"\n\"it's called Nostrum of the Underground and it tells about Nostrum of the Underground\" should be \"it's called Notes from the Underground and it's about the Underground Man\"\n\nCorrected text:\nHello, my major is software engineering but despite this being a math-heavy technical major, I love reading. I have a lot of books right over here and my favorite author is Fyodor Dostoevsky. It's a very dark Russian author and here's a really nice book from him. Why I really like this book? It's called Notes from the Underground and it's about the Underground Man."
-    
-    mistakes_lines = []
-    corrected_text = text_to_check
-
-    lines = corrected_unparsed.splitlines()
-    correction_spans = []
-    
-    # Find where the corrected text starts
-    corrected_text_start_idx = -1
-    for i, line in enumerate(lines):
-        line_lower = line.strip().lower()
-        if line_lower.startswith("corrected text:") or line_lower == "corrected text":
-            corrected_text_start_idx = i
-            break
-    
-    # Process only the correction lines (before "Corrected text:")
-    lines_to_process = lines[:corrected_text_start_idx] if corrected_text_start_idx != -1 else lines
-    
-    for line in lines_to_process:
+def parse_correction_lines(corrected_unparsed) -> List[Tuple[str, str]]:
+    """(incorrect_phrase, correct_phrase) for every '"x" should be "y"' line of an LLM answer."""
+    pairs = []
+    for line in corrected_unparsed.strip().splitlines():
         line = line.strip()
-        if not line:
-            continue
-            
-        # Only add lines that contain actual corrections
+        if line.lower().startswith("corrected text"):
+            break  # older prompts made the model append the whole corrected text
+        # Only lines that contain actual corrections
         if '"' in line and "should be" in line:
-            mistakes_lines.append(line)
-            
             first_quote = line.find('"')
             second_quote = line.find('"', first_quote + 1)
             incorrect_phrase = line[first_quote + 1:second_quote]
@@ -109,25 +129,291 @@ def get_mistakes_and_text(text_to_check):
             third_quote = line.find('"', should_be_idx)
             fourth_quote = line.find('"', third_quote + 1)
             correct_phrase = line[third_quote + 1:fourth_quote]
+            if incorrect_phrase and third_quote != -1 and fourth_quote != -1:
+                pairs.append((incorrect_phrase, correct_phrase))
+    return pairs
 
-            # Find the first occurrence of incorrect_phrase in corrected_text
-            idx = corrected_text.find(incorrect_phrase)
-            if idx != -1:
-                # Record the span as (start_index, end_index) in the original string
-                # The end_index is exclusive
-                correction_spans.append((idx, idx + len(correct_phrase)))
-                # Replace only the first occurrence in corrected_text
-                corrected_text = corrected_text[:idx] + correct_phrase + corrected_text[idx + len(incorrect_phrase):]
-    
-    # Extract the actual corrected text if it exists
-    if corrected_text_start_idx != -1 and corrected_text_start_idx + 1 < len(lines):
-        # Get all lines after "Corrected text:" and join them
-        actual_corrected_text_lines = lines[corrected_text_start_idx + 1:]
-        actual_corrected_text = '\n'.join(actual_corrected_text_lines).strip()
-        if actual_corrected_text:
-            corrected_text = actual_corrected_text
-
-    return mistakes_lines, corrected_text, correction_spans
+
+def apply_edits(text: str, edits: List[Edit]) -> Corrections:
+    """
+    Applies edits to text in one left-to-right pass. Overlapping edits are dropped (the
+    earliest wins), so every span is valid against both the original and the corrected text.
+    """
+    mistakes_lines, correction_spans, original_spans, pieces = [], [], [], []
+    position = 0  # next unconsumed character of text
+    shift = 0     # len(corrected so far) - position: maps original offsets to corrected ones
+    for edit in sorted(edits):
+        if edit.start < position or edit.end > len(text) or text[edit.start:edit.end] == edit.replacement:
+            continue
+        pieces.append(text[position:edit.start])
+        pieces.append(edit.replacement)
+        start = edit.start + shift
+        correction_spans.append((start, start + len(edit.replacement)))
+        original_spans.append((edit.start, edit.end))
+        mistakes_lines.append(f'"{text[edit.start:edit.end]}" should be "{edit.replacement}"')
+        shift += len(edit.replacement) - (edit.end - edit.start)
+        position = edit.end
+    pieces.append(text[position:])
+    return Corrections(mistakes_lines, "".join(pieces), correction_spans, original_spans)
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """[start, end) of each sentence: text up to a run of . ! ? followed by whitespace or the end."""
+    return [match.span() for match in re.finditer(r'\S.*?(?:[.!?]+(?=\s)|$)', text, re.DOTALL)]
+
+
+def _words_only(phrase: str) -> str:
+    return phrase.translate(str.maketrans("", "", string.punctuation)).lower()
+
+
+def diff_sentence(original: str, corrected: str) -> List[Edit]:
+    """
+    Word-level edits that turn original into corrected, with offsets into original.
+
+    Changes that only touch punctuation or case are ignored, like in the OpenRouter prompt.
+    Insertions and deletions are widened by one neighbouring word so neither phrase is empty.
+    """
+    word_spans = [match.span() for match in re.finditer(r'\S+', original)]
+    a = [original[start:end] for start, end in word_spans]
+    b = corrected.split()
+    if not a:
+        return []
+    edits = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(a=a, b=b, autojunk=False).get_opcodes():
+        if tag == "equal" or _words_only(" ".join(a[i1:i2])) == _words_only(" ".join(b[j1:j2])):
+            continue
+        correct = b[j1:j2]
+        if i1 == i2 or j1 == j2:
+            # the neighbouring word is unchanged, so it is kept as written in the original
+            if i1 > 0:
+                i1 -= 1
+                correct = [a[i1]] + correct
+            elif i2 < len(a):
+                correct = correct + [a[i2]]
+                i2 += 1
+        edits.append(Edit(word_spans[i1][0], word_spans[i2 - 1][1], " ".join(correct)))
+    return edits
+
+
+def locate_pairs(text: str, pairs: List[Tuple[str, str]]) -> List[Edit]:
+    """
+    Finds each (incorrect, correct) pair in text. The model lists corrections in reading order,
+    so each phrase is looked up after the previous match first, then anywhere in the text.
+    """
+    edits = []
+    cursor = 0
+    for incorrect, correct in pairs:
+        index = text.find(incorrect, cursor)
+        if index == -1:
+            index = text.find(incorrect)
+        if index == -1:
+            logger.info(f"Correction not found in the checked text: {incorrect!r}")
+            continue
+        edits.append(Edit(index, index + len(incorrect), correct))
+        cursor = index + len(incorrect)
+    return edits
+
+
+class GrammarBackend:
+    """
+    A grammar checker.
+
+    check() splits the text into sentences and looks each one up in the result cache under
+    the backend's cache_tag. Only the missing sentences go to sentence_edits(), so an edit to
+    one sentence of a transcript rechecks only that sentence. The edits of all sentences are
+    then applied in one pass (apply_edits). This base backend finds no mistakes.
+    """
+    name = "none"
+
+    def available(self) -> bool:
+        return True
+
+    @property
+    def cache_tag(self) -> str:
+        return self.name
+
+    def sentence_edits(self, sentences: List[str]) -> List[Optional[List[Edit]]]:
+        """Edits per sentence, with offsets into that sentence; None if the sentence could not be checked."""
+        return [[] for _ in sentences]
+
+    def correct(self, text: str, sentences: Optional[List[Tuple[int, int]]] = None) -> Corrections:
+        """sentences: [start, end) spans of the text's sentences, e.g. NlpDocument.sentences; split with a regex if not given."""
+        spans = sentences if sentences is not None else split_sentences(text)
+        sentences = [text[start:end] for start, end in spans]
+        keys = [make_key("grammar", self.cache_tag, sentence) for sentence in sentences]
+        found: Dict[int, List[Edit]] = {}
+        if result_cache is not None:
+            for index, key in enumerate(keys):
+                edits = result_cache.get(key)
+                if edits is not None:
+                    found[index] = [Edit(*edit) for edit in edits]
+        missing = [index for index in range(len(sentences)) if index not in found]
+        if missing:
+            logger.info(f"Checking {len(missing)} of {len(sentences)} sentences with {self.name}")
+            for index, edits in zip(missing, self.sentence_edits([sentences[index] for index in missing])):
+                # Unchecked sentences count as correct this time and are retried next time
+                found[index] = edits or []
+                if result_cache is not None and edits is not None:
+                    result_cache.put(keys[index], [tuple(edit) for edit in edits])
+
+        edits = [
+            Edit(edit.start + start, edit.end + start, edit.replacement)
+            for index, (start, _) in enumerate(spans) for edit in found[index]
+        ]
+        return apply_edits(text, edits)
+
+    def check(self, text: str, sentences: Optional[List[Tuple[int, int]]] = None) -> GrammarResult:
+        mistakes_lines, corrected_text, correction_spans, _ = self.correct(text, sentences)
+        return mistakes_lines, corrected_text, correction_spans
+
+
+class OpenRouterBackend(GrammarBackend):
+    """
+    Sends sentence-bounded chunks of at most GRAMMAR_CHUNK_CHARS characters to an LLM on
+    OpenRouter (see fix_grammar), GRAMMAR_WORKERS at a time over the shared HTTP pool, so long
+    speeches never run into the answer's token limit. Chunks that fail after the pool's retries,
+    while OpenRouter's circuit is open, or whose answer is malformed, are left unchecked.
+    """
+    name = "openrouter"
+
+    def __init__(self, model=almaz, chunk_chars=GRAMMAR_CHUNK_CHARS, workers=GRAMMAR_WORKERS):
+        self.model = model
+        self.chunk_chars = chunk_chars
+        self.workers = workers
+
+    def available(self) -> bool:
+        return bool(API_KEY)
+
+    @property
+    def cache_tag(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    def sentence_edits(self, sentences: List[str]) -> List[Optional[List[Edit]]]:
+        if not API_KEY:
+            return super().sentence_edits(sentences)
+        # Pack consecutive sentences into chunks, remembering where each one starts in its chunk
+        chunks: List[List[int]] = []
+        length = 0
+        for index, sentence in enumerate(sentences):
+            if chunks and length + 1 + len(sentence) <= self.chunk_chars:
+                chunks[-1].append(index)
+                length += 1 + len(sentence)
+            else:
+                chunks.append([index])
+                length = len(sentence)
+
+        def check_chunk(members):
+            chunk = " ".join(sentences[index] for index in members)
+            try:
+                return chunk, locate_pairs(chunk, parse_correction_lines(fix_grammar(chunk, self.model)))
+            except ServiceUnavailable as e:
+                logger.error(f"Grammar check of {len(members)} sentences failed: {e}")
+                return chunk, None
+            except (KeyError, IndexError, TypeError) as e:
+                logger.error(f"Grammar check of {len(members)} sentences got a malformed answer: {e!r}")
+                return chunk, None
+
+        result: List[Optional[List[Edit]]] = [None for _ in sentences]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(chunks))), thread_name_prefix="grammar") as pool:
+            for members, (chunk, edits) in zip(chunks, pool.map(check_chunk, chunks)):
+                if edits is None:
+                    continue
+                start = 0
+                for index in members:
+                    end = start + len(sentences[index])
+                    # Edits crossing a sentence boundary are dropped
+                    result[index] = [Edit(edit.start - start, edit.end - start, edit.replacement)
+                                     for edit in edits if start <= edit.start and edit.end <= end]
+                    start = end + 1
+        return result
+
+
+def _load_gramformer():
+    from gramformer import Gramformer
+    gramformer = Gramformer(models=1, use_gpu=False)  # 1: the corrector only
+    gramformer.correction_model.eval()
+    return gramformer
+
+
+# Gramformer is optional (it is not in requirements.txt), so it is only registered, and only
+# loaded by PRELOAD_MODELS/WARMUP_MODELS=all, where it is installed
+if importlib.util.find_spec("gramformer") is not None:
+    registry.register("gramformer", _load_gramformer)
+
+
+class GramformerBackend(GrammarBackend):
+    """
+    Local seq2seq corrector (Gramformer's T5 model) on the CPU.
+
+    Sentences are corrected in batches of GRAMFORMER_BATCH_SIZE with deterministic beam search;
+    GRAMFORMER_WORKERS batches run at once (torch releases the GIL during generation). Latency
+    grows with the number of sentences, not with the network.
+    """
+    name = "gramformer"
+
+    def __init__(self, batch_size=GRAMFORMER_BATCH_SIZE, workers=GRAMFORMER_WORKERS, beams=GRAMFORMER_BEAMS):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.beams = beams
+
+    def available(self) -> bool:
+        return importlib.util.find_spec("gramformer") is not None
+
+    @property
+    def cache_tag(self) -> str:
+        return f"{self.name}:beams={self.beams}"
+
+    def correct_sentences(self, sentences: List[str]) -> List[str]:
+        if not sentences:
+            return []
+        import torch
+        gramformer = registry.get("gramformer")
+        tokenizer, model = gramformer.correction_tokenizer, gramformer.correction_model
+
+        def correct_batch(batch):
+            inputs = tokenizer(["gec: " + sentence for sentence in batch], return_tensors="pt",
+                               padding=True, truncation=True, max_length=GRAMFORMER_MAX_TOKENS)
+            with torch.inference_mode():
+                outputs = model.generate(**inputs, max_length=GRAMFORMER_MAX_TOKENS, num_beams=self.beams,
+                                         do_sample=False, early_stopping=True)
+            corrected = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            too_long = inputs["attention_mask"].sum(dim=1) >= GRAMFORMER_MAX_TOKENS
+            return [original if truncated else fixed.strip()
+                    for original, fixed, truncated in zip(batch, corrected, too_long.tolist())]
+
+        batches = [sentences[i:i + self.batch_size] for i in range(0, len(sentences), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(batches))), thread_name_prefix="gramformer") as pool:
+            return [sentence for batch in pool.map(correct_batch, batches) for sentence in batch]
+
+    def sentence_edits(self, sentences: List[str]) -> List[List[Edit]]:
+        return [diff_sentence(original, fixed) for original, fixed in zip(sentences, self.correct_sentences(sentences))]
+
+
+BACKENDS = {backend.name: backend for backend in (GrammarBackend(), OpenRouterBackend(), GramformerBackend())}
+
+
+def get_backend(name: Optional[str] = None) -> GrammarBackend:
+    name = name or GRAMMAR_BACKEND
+    if name == "auto":
+        for candidate in ("openrouter", "gramformer"):
+            if BACKENDS[candidate].available():
+                return BACKENDS[candidate]
+        return BACKENDS["none"]
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown grammar backend '{name}', expected auto or one of {sorted(BACKENDS)}")
+    return BACKENDS[name]
+
+
+def get_mistakes_and_text(text_to_check, backend: Optional[str] = None,
+                          sentences: Optional[List[Tuple[int, int]]] = None) -> GrammarResult:
+    """Checks grammar with the given backend (GRAMMAR_BACKEND by default), sentence by sentence."""
+    return get_backend(backend).check(text_to_check, sentences)
+
+
+def get_corrections(text_to_check, backend: Optional[str] = None,
+                    sentences: Optional[List[Tuple[int, int]]] = None) -> Corrections:
+    """Like get_mistakes_and_text, but also returns where each correction is in the checked text."""
+    return get_backend(backend).correct(text_to_check, sentences)
 
 # t = "Hey! So yesterday I go to tashkent metro and it would be wonderful beautiful. The new trainers there are shiny and fast. And they also install new escavators - that's good because I don't need to climb the stairs anymore. it used to bee really tiring"
 
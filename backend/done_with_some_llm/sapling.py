@@ -1,6 +1,7 @@
-import requests
 import os
 import logging
+import httpx
+from http_client import ServiceConfig, ServiceUnavailable, http_pool
 
 logging.basicConfig(
     level=logging.INFO,
@@ -10,22 +11,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-key = os.getenv("SAPLING_KEY")
-key="015DQLX8TMB98ZT4L39YZT1Y735MOGOG"
+key = os.getenv("SAPLING_KEY", "015DQLX8TMB98ZT4L39YZT1Y735MOGOG")
+
+
+def _mock_tone(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={"overall": [[0.5, "neutral", "😐"]], "sentences": []})
+
+
+sapling_service = http_pool.register(ServiceConfig("sapling", "https://api.sapling.ai/api/v1",
+                                                   timeout_sec=10., max_concurrency=4, mock=_mock_tone))
 
 def get_tone(text: str) -> list:
     logger.info("get_tone called")
     try:
-        response = requests.post(
-            "https://api.sapling.ai/api/v1/tone",
-            json={
-                "key": key,
-                "text": text
-            }
-        )
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-
-        data = response.json()
+        # Retries, timeouts and the circuit breaker are handled by the pool
+        data = sapling_service.post_json("/tone", json={
+            "key": key,
+            "text": text
+        })
         logger.debug(f"Response from Sapling: {data}")
 
         oval = data.get("overall", []) # Safely get 'overall', default to empty list
@@ -35,8 +38,8 @@ def get_tone(text: str) -> list:
         logger.info("Successfully retrieved tone from Sapling.")
         return oval
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error calling Sapling API: {e}", exc_info=True)
+    except ServiceUnavailable as e:
+        logger.error(f"Error calling Sapling API: {e}")
         return [] # Return empty list on network/HTTP error
     except Exception as e:
         logger.error(f"An unexpected error occurred in get_tone: {e}", exc_info=True)
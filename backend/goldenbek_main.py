@@ -8,7 +8,6 @@ from predict_flaws import floss
 from timestamped_punctuation import timestamp_punctuation_to_index
 import video_to_vaw
 import speech_to_text
-import nltk
 import parts_of_speech
 import read_volume
 import rate_of_speech
@@ -20,13 +19,6 @@ import os
 import sys
 # from custom_types import TimeStamp
 
-# Download required NLTK data
-
-nltk.download('punkt')
-nltk.download('averaged_perceptron_tagger')
-nltk.download('universal_tagset')
-nltk.download('averaged_perceptron_tagger_eng')
-
 # Sample text for tone analysis (now with real sentence boundaries)
 sample_text = """
 Hey there! So, I just wanted to get this off my chest because, honestly, it's been bugging me for a while now. You know how sometimes things just don't go your way, no matter how hard you try? Well, that's pretty much been my week in a nutshell. I mean, I tried to stay positive, but wow, it's like the universe had other plans. 
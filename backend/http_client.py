@@ -0,0 +1,229 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import logging
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+# "1" answers every request from the services' mock handlers instead of the network
+HTTP_MOCK = os.getenv("HTTP_MOCK", "0") == "1"
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ServiceUnavailable(Exception):
+    """Raised when an external service fails after all retries or its circuit is open."""
+
+
+def _env(service: str, setting: str, default: str) -> str:
+    return os.getenv(f"{service.upper()}_{setting}", default)
+
+
+class ServiceConfig:
+    """
+    Connection settings of one external service. Every setting can be overridden with
+    <NAME>_<SETTING> environment variables, e.g. SAPLING_TIMEOUT_SEC or SAPLING_URL (which
+    also lets tests point a service at a local mock server).
+    """
+
+    def __init__(self, name: str, base_url: str, timeout_sec: float = 30., retries: int = 2,
+                 backoff_sec: float = 0.5, max_concurrency: int = 4, failure_threshold: int = 5,
+                 reset_after_sec: float = 30., mock: Optional[Callable[[httpx.Request], httpx.Response]] = None):
+        self.name = name
+        self.base_url = _env(name, "URL", base_url)
+        self.timeout_sec = float(_env(name, "TIMEOUT_SEC", str(timeout_sec)))
+        self.retries = int(_env(name, "RETRIES", str(retries)))
+        self.backoff_sec = float(_env(name, "BACKOFF_SEC", str(backoff_sec)))
+        self.max_concurrency = int(_env(name, "MAX_CONCURRENCY", str(max_concurrency)))
+        self.failure_threshold = int(_env(name, "FAILURE_THRESHOLD", str(failure_threshold)))
+        self.reset_after_sec = float(_env(name, "RESET_AFTER_SEC", str(reset_after_sec)))
+        self.mock = mock
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures; while open, calls fail immediately.
+    After reset_after_sec one trial call is let through (half-open): success closes the
+    circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_after_sec: float):
+        self.failure_threshold = failure_threshold
+        self.reset_after_sec = reset_after_sec
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after_sec:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class ServiceClient:
+    """Async JSON calls to one service with a timeout, bounded retries, a concurrency limit and a circuit breaker."""
+
+    def __init__(self, config: ServiceConfig, pool: "HttpPool"):
+        self.config = config
+        self.pool = pool
+        self.breaker = CircuitBreaker(config.failure_threshold, config.reset_after_sec)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def request_json(self, method: str, path: str = "", **kwargs) -> Any:
+        """Awaitable from any event loop; the request itself runs on the pool's loop."""
+        return await asyncio.wrap_future(self.pool.submit(self._request_json(method, path, **kwargs)))
+
+    def post_json(self, path: str = "", **kwargs) -> Any:
+        """Blocking POST for code running in worker threads (analysis stages)."""
+        return self.pool.run(self._request_json("POST", path, **kwargs))
+
+    async def _request_json(self, method: str, path: str, **kwargs) -> Any:
+        config = self.config
+        if not self.breaker.allow():
+            raise ServiceUnavailable(f"{config.name} circuit is open")
+        last_error: Optional[Exception] = None
+        succeeded = False
+        try:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(config.max_concurrency)
+            client = self.pool.client(config)
+            async with self._semaphore:
+                for attempt in range(config.retries + 1):
+                    if attempt:
+                        # Exponential backoff with jitter, so retries of concurrent calls spread out
+                        await asyncio.sleep(config.backoff_sec * 2 ** (attempt - 1) * (0.5 + random.random()))
+                    try:
+                        response = await client.request(method, config.base_url + path,
+                                                        timeout=config.timeout_sec, **kwargs)
+                        if response.status_code in RETRY_STATUS_CODES:
+                            last_error = ServiceUnavailable(f"{config.name} answered {response.status_code}")
+                            continue
+                        response.raise_for_status()
+                        data = response.json()
+                    except (httpx.HTTPError, ValueError) as e:
+                        last_error = e
+                        if isinstance(e, httpx.HTTPStatusError):
+                            break  # other 4xx answers will not change on a retry
+                        continue
+                    succeeded = True
+                    return data
+            raise ServiceUnavailable(f"{config.name} request failed: {last_error}") from last_error
+        finally:
+            # Every way out records an outcome, so a half-open trial can never stay taken
+            if succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+                logger.warning(f"{config.name} request failed ({self.breaker.state} circuit): {last_error}")
+
+
+class HttpPool:
+    """
+    Pooled httpx.AsyncClient connections for all external services.
+
+    The client lives on an event loop in a background thread: async code awaits
+    ServiceClient.request_json, and the analysis stages, which run in worker threads,
+    call post_json. Either way the request runs on that loop. Waiting on a slow service then
+    ties up neither the server's event loop nor more connections than the limits allow.
+    """
+
+    def __init__(self, max_connections: int = HTTP_MAX_CONNECTIONS, mock: bool = HTTP_MOCK):
+        self.max_connections = max_connections
+        self.mock = mock
+        self.services: Dict[str, ServiceClient] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def register(self, config: ServiceConfig) -> ServiceClient:
+        with self._lock:
+            service = self.services[config.name] = ServiceClient(config, self)
+            return service
+
+    def service(self, name: str) -> ServiceClient:
+        return self.services[name]
+
+    def client(self, config: ServiceConfig) -> httpx.AsyncClient:
+        # One client normally; in mock mode each service gets a client bound to its mock handler
+        key = config.name if self.mock else "shared"
+        if key not in self._clients:
+            if self.mock:
+                if config.mock is None:
+                    raise ServiceUnavailable(f"{config.name} has no mock handler")
+                self._clients[key] = httpx.AsyncClient(transport=httpx.MockTransport(config.mock))
+            else:
+                self._clients[key] = httpx.AsyncClient(limits=httpx.Limits(
+                    max_connections=self.max_connections, max_keepalive_connections=self.max_connections))
+        return self._clients[key]
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="http-pool", daemon=True).start()
+            return self._loop
+
+    def submit(self, coroutine):
+        """Schedules a coroutine on the pool's loop and returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop())
+
+    def run(self, coroutine) -> Any:
+        if threading.current_thread().name == "http-pool":
+            raise RuntimeError("HttpPool.run would block its own event loop; await the coroutine instead")
+        return self.submit(coroutine).result()
+
+    def close(self) -> None:
+        if self._loop is None:
+            return
+
+        async def close_clients():
+            for client in self._clients.values():
+                await client.aclose()
+            self._clients.clear()
+        asyncio.run_coroutine_threadsafe(close_clients(), self._loop).result()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: {"circuit": service.breaker.state, "failures": service.breaker.failures}
+                for name, service in self.services.items()}
+
+
+http_pool = HttpPool()
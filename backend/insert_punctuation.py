@@ -1,5 +1,7 @@
-from deepmultilingualpunctuation import PunctuationModel
+from typing import List, Optional, Tuple
+from model_registry import registry
 import logging
+import os
 
 logging.basicConfig(
     level=logging.INFO,
@@ -9,12 +11,116 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-model = PunctuationModel()
+# "windowed": overlapping windows punctuated in batches; "legacy": PunctuationModel.restore_punctuation
+PUNCTUATION_MODE = os.getenv("PUNCTUATION_MODE", "windowed")
+# Words per window (the model reads at most 512 sub-word tokens) and words shared by neighbouring windows
+PUNCTUATION_WINDOW_WORDS = int(os.getenv("PUNCTUATION_WINDOW_WORDS", "200"))
+PUNCTUATION_OVERLAP_WORDS = int(os.getenv("PUNCTUATION_OVERLAP_WORDS", "40"))
+PUNCTUATION_BATCH_SIZE = int(os.getenv("PUNCTUATION_BATCH_SIZE", "8"))
+# Threads torch uses for inference in this process; 0 keeps torch's default (all cores)
+PUNCTUATION_TORCH_THREADS = int(os.getenv("PUNCTUATION_TORCH_THREADS", "0"))
 
-def get_punctuated_text(unpunctuated_text: str) -> str:
+Window = Tuple[int, int]  # [start, end) word indices
+
+
+def _load_punctuation_model():
+    if PUNCTUATION_TORCH_THREADS:
+        import torch
+        torch.set_num_threads(PUNCTUATION_TORCH_THREADS)
+    from deepmultilingualpunctuation import PunctuationModel
+    return PunctuationModel()
+
+registry.register("punctuation", _load_punctuation_model)
+
+
+def plan_windows(n_words: int, window: int = PUNCTUATION_WINDOW_WORDS, overlap: int = PUNCTUATION_OVERLAP_WORDS) -> List[Window]:
+    """
+    Windows of `window` words starting every window - overlap words. The last window is cut
+    at the end of the text, and a window that would only repeat the previous one's overlap is
+    left out.
+    """
+    stride = window - overlap
+    if stride <= 0:
+        raise ValueError(f"Window ({window} words) must be longer than the overlap ({overlap} words)")
+    windows = []
+    start = 0
+    while start == 0 or start + overlap < n_words:
+        windows.append((start, min(start + window, n_words)))
+        start += stride
+    return windows
+
+
+def _window_owner_bounds(windows: List[Window]) -> List[Window]:
+    """
+    Words each window decides the punctuation of: overlaps are split in the middle, so every
+    word is labelled by the window in which it has the most context on both sides. The split
+    only depends on the windows, which makes merging deterministic.
+    """
+    bounds = []
+    for index, (start, end) in enumerate(windows):
+        own_start = start if index == 0 else (start + windows[index - 1][1]) // 2
+        own_end = end if index == len(windows) - 1 else (windows[index + 1][0] + end) // 2
+        bounds.append((own_start, own_end))
+    return bounds
+
+
+def _tag_window(words: List[str], result: List[dict]) -> List[Tuple[str, float]]:
+    """(label, score) per word from the token-level pipeline output, as PunctuationModel.predict does it."""
+    tags = []
+    char_index = 0
+    result_index = 0
+    for word in words:
+        char_index += len(word) + 1
+        # if any sub-token of a word is labelled as a sentence end, the whole word is
+        label, score = "0", 0.0
+        while result_index < len(result) and char_index > result[result_index]["end"]:
+            label = result[result_index]["entity"]
+            score = result[result_index]["score"]
+            result_index += 1
+        tags.append((label, score))
+    return tags
+
+
+def _run_windows(model, words: List[str], windows: List[Window], batch_size: int) -> List[List[Tuple[str, float]]]:
+    """Punctuation tags of each window, running the windows through the model batch_size at a time."""
+    texts = [" ".join(words[start:end]) for start, end in windows]
+    results = model.pipe(texts, batch_size=batch_size)
+    tags = []
+    for (start, end), text, result in zip(windows, texts, results):
+        if result and result[-1]["end"] != len(text):
+            logger.warning(f"Punctuation window {start}-{end} was clipped by the model; lower PUNCTUATION_WINDOW_WORDS")
+        tags.append(_tag_window(words[start:end], result))
+    return tags
+
+
+def _merge(words: List[str], windows: List[Window], tags: List[List[Tuple[str, float]]]) -> List[list]:
+    merged = []
+    for (start, _), (own_start, own_end), window_tags in zip(windows, _window_owner_bounds(windows), tags):
+        for index in range(own_start, own_end):
+            label, score = window_tags[index - start]
+            merged.append([words[index], label, score])
+    return merged
+
+
+def punctuate_words(words: List[str], window: int = PUNCTUATION_WINDOW_WORDS, overlap: int = PUNCTUATION_OVERLAP_WORDS,
+                    batch_size: int = PUNCTUATION_BATCH_SIZE) -> str:
+    """Punctuates a list of words (already stripped of punctuation) with overlapping, batched windows."""
+    if not words:
+        return ""
+    model = registry.get("punctuation")
+    windows = plan_windows(len(words), window, overlap)
+    tags = _run_windows(model, words, windows, batch_size)
+    return model.prediction_to_text(_merge(words, windows, tags))
+
+
+def get_punctuated_text(unpunctuated_text: str, mode: Optional[str] = None) -> str:
     logger.info("get_punctuated_text called")
     try:
-        result = model.restore_punctuation(unpunctuated_text)
+        model = registry.get("punctuation")
+        if (mode or PUNCTUATION_MODE) == "legacy":
+            result = model.restore_punctuation(unpunctuated_text)
+        else:
+            result = punctuate_words(model.preprocess(unpunctuated_text))
         logger.info("Successfully punctuated text.")
         return result
     except Exception as e:
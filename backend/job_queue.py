@@ -0,0 +1,157 @@
+import os
+import time
+import uuid
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+# Job lifecycle states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Stage lifecycle states (reported per stage in Job.stages)
+STAGE_PENDING = "pending"
+STAGE_RUNNING = "running"
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+STAGE_CACHED = "cached"    # loaded from the result cache
+STAGE_SKIPPED = "skipped"  # not needed, everything depending on it was cached
+
+
+class JobRejected(Exception):
+    """Raised when the queue is full and a new job cannot be accepted."""
+
+
+class JobFailed(Exception):
+    """Raised by a job function to fail the job with a client-facing message and status code."""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Job:
+    """State of a single queued analysis: status, per-stage progress and the final result."""
+
+    def __init__(self, job_id: str, filename: Optional[str] = None):
+        self.id = job_id
+        self.filename = filename
+        self.status = QUEUED
+        self.stages: Dict[str, str] = {}
+        self.stage_timings: Dict[str, float] = {}
+        self.result: Optional[Any] = None
+        self.error: Optional[str] = None
+        self.error_status_code = 500
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage: str, state: str, elapsed: Optional[float] = None) -> None:
+        with self._lock:
+            self.stages[stage] = state
+            if elapsed is not None:
+                self.stage_timings[stage] = round(elapsed, 3)
+        logger.info(f"Job {self.id}: stage '{stage}' {state}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = dict(self.stages)
+            stage_timings = dict(self.stage_timings)
+        done = sum(1 for state in stages.values() if state in (STAGE_DONE, STAGE_CACHED, STAGE_SKIPPED))
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "stages": stages,
+            "progress": round(done / len(stages), 2) if stages else 0.0,
+            "stage_timings": stage_timings,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Bounded worker pool for long-running analysis jobs.
+
+    Jobs are accepted immediately and executed on at most ``max_workers`` threads;
+    at most ``max_pending`` jobs may wait or run at once. Finished jobs are kept
+    for ``ttl_sec`` seconds so that clients can fetch their results.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 32, ttl_sec: float = 3600.):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl_sec = ttl_sec
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Any], *args, filename: Optional[str] = None, **kwargs) -> Job:
+        """Queue ``fn(job, *args, **kwargs)``; its return value becomes the job result."""
+        with self._lock:
+            self._prune()
+            active = sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
+            if active >= self.max_pending:
+                raise JobRejected(f"Too many jobs in progress ({active}), try again later.")
+            job = Job(uuid.uuid4().hex, filename=filename)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        logger.info(f"Job {job.id} queued for {filename}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs) -> None:
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = DONE
+            logger.info(f"Job {job.id} finished in {time.time() - job.started_at:.1f}s")
+        except JobFailed as e:
+            job.error = str(e)
+            job.error_status_code = e.status_code
+            job.status = FAILED
+            logger.warning(f"Job {job.id} failed: {e}")
+        except Exception as e:
+            job.error = f"An error occurred during processing: {str(e)}"
+            job.status = FAILED
+            logger.error(f"Job {job.id} crashed: {e}", exc_info=True)
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self) -> None:
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.ttl_sec
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+job_queue = JobQueue(
+    max_workers=int(os.getenv("ANALYSIS_WORKERS", "2")),
+    max_pending=int(os.getenv("MAX_PENDING_JOBS", "32")),
+    ttl_sec=float(os.getenv("JOB_RESULT_TTL_SEC", "3600")),
+)
@@ -0,0 +1,148 @@
+import gc
+import os
+import sys
+import time
+import threading
+import logging
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size of this process, or None where it cannot be read."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS; bytes on macOS, kilobytes elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+class _Entry:
+    def __init__(self, loader: Callable[[], Any], in_all: bool = True):
+        self.loader = loader
+        self.in_all = in_all
+        self.model: Any = None
+        self.loaded = False
+        self.load_time_sec: Optional[float] = None
+        self.rss_delta_bytes: Optional[int] = None
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Loads models lazily, once per process, on first use.
+
+    Modules register a loader at import time instead of building the model, so
+    importing api_server stays cheap. Models can be warmed up from a startup hook,
+    or before the server forks its workers (see preload) so that the read-only
+    weights are shared copy-on-write between them.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any], in_all: bool = True) -> None:
+        """in_all: Whether warm_up/preload without names (PRELOAD_MODELS=all) load this model."""
+        with self._lock:
+            if name in self._entries and self._entries[name].loaded:
+                raise ValueError(f"Model {name} is already loaded")
+            self._entries[name] = _Entry(loader, in_all)
+
+    def names(self):
+        with self._lock:
+            return list(self._entries)
+
+    def default_names(self):
+        """The models that "all" stands for."""
+        with self._lock:
+            return [name for name, entry in self._entries.items() if entry.in_all]
+
+    def is_loaded(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return entry is not None and entry.loaded
+
+    def get(self, name: str) -> Any:
+        """Returns the model, loading it first if needed; concurrent callers wait for a single load."""
+        try:
+            entry = self._entries[name]
+        except KeyError:
+            raise KeyError(f"No model registered under {name}") from None
+        if entry.loaded:
+            return entry.model
+        with entry.lock:
+            if not entry.loaded:
+                logger.info(f"Loading model {name}")
+                rss_before = current_rss_bytes()
+                started = time.perf_counter()
+                entry.model = entry.loader()
+                entry.load_time_sec = time.perf_counter() - started
+                rss_after = current_rss_bytes()
+                if rss_before is not None and rss_after is not None:
+                    entry.rss_delta_bytes = rss_after - rss_before
+                entry.loaded = True
+                logger.info(f"Loaded model {name} in {entry.load_time_sec:.1f}s ({self._format_bytes(entry.rss_delta_bytes)} resident)")
+        return entry.model
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> None:
+        """Loads the given models (default_names() by default) ahead of the first request."""
+        for name in (self.default_names() if names is None else names):
+            self.get(name)
+
+    def preload(self, names: Optional[Iterable[str]] = None) -> None:
+        """
+        Warms up models in a parent process before it forks workers (e.g. gunicorn --preload)
+        and moves everything allocated so far out of the garbage collector's reach, so that
+        the collector does not touch, and thereby copy, the shared pages in the workers.
+        """
+        self.warm_up(names)
+        gc.collect()
+        gc.freeze()
+
+    def unload(self, name: str) -> None:
+        entry = self._entries[name]
+        with entry.lock:
+            entry.model = None
+            entry.loaded = False
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Load state, load time and resident size increase per model."""
+        return {
+            name: {
+                "loaded": entry.loaded,
+                "load_time_sec": round(entry.load_time_sec, 3) if entry.load_time_sec is not None else None,
+                "rss_delta_mb": round(entry.rss_delta_bytes / 2 ** 20, 1) if entry.rss_delta_bytes is not None else None,
+            }
+            for name, entry in list(self._entries.items())
+        }
+
+    @staticmethod
+    def _format_bytes(size: Optional[int]) -> str:
+        return "unknown" if size is None else f"{size / 2 ** 20:.0f} MiB"
+
+
+registry = ModelRegistry()
+
+
+def models_from_env(variable: str) -> Optional[list]:
+    """Parses a comma-separated list of model names from an environment variable; "all" (None) means registry.default_names()."""
+    value = os.getenv(variable, "").strip()
+    if not value:
+        return []
+    if value == "all":
+        return None
+    return [name.strip() for name in value.split(",") if name.strip()]
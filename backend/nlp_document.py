@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+import logging
+from concurrent.futures import Future, wait
+from typing import List, NamedTuple, Tuple
+from model_registry import registry
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+NLP_BATCH_SIZE = int(os.getenv("NLP_BATCH_SIZE", "16"))
+# How long the first of several concurrent jobs waits for others to join its nlp.pipe batch
+NLP_BATCH_WAIT_MS = float(os.getenv("NLP_BATCH_WAIT_MS", "5"))
+
+
+def _load_spacy():
+    import spacy
+    # Entities and the dependency parse are never used; the statistical sentence
+    # segmenter replaces the parser's sentence boundaries at a fraction of the cost
+    nlp = spacy.load(SPACY_MODEL, exclude=["ner", "parser"])
+    if "senter" in nlp.disabled:
+        nlp.enable_pipe("senter")
+    return nlp
+
+registry.register("spacy", _load_spacy)
+
+
+class Token(NamedTuple):
+    text: str
+    start: int      # character offsets into the document's text, end exclusive
+    end: int
+    pos: str        # universal POS tag (spaCy's token.pos_)
+    lemma: str
+    is_punct: bool
+    space_after: bool
+
+
+class NlpDocument(NamedTuple):
+    """
+    One NLP pass over a text, shared by the analyses that need tokens, tags or sentences.
+    Plain tuples, so it can be cached and sent to other processes without spaCy.
+    """
+    text: str
+    tokens: List[Token]
+    sentences: List[Tuple[int, int]]  # [start, end) character spans
+
+    def words(self) -> List[Tuple[int, int]]:
+        """
+        [start, end) of each whitespace-separated word, without leading or trailing punctuation,
+        i.e. what a speech recognizer would output as one word ("don't", "U.S." or "3.5").
+        """
+        spans = []
+        start = end = None
+        for token in self.tokens:
+            if not token.is_punct:
+                if start is None:
+                    start = token.start
+                end = token.end
+            if token.space_after:
+                if start is not None:
+                    spans.append((start, end))
+                start = end = None
+        if start is not None:
+            spans.append((start, end))
+        return spans
+
+
+def _to_document(doc) -> NlpDocument:
+    tokens = [
+        Token(token.text, token.idx, token.idx + len(token.text), token.pos_, token.lemma_,
+              token.is_punct, bool(token.whitespace_) or token.i == len(doc) - 1 or doc[token.i + 1].is_space)
+        for token in doc if not token.is_space
+    ]
+    sentences = [(sentence.start_char, sentence.end_char) for sentence in doc.sents]
+    return NlpDocument(doc.text, tokens, sentences)
+
+
+def analyze_many(texts: List[str]) -> List[NlpDocument]:
+    """Annotates several texts with one nlp.pipe call."""
+    nlp = registry.get("spacy")
+    return [_to_document(doc) for doc in nlp.pipe(texts, batch_size=NLP_BATCH_SIZE)]
+
+
+class _Batcher:
+    """
+    Collects texts from concurrent callers into shared nlp.pipe batches.
+
+    A caller that finds no batch running becomes the leader: it waits NLP_BATCH_WAIT_MS for
+    other jobs' texts, annotates everything queued in one nlp.pipe call and hands each caller
+    its document. Texts queued meanwhile go into the next batch, led by one of their callers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[str, Future]] = []
+        self._running = False
+
+    def submit(self, text: str) -> NlpDocument:
+        future: Future = Future()
+        with self._lock:
+            self._queue.append((text, future))
+        while not future.done():
+            with self._lock:
+                leader = not self._running
+                self._running = True
+            if leader:
+                self._run_batch()
+            else:
+                wait([future], timeout=NLP_BATCH_WAIT_MS / 1000)
+        return future.result()
+
+    def _run_batch(self) -> None:
+        try:
+            time.sleep(NLP_BATCH_WAIT_MS / 1000)
+            with self._lock:
+                batch, self._queue = self._queue, []
+            if not batch:
+                return
+            try:
+                documents = analyze_many([text for text, _ in batch])
+                for (_, future), document in zip(batch, documents):
+                    future.set_result(document)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running = False
+
+
+_batcher = _Batcher()
+
+
+def analyze(text: str) -> NlpDocument:
+    """Tokens with character offsets, universal POS tags, lemmas and sentences of a text."""
+    logger.info("nlp_document.analyze called")
+    try:
+        document = _batcher.submit(text)
+        logger.info(f"Annotated {len(document.tokens)} tokens in {len(document.sentences)} sentences.")
+        return document
+    except Exception as e:
+        logger.error(f"Error in nlp_document.analyze: {e}", exc_info=True)
+        raise
+
+
+def as_document(text_or_document) -> NlpDocument:
+    return text_or_document if isinstance(text_or_document, NlpDocument) else analyze(text_or_document)
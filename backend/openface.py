@@ -1,65 +1,236 @@
-import subprocess 
+import os
+import time
+import shutil
+import signal
+import tempfile
+import threading
+import subprocess
 import polars as pl
 import logging
 
-def extract_video(file_path, out_dir, file_name = "video", openface_path='/opt/OpenFace/build/bin/FeatureExtraction'): 
-    subprocess.run([
-        openface_path,  # Use absolute path
-        '-f', file_path,
-        '-out_dir', out_dir,
-        '-of', file_name, 
-        '-gaze',
-        '-aus'
-    ])
-
-def get_gaze_and_aus(file_path):
-    gaze = ["gaze_angle_x", "gaze_angle_y"]
-    aus = [
-        "AU01_r", "AU02_r", "AU04_r", "AU05_r", "AU06_r", "AU07_r",
-        "AU09_r", "AU10_r", "AU12_r", "AU14_r", "AU15_r", "AU17_r",
-        "AU20_r", "AU23_r", "AU25_r", "AU26_r", "AU45_r",
-    ]
-    print("Yes")
-    df = pl.read_csv(file_path, columns=gaze + aus)
-
-    result = {}
-
-    # Sum of absolute gaze angles
-    gaze_sums = df.select([pl.col(col).abs().mean().alias(col + "_abs_sum") for col in gaze])
-    result.update(dict(zip(gaze, gaze_sums.row(0))))
-
-    # Sum of absolute diffs for AUs
-    for col in aus:
-        diff_sum = df.select(
-            (pl.col(col) - pl.col(col).shift(1)).abs().mean().alias(col + "_diff_sum")
-        )[0, 0]
-        result[col] = diff_sum
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
 
-    return result
+OPENFACE_PATH = os.getenv("OPENFACE_PATH", '/opt/OpenFace/build/bin/FeatureExtraction')
+OPENFACE_TIMEOUT_SEC = float(os.getenv("OPENFACE_TIMEOUT_SEC", "1800"))
+# OpenFace is CPU-heavy and runs next to Whisper and pose tracking, so only a few may run at once
+OPENFACE_MAX_CONCURRENT = int(os.getenv("OPENFACE_MAX_CONCURRENT", str(max(1, (os.cpu_count() or 1) // 4))))
+POLL_INTERVAL_SEC = 0.25
+# Frames OpenFace could not fit a face to, or fitted with low confidence, are left out of the statistics
+OPENFACE_MIN_CONFIDENCE = float(os.getenv("OPENFACE_MIN_CONFIDENCE", "0.8"))
+FACE_WINDOW_SEC = float(os.getenv("FACE_WINDOW_SEC", "10"))
+PERCENTILES = (0.1, 0.5, 0.9)
+
+GAZE = ["gaze_angle_x", "gaze_angle_y"]
+AUS = [
+    "AU01_r", "AU02_r", "AU04_r", "AU05_r", "AU06_r", "AU07_r",
+    "AU09_r", "AU10_r", "AU12_r", "AU14_r", "AU15_r", "AU17_r",
+    "AU20_r", "AU23_r", "AU25_r", "AU26_r", "AU45_r",
+]
+
+_slots = threading.BoundedSemaphore(OPENFACE_MAX_CONCURRENT)
+
+
+class OpenFaceError(Exception):
+    """Raised when FeatureExtraction fails, times out or produces no output."""
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, AttributeError):
+        process.kill()
+    process.wait()
+
+
+def run_openface(file_path, out_dir, file_name="video", openface_path=OPENFACE_PATH, timeout=OPENFACE_TIMEOUT_SEC):
+    """
+    Runs FeatureExtraction on a video, killing it after the timeout.
+
+    Args:
+        file_path: Video to analyze
+        out_dir: Directory for OpenFace's output; should belong to this run only
+        file_name: Base name of the output files
+        openface_path: FeatureExtraction binary
+        timeout: Seconds after which the process is killed
+
+    Returns:
+        str: Path of the finished CSV
+
+    Raises:
+        OpenFaceError: On a non-zero exit code, a timeout or missing output
+    """
+    csv_path = os.path.join(out_dir, file_name + ".csv")
+    with open(os.path.join(out_dir, "openface.log"), "wb") as log:
+        process = subprocess.Popen([
+            openface_path,  # Use absolute path
+            '-f', file_path,
+            '-out_dir', out_dir,
+            '-of', file_name,
+            '-gaze',
+            '-aus'
+        ], stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    deadline = time.monotonic() + timeout
+    try:
+        while process.poll() is None:
+            if time.monotonic() > deadline:
+                _kill(process)
+                raise OpenFaceError(f"OpenFace timed out after {timeout:.0f}s on {file_path}")
+            time.sleep(POLL_INTERVAL_SEC)
+    finally:
+        if process.poll() is None:
+            _kill(process)
+
+    if process.returncode != 0:
+        raise OpenFaceError(f"OpenFace exited with code {process.returncode} on {file_path}")
+    if not os.path.exists(csv_path):
+        raise OpenFaceError(f"OpenFace wrote no CSV for {file_path}")
+    return csv_path
+
+def _scan_csv(file_path):
+    """
+    Lazy table of the frame columns of an OpenFace CSV. OpenFace pads header names and values
+    with spaces, so names are stripped and values parsed as floats.
+    """
+    columns = ["timestamp", "confidence", "success"] + GAZE + AUS
+    return (
+        pl.scan_csv(file_path,
+                    with_column_names=lambda names: [name.strip() for name in names],
+                    schema_overrides={col: pl.Float64 for col in columns})
+        .select(columns)
+    )
+
+
+def _scan_frames(table, min_confidence=OPENFACE_MIN_CONFIDENCE):
+    """Lazy frame table: |gaze angle| and |AU change since the previous kept frame| per successfully tracked frame."""
+    return (
+        table
+        .filter((pl.col("success") == 1) & (pl.col("confidence") >= min_confidence))
+        .with_columns([pl.col(col).abs() for col in GAZE] + [pl.col(col).diff().abs() for col in AUS])
+    )
+
+
+def get_face_statistics(file_path, min_confidence=OPENFACE_MIN_CONFIDENCE, window_sec=FACE_WINDOW_SEC):
+    """
+    Gaze and AU statistics of an OpenFace CSV, computed by one lazy query plan.
+
+    The frame count and the two results below share a single scan of the file (collect_all
+    eliminates the common subplan) and run on the streaming engine, so memory stays bounded
+    however long the recording is.
+
+    Args:
+        file_path: CSV written by FeatureExtraction
+        min_confidence: Frames below this tracking confidence are skipped
+        window_sec: Length of the windows in "windows"
+
+    Returns:
+        dict: "summary" (mean |gaze| and mean |AU change| per column, as in get_gaze_and_aus),
+        "frames" and "frames_used" (before and after filtering), "percentiles" of the same
+        per-frame values, and "windows" with per-window gaze means, spread and AU activity
+    """
+    table = _scan_csv(file_path)
+    frames = _scan_frames(table, min_confidence)
+    columns = GAZE + AUS
+    total = table.select(pl.len().alias("frames"))
+    summary = frames.select(
+        [pl.len().alias("frames_used")]
+        + [pl.col(col).mean() for col in columns]
+        + [pl.col(col).quantile(q).alias(f"{col}_p{round(q * 100)}") for col in columns for q in PERCENTILES]
+    )
+    windows = (
+        frames
+        .with_columns((pl.col("timestamp") // window_sec).cast(pl.Int64).alias("window"))
+        .group_by("window")
+        .agg(
+            [pl.len().alias("frames")]
+            + [pl.col(col).mean() for col in GAZE]
+            + [pl.col(col).std().alias(col + "_std") for col in GAZE]
+            + [pl.sum_horizontal([pl.col(col).mean() for col in AUS]).alias("au_activity")]
+        )
+        .sort("window")
+    )
+    total, summary, windows = pl.collect_all([total, summary, windows], engine="streaming")
+
+    row = summary.row(0, named=True)
+    return {
+        "frames": total[0, 0],
+        "frames_used": row["frames_used"],
+        "summary": {col: row[col] for col in columns},
+        "percentiles": {
+            col: {f"p{round(q * 100)}": row[f"{col}_p{round(q * 100)}"] for q in PERCENTILES}
+            for col in columns
+        },
+        "windows": [
+            {
+                "start": window["window"] * window_sec,
+                "frames": window["frames"],
+                **{col: window[col] for col in GAZE},
+                **{col + "_std": window[col + "_std"] for col in GAZE},
+                "au_activity": window["au_activity"],
+            }
+            for window in windows.iter_rows(named=True)
+        ],
+    }
+
+
+def get_gaze_and_aus(file_path, min_confidence=OPENFACE_MIN_CONFIDENCE):
+    """Mean |gaze angle| and mean |AU change| per column of an OpenFace CSV."""
+    return get_face_statistics(file_path, min_confidence)["summary"]
 
 def get_all_aus_sum(dick):
     sum = 0
     for key, value in dick.items():
-        if "AU" in key:
+        if "AU" in key and value is not None:
             sum += value
     return sum
 
-def return_numbers(file_path, openface_path='/opt/OpenFace/build/bin/FeatureExtraction', temp_dir = "app/videos/openface"):
-    logging.basicConfig(level=logging.INFO)
+def analyze_face(file_path, openface_path=OPENFACE_PATH, temp_dir=None, timeout=OPENFACE_TIMEOUT_SEC):
+    """
+    Runs OpenFace on a video and returns get_face_statistics of its output plus "all_aus_sum",
+    or None if OpenFace failed.
+
+    Every call gets its own output directory under temp_dir (system temp by default), which
+    is removed afterwards, so concurrent jobs never share files.
+    """
+    out_dir = None
     try:
-        # temp_dir = "/app/videos/openface"  # Use absolute path that exists in container
-        extract_video(file_path, temp_dir, openface_path=openface_path)
-        print("No")
-        out = get_gaze_and_aus(temp_dir+"/video.csv") # add stuff
-        result = (out['gaze_angle_x'], out['gaze_angle_y'], get_all_aus_sum(out))
-        logging.info(f"return_numbers({file_path}) returns: {result}")
+        with _slots:
+            out_dir = tempfile.mkdtemp(prefix="openface_", dir=temp_dir)
+            started = time.perf_counter()
+            csv_path = run_openface(file_path, out_dir, openface_path=openface_path, timeout=timeout)
+        statistics = get_face_statistics(csv_path)
+        logger.info(f"OpenFace processed {statistics['frames']} frames of {file_path} in {time.perf_counter() - started:.1f}s")
+        if not statistics["frames_used"]:
+            raise OpenFaceError(f"No frame of {file_path} was tracked with enough confidence")
+        statistics["all_aus_sum"] = get_all_aus_sum(statistics["summary"])
+        return statistics
     except Exception as e:
-        logging.error(f"return_numbers({file_path}) failed: {e}")
+        logger.error(f"analyze_face({file_path}) failed: {e}")
+        return None
+    finally:
+        if out_dir is not None:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+def return_numbers(file_path, openface_path=OPENFACE_PATH, temp_dir=None, timeout=OPENFACE_TIMEOUT_SEC):
+    """
+    Gaze and AU summary of a video: (mean |gaze_angle_x|, mean |gaze_angle_y|, sum of mean |AU change|),
+    or (None, None, None) if OpenFace failed.
+    """
+    statistics = analyze_face(file_path, openface_path, temp_dir, timeout)
+    if statistics is None:
         return (None, None, None)
+    out = statistics["summary"]
+    result = (out['gaze_angle_x'], out['gaze_angle_y'], statistics["all_aus_sum"])
+    logger.info(f"return_numbers({file_path}) returns: {result}")
     return result
 
 if __name__ == "__main__":
     print("Hello")
-    numbers = return_numbers('/Users/almaz/PycharmProjects/SpeechAnalyzer/videos/Vika.mov', 
-                             '/Users/almaz/PycharmProjects/SpeechAnalyzer/openFace/OpenFace/build/bin/FeatureExtraction', 
+    numbers = return_numbers('/Users/almaz/PycharmProjects/SpeechAnalyzer/videos/Vika.mov',
+                             '/Users/almaz/PycharmProjects/SpeechAnalyzer/openFace/OpenFace/build/bin/FeatureExtraction',
                              '/Users/almaz/PycharmProjects/SpeechAnalyzer/videos/tests')
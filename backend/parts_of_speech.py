@@ -1,7 +1,6 @@
-from nltk.tokenize import word_tokenize
-from nltk import pos_tag
-from typing import Dict, List
+from typing import Dict, Union
 from custom_types import PartOfSpeech
+from nlp_document import NlpDocument, as_document
 import logging
 
 logging.basicConfig(
@@ -25,21 +24,26 @@ POS_MARKINGS = {
     'PRT' : 'Particles',
 }
 
-def parts_of_speech(text: str) -> Dict[PartOfSpeech, int]:
+# spaCy tags with Universal Dependencies POS; these map onto the universal tagset above
+UD_TO_UNIVERSAL = {
+    'AUX' : 'VERB',
+    'PROPN' : 'NOUN',
+    'CCONJ' : 'CONJ',
+    'SCONJ' : 'CONJ',
+    'PART' : 'PRT',
+}
+
+def parts_of_speech(text: Union[str, NlpDocument]) -> Dict[PartOfSpeech, int]:
+    """Number of words per part of speech, from the job's NlpDocument or a text to annotate."""
     logger.info("parts_of_speech called")
     try:
-        words = word_tokenize(text, "english")
-        tagged = pos_tag(words, tagset='universal')
-        tag_words: Dict[str, List[str]]= {}
-
-        for word, tag in tagged:
-            if tag in ['.', 'X']:
-                continue 
-            else:
-                normal_tag = POS_MARKINGS[tag]
-            tag_words.setdefault(normal_tag, []).append(word)
-
-        result = {pos: len(words) for pos, words in tag_words.items()} # type: ignore
+        result: Dict[PartOfSpeech, int] = {}
+        for token in as_document(text).tokens:
+            tag = UD_TO_UNIVERSAL.get(token.pos, token.pos)
+            # punctuation, symbols, interjections and unknown words are not counted
+            if tag not in POS_MARKINGS:
+                continue
+            result[POS_MARKINGS[tag]] = result.get(POS_MARKINGS[tag], 0) + 1 # type: ignore
         logger.info("Successfully analyzed parts of speech.")
         return result
     except Exception as e:
@@ -1,78 +1,252 @@
 import cv2
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-from mediapipe.framework.formats import landmark_pb2
+import numpy as np
+import importlib
+import math
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
+from model_registry import registry
 
 # Use relative path from the script's directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
 model_path = os.path.join(script_dir, 'mediapipe_landmarker', 'pose_landmarker_lite.task')
 
-BaseOptions = mp.tasks.BaseOptions
-PoseLandmarker = mp.tasks.vision.PoseLandmarker
-PoseLandmarkerOptions = mp.tasks.vision.PoseLandmarkerOptions
-VisionRunningMode = mp.tasks.vision.RunningMode
+# mediapipe takes seconds to import, so it is only loaded once pose analysis actually runs
+registry.register("mediapipe", lambda: importlib.import_module("mediapipe"))
 
-# Drawing utils for visualization
-mp_drawing = mp.solutions.drawing_utils
-mp_drawing_styles = mp.solutions.drawing_styles
+def _mediapipe():
+    return registry.get("mediapipe")
 
-def calculate_symmetry_points(landmarks):
+# Longest frame side used for pose inference; the lite landmarker works on 256x256 input anyway
+POSE_MAX_SIDE = int(os.getenv("POSE_MAX_SIDE", "640"))
+# Seconds between analyzed frames
+POSE_FRAME_INTERVAL_SEC = float(os.getenv("POSE_FRAME_INTERVAL_SEC", "0.5"))
+# Sampled frames further apart than this are reached by seeking instead of grabbing every frame
+SEEK_MIN_INTERVAL_SEC = 5.0
+# Used when the container does not report a frame rate
+DEFAULT_FPS = 30.0
+
+def get_fps(cap):
+    """Frame rate reported by the container, or DEFAULT_FPS if it is missing or invalid."""
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not fps or not math.isfinite(fps) or fps <= 0 or fps > 1000:
+        return DEFAULT_FPS
+    return fps
+
+def sample_frames(cap, fps, frame_interval, start_frame=0, end_frame=None):
     """
-    Calculate vertical symmetry line and three reference points based on landmarks.
-    
+    Yield (frame_idx, frame) for one frame every frame_interval seconds, without decoding the rest.
+
+    Skipped frames are only grabbed (demuxed, never converted to BGR), or, when samples
+    are far apart, jumped over by seeking.
+    """
+    interval = max(1, int(round(frame_interval * fps)))
+    frame_idx = start_frame
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    seek = frame_interval >= SEEK_MIN_INTERVAL_SEC
+    while end_frame is None or frame_idx < end_frame:
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield frame_idx, frame
+        if seek:
+            frame_idx += interval
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+            continue
+        for _ in range(interval - 1):
+            if not cap.grab():
+                return
+        frame_idx += interval
+
+def downscale(frame, max_side):
+    """Shrink a frame so that its longest side is at most max_side pixels."""
+    height, width = frame.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return frame
+    scale = max_side / max(height, width)
+    return cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+def draw_landmarks(frame, pose_landmarks):
+    """Draw detected poses onto a BGR frame; the protobuf conversion is only needed for this."""
+    mp = _mediapipe()
+    from mediapipe.framework.formats import landmark_pb2
+    for landmarks in pose_landmarks:
+        landmark_list = landmark_pb2.NormalizedLandmarkList()
+        for lm in landmarks:
+            landmark_list.landmark.add(x=lm.x, y=lm.y, z=lm.z)
+        mp.solutions.drawing_utils.draw_landmarks(
+            frame,  # Draw on the original BGR frame
+            landmark_list,
+            mp.solutions.pose.POSE_CONNECTIONS,
+            mp.solutions.drawing_styles.get_default_pose_landmarks_style())
+
+# Hand zones, indexed by the codes classify_hand_zones returns: band * 2 + side,
+# band 0-3 from top to bottom, side 0 for left and 1 for right
+HAND_ZONES = ["uul", "uur", "ul", "ur", "dl", "dr", "ddl", "ddr"]
+NO_ZONE = -1  # no pose detected in the frame
+
+NUM_LANDMARKS = 33
+# Landmark indices used for the zones
+NOSE, LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_WRIST, RIGHT_WRIST, LEFT_HIP, RIGHT_HIP = 0, 11, 12, 15, 16, 23, 24
+
+def classify_hand_zones(landmarks, hip_factor=0.95):
+    """
+    Categorize both hands of every frame in one vectorized pass.
+
+    The vertical symmetry line is the nose's x. The hand's height is compared with
+    three reference lines: the shoulder line, the midpoint between shoulders and
+    hips, and the hip line scaled by hip_factor. A hand whose x is bigger than the
+    symmetry line counts as left.
+
     Args:
-        landmarks: List of pose landmarks
-        
+        landmarks: Array of shape (frames, 33, 4) with x, y, z, visibility; NaN rows where no pose was found
+        hip_factor: Scale of the hip line that separates "d" from "dd"
+
     Returns:
-        tuple: (vertical_symmetry_x, point1, point2, point3)
+        tuple: (left_zones, right_zones), int arrays of HAND_ZONES indices, NO_ZONE where no pose was found
     """
-    if len(landmarks) < 25:  # Need at least 25 landmarks for 0, 11, 12, 23, 24
-        return None, None, None, None
-    
-    # 1. Take landmark 0's x position for vertical symmetry line
-    vertical_symmetry_x = landmarks[0].x
-    
-    # 2. Calculate horizontal center between landmarks 11, 12, 23, 24
-    landmark_11_y = landmarks[11].y
-    landmark_12_y = landmarks[12].y
-    landmark_23_y = landmarks[23].y
-    landmark_24_y = landmarks[24].y
-    horizontal_center_y = ((landmark_11_y + landmark_23_y) / 2 + (landmark_12_y + landmark_24_y) / 2)/2
-    
-    # 3. Create three points
-    point1 = (vertical_symmetry_x, (landmark_11_y+landmark_12_y)/2)  # Vertical symmetry line x, landmark 11 y
-    point2 = (vertical_symmetry_x, horizontal_center_y)  # Vertical symmetry line x, horizontal center y
-    point3 = (vertical_symmetry_x, ((landmark_23_y+landmark_24_y)/2) * 0.95)  # Vertical symmetry line x, landmark 23 y
-    
-    return vertical_symmetry_x, point1, point2, point3
+    landmarks = np.asarray(landmarks)
+    x, y = landmarks[:, :, 0], landmarks[:, :, 1]
+    symmetry_x = x[:, NOSE]
+    shoulder_y = (y[:, LEFT_SHOULDER] + y[:, RIGHT_SHOULDER]) / 2
+    hip_y = (y[:, LEFT_HIP] + y[:, RIGHT_HIP]) / 2
+    center_y = (shoulder_y + hip_y) / 2
+    lower_y = hip_y * hip_factor
+    detected = ~np.isnan(landmarks).any(axis=(1, 2))
 
-def categorize_hand_position(hand_x, hand_y, point1, point2, point3):
+    zones = []
+    for wrist in (LEFT_WRIST, RIGHT_WRIST):
+        hand_x, hand_y = x[:, wrist], y[:, wrist]
+        band = np.select([hand_y < shoulder_y, hand_y < center_y, hand_y < lower_y], [0, 1, 2], default=3)
+        side = np.where(hand_x > symmetry_x, 0, 1)
+        zones.append(np.where(detected, band * 2 + side, NO_ZONE))
+    return zones[0], zones[1]
+
+def summarize_hand_positions(timestamps, landmarks, hip_factor=0.95):
     """
-    Categorize hand position based on coordinates relative to reference points.
+    Counts and timeline of hand zones from stored landmarks, without rerunning inference.
+
+    Returns:
+        dict: "counts" per zone over both hands, "frames_analyzed" (frames with a pose) and
+        "timeline" with the time, left zone and right zone (None without a pose) of every sampled frame
+    """
+    left, right = classify_hand_zones(landmarks, hip_factor)
+    both = np.concatenate([left, right])
+    totals = np.bincount(both[both != NO_ZONE], minlength=len(HAND_ZONES))
+    zone_names = np.array(HAND_ZONES + [None], dtype=object)  # NO_ZONE (-1) picks the trailing None
+    return {
+        "counts": dict(zip(HAND_ZONES, totals.tolist())),
+        "frames_analyzed": int((left != NO_ZONE).sum()),
+        "timeline": {
+            "times": np.round(timestamps, 3).tolist(),
+            "left": zone_names[left].tolist(),
+            "right": zone_names[right].tolist(),
+        },
+    }
+
+def analyze_range(video_path, start_frame=0, end_frame=None, save_frames=False, frame_interval=0.5, max_side=POSE_MAX_SIDE):
+    """
+    Detect poses in frames [start_frame, end_frame) of a video with its own landmarker.
     
     Args:
-        hand_x, hand_y: Hand landmark coordinates
-        point1, point2, point3: Reference points (x, y) tuples
+        video_path: Path to the video file
+        start_frame, end_frame: Frame range to analyze (end_frame None means until the end)
+        save_frames: Whether to save frames with landmarks
+        frame_interval: Interval between analyzed frames in seconds
+        max_side: Frames are downscaled to at most this many pixels on their longest side before inference
         
     Returns:
-        str: Position category
+        dict: "timestamps" (seconds) and "landmarks", a (frames, 33, 4) float32 array of
+        x, y, z and visibility for every sampled frame, NaN where no pose was found
     """
-    # Check if hand is to the left or right of the vertical symmetry line
-    is_left = hand_x > point1[0]  # x coordinate bigger than symmetry line
+    # Open video file
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return {"error": f"Could not open video file: {video_path}"}
     
-    # Categorize based on y position
-    if hand_y < point1[1]:  # Higher than point 1
-        return "uul" if is_left else "uur"
-    elif point1[1] <= hand_y < point2[1]:  # Between point 1 and point 2
-        return "ul" if is_left else "ur"
-    elif point2[1] <= hand_y < point3[1]:  # Between point 2 and point 3
-        return "dl" if is_left else "dr"
-    else:  # Lower than point 3
-        return "ddl" if is_left else "ddr"
-
-def analyze_hand_positions(video_path, save_frames=False, frame_interval=0.5):
+    fps = get_fps(cap)
+    timestamps = []
+    rows = []
+    missing = np.full((NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+    
+    mp = _mediapipe()
+    options = mp.tasks.vision.PoseLandmarkerOptions(
+        base_options=mp.tasks.BaseOptions(model_asset_path=model_path),
+        running_mode=mp.tasks.vision.RunningMode.VIDEO)
+
+    # Timestamps only have to increase within one landmarker, so every range keeps the video's own time base
+    with mp.tasks.vision.PoseLandmarker.create_from_options(options) as landmarker:
+        for frame_idx, frame in sample_frames(cap, fps, frame_interval, start_frame, end_frame):
+            # Landmarks are normalized to [0, 1], so inference on a smaller frame gives the same categories
+            small_frame = downscale(frame, max_side)
+            # Convert BGR (OpenCV) to RGB (MediaPipe expects RGB)
+            rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+
+            # Create MediaPipe Image
+            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
+
+            # Calculate timestamp in ms
+            frame_timestamp_ms = int((frame_idx / fps) * 1000)
+
+            # Run pose detection
+            result = landmarker.detect_for_video(mp_image, frame_timestamp_ms)
+            timestamps.append(frame_timestamp_ms / 1000)
+
+            if result.pose_landmarks and len(result.pose_landmarks[-1]) == NUM_LANDMARKS:
+                rows.append([(lm.x, lm.y, lm.z, lm.visibility or 0.0) for lm in result.pose_landmarks[-1]])
+            else:
+                rows.append(missing)
+
+            if result.pose_landmarks and save_frames:
+                draw_landmarks(frame, result.pose_landmarks)
+                # Save the frame with landmarks
+                cv2.imwrite(f"frame_{frame_idx}.jpg", frame)
+
+    cap.release()
+    cv2.destroyAllWindows()
+
+    landmarks = np.array(rows, dtype=np.float32).reshape(-1, NUM_LANDMARKS, 4)
+    return {"timestamps": np.array(timestamps, dtype=np.float64), "landmarks": landmarks}
+
+# Worker processes for segmented analysis, each running its own landmarker. Kept small because
+# concurrent jobs share them with Whisper, OpenFace and the other stages
+POSE_WORKERS = int(os.getenv("POSE_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Segments shorter than this are not worth the start-up cost of a landmarker
+MIN_SEGMENT_SEC = 20.0
+
+_pose_pool = None
+
+def _get_pose_pool():
+    global _pose_pool
+    if _pose_pool is None:
+        # spawn, not fork: mediapipe and the server's models do not survive forking well
+        _pose_pool = ProcessPoolExecutor(max_workers=POSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pose_pool
+
+def shutdown_pose_pool():
+    """Stops the worker processes, e.g. when the server shuts down; the next analysis starts new ones."""
+    global _pose_pool
+    if _pose_pool is not None:
+        _pose_pool.shutdown(wait=False, cancel_futures=True)
+        _pose_pool = None
+
+def plan_segments(frame_count, fps, frame_interval, workers, min_segment_sec=MIN_SEGMENT_SEC):
+    """
+    Split [0, frame_count) into at most `workers` frame ranges for parallel analysis.
+    Boundaries fall on the sampling grid, so exactly the same frames are analyzed as in one pass.
+    """
+    interval = max(1, int(round(frame_interval * fps)))
+    samples = -(-frame_count // interval)
+    segments = max(1, min(workers, int(frame_count / fps // min_segment_sec)))
+    samples_per_segment = -(-samples // segments)
+    ranges = []
+    for start_sample in range(0, samples, samples_per_segment):
+        end_sample = min(samples, start_sample + samples_per_segment)
+        ranges.append((start_sample * interval, min(frame_count, end_sample * interval)))
+    return ranges or [(0, frame_count)]
+
+def analyze_hand_positions(video_path, save_frames=False, frame_interval=POSE_FRAME_INTERVAL_SEC, max_side=POSE_MAX_SIDE, workers=1):
     """
     Analyze hand positions in a video and return distribution statistics.
     
@@ -80,89 +254,43 @@ def analyze_hand_positions(video_path, save_frames=False, frame_interval=0.5):
         video_path: Path to the video file
         save_frames: Whether to save frames with landmarks
         frame_interval: Interval between analyzed frames in seconds
+        max_side: Frames are downscaled to at most this many pixels on their longest side before inference
+        workers: Number of time ranges analyzed in parallel processes (None: POSE_WORKERS)
         
     Returns:
         dict: Dictionary containing position distribution and statistics
     """
-    # Hand position distribution counters
-    hand_position_counts = {
-        "uul": 0,  # upper-upper left
-        "uur": 0,  # upper-upper right
-        "ul": 0,   # upper left
-        "ur": 0,   # upper right
-        "dl": 0,   # down left
-        "dr": 0,   # down right
-        "ddl": 0,  # down-down left
-        "ddr": 0   # down-down right
-    }
-    
-    # Open video file
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         return {"error": f"Could not open video file: {video_path}"}
-    
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    interval = int(frame_interval * fps)
-    frame_idx = 0
-    total_frames_analyzed = 0
-    
-    options = PoseLandmarkerOptions(
-        base_options=BaseOptions(model_asset_path=model_path),
-        running_mode=VisionRunningMode.VIDEO)
-
-    with PoseLandmarker.create_from_options(options) as landmarker:
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            if frame_idx % interval == 0:
-                # Convert BGR (OpenCV) to RGB (MediaPipe expects RGB)
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-                # Create MediaPipe Image
-                mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-
-                # Calculate timestamp in ms
-                frame_timestamp_ms = int((frame_idx / fps) * 1000)
-
-                # Run pose detection
-                result = landmarker.detect_for_video(mp_image, frame_timestamp_ms)
-                
-                if result.pose_landmarks:
-                    for landmarks in result.pose_landmarks:
-                        landmark_list = landmark_pb2.NormalizedLandmarkList()
-                        for lm in landmarks:
-                            landmark_list.landmark.add(x=lm.x, y=lm.y, z=lm.z)
-                        
-                        if save_frames:
-                            mp_drawing.draw_landmarks(
-                                frame,  # Draw on the original BGR frame
-                                landmark_list,
-                                mp.solutions.pose.POSE_CONNECTIONS,
-                                mp_drawing_styles.get_default_pose_landmarks_style())
-                    
-                    # Calculate symmetry points
-                    vertical_symmetry_x, point1, point2, point3 = calculate_symmetry_points(landmarks)
-                    
-                    if vertical_symmetry_x is not None and len(landmarks) >= 17:  # Need landmarks 15, 16
-                        # Track hand positions (landmarks 15 and 16)
-                        left_hand_pos = categorize_hand_position(landmarks[15].x, landmarks[15].y, point1, point2, point3)
-                        right_hand_pos = categorize_hand_position(landmarks[16].x, landmarks[16].y, point1, point2, point3)
-                        
-                        # Increment counters
-                        hand_position_counts[left_hand_pos] = hand_position_counts.get(left_hand_pos, 0) + 1
-                        hand_position_counts[right_hand_pos] = hand_position_counts.get(right_hand_pos, 0) + 1
-                        total_frames_analyzed += 1
-                    
-                    if save_frames:
-                        # Save the frame with landmarks
-                        cv2.imwrite(f"frame_{frame_idx}.jpg", frame)
-
-            frame_idx += 1
-
+    fps = get_fps(cap)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
     cap.release()
-    cv2.destroyAllWindows()
+
+    workers = POSE_WORKERS if workers is None else workers
+    if workers > 1 and frame_count > 0 and not save_frames:
+        ranges = plan_segments(frame_count, fps, frame_interval, workers)
+    else:
+        # Unknown length (some containers do not report it) or a single worker: one pass over the whole video
+        ranges = [(0, None)]
+
+    if len(ranges) == 1:
+        parts = [analyze_range(video_path, *ranges[0], save_frames, frame_interval, max_side)]
+    else:
+        pool = _get_pose_pool()
+        futures = [pool.submit(analyze_range, video_path, start, end, False, frame_interval, max_side) for start, end in ranges]
+        parts = [future.result() for future in futures]
+
+    for part in parts:
+        if "error" in part:
+            return {"video_path": video_path, "error": part["error"]}
+
+    # Ranges come back in time order, so concatenating keeps the frames sorted
+    timestamps = np.concatenate([part["timestamps"] for part in parts])
+    landmarks = np.concatenate([part["landmarks"] for part in parts])
+    summary = summarize_hand_positions(timestamps, landmarks)
+    hand_position_counts = summary["counts"]
+    total_frames_analyzed = summary["frames_analyzed"]
     
     # Calculate results
     total_hand_positions = sum(hand_position_counts.values())
@@ -175,7 +303,10 @@ def analyze_hand_positions(video_path, save_frames=False, frame_interval=0.5):
             "percentages": {
                 key: round(hand_position_counts[key]/total_hand_positions*100, 2) for key in hand_position_counts
             },
-            "absolute_counts": hand_position_counts.copy()
+            "absolute_counts": hand_position_counts.copy(),
+            "timeline": summary["timeline"],
+            "timestamps": timestamps,
+            "landmarks": landmarks,
         }
     else:
         results = {
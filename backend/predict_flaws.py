@@ -1,26 +1,153 @@
 import numpy as np
-from typing import List, Dict
+import logging
+import os
+import re
+from typing import List, Dict, Optional
 from custom_types import TimeStamp, WordBoundary
 
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+# Words spoken this many robust standard deviations slower (per character) than usual are prolonged
+PROLONGATION_Z = float(os.getenv("PROLONGATION_Z", "3.5"))
+# Pauses inside speech count as hesitations when this long and this unusual for the speaker
+HESITATION_MIN_SEC = float(os.getenv("HESITATION_MIN_SEC", "0.75"))
+HESITATION_Z = float(os.getenv("HESITATION_Z", "3.0"))
+# Words Whisper was less sure of than this are reported as unclear
+LOW_PROBABILITY = float(os.getenv("LOW_PROBABILITY", "0.35"))
+# A pause this long next to an ambiguous filler ("like", "you know") marks it as a filler
+FILLER_PAUSE_SEC = 0.2
+
+FILLERS = {"um", "uh", "uhm", "umm", "uhh", "er", "erm", "ah", "hmm", "mm", "mhm"}
+# Fillers that are also ordinary words; counted only when set off by a pause or a comma
+AMBIGUOUS_FILLERS = {"like", "basically", "actually", "literally"}
+FILLER_PHRASES = {("you", "know"), ("i", "mean")}
+
+CATEGORIES = ("filler", "repetition", "prolongation", "hesitation", "unclear")
+
+
 def floss(indices: Dict[TimeStamp, WordBoundary], threshhold: float = 1.0) -> List[WordBoundary]:
     x, y = zip(*indices.keys())
-    diff = np.array(x) - np.array(y)
+    diff = np.array(y) - np.array(x)  # word durations
     avg = np.average(diff)
     mask = abs(diff - avg) > threshhold
     filtered_values = [index_pair for index_pair, m in zip(indices.values(), mask) if m]
     return filtered_values
 
-# from typing import Tuple, Dict
-# from custom_types import TimeStamp
-#
-# def floss(timestamped_transcipt: Dict[TimeStamp, str], threshhold: float = 1.0) -> Dict[TimeStamp, str]:
-#     x, y = zip(*timestamped_transcipt.keys())
-#     diff = np.array(x) - np.array(y)
-#     avg = np.average(diff)
-#     mask = abs(diff - avg) > threshhold
-#     filtered_timestamped_transcipt = {
-#         timestamp: word
-#         for (timestamp, word), mask_value in zip(timestamped_transcipt.items(), mask) 
-#         if mask_value
-#     }
-#     return filtered_timestamped_transcipt
+
+def _robust_z(values: np.ndarray) -> np.ndarray:
+    """(value - median) / (1.4826 * MAD), which a few extreme values cannot inflate."""
+    if len(values) == 0:
+        return values
+    median = np.median(values)
+    spread = 1.4826 * np.median(np.abs(values - median))
+    if spread == 0:
+        spread = values.std() or 1.
+    return (values - median) / spread
+
+
+def _flaw(start: float, end: float, category: str, text: str, score: float) -> dict:
+    return {"start": float(start), "end": float(end), "category": category, "text": text, "score": round(score, 2)}
+
+
+def detect_disfluencies(words: Dict[TimeStamp, str], probabilities: Optional[Dict[TimeStamp, float]] = None) -> List[dict]:
+    """
+    Disfluencies in a timestamped transcript, from per-word features computed over whole arrays:
+
+    - filler: "um", "uh", filler phrases ("you know"), and ambiguous fillers ("like") set off
+      by a pause or a comma
+    - repetition: a word or two-word phrase said twice in a row ("I I", "I was I was")
+    - prolongation: a word that lasts unusually long for its length (robust z-score of the
+      seconds per character)
+    - hesitation: a pause between words that is long and unusual for the speaker
+    - unclear: a word Whisper gave a low probability (speech_to_text.Transcript.probabilities)
+
+    Returns:
+        list: {"start", "end", "category", "text", "score"} sorted by start time. score is the
+              z-score, the pause length, the probability, or 1 for fillers and repetitions.
+    """
+    logger.info("detect_disfluencies called")
+    try:
+        items = sorted(words.items(), key=lambda item: item[0][0])
+        if not items:
+            return []
+        stamps = [stamp for stamp, _ in items]
+        texts = [text for _, text in items]
+        starts = np.array([start for start, _ in stamps], dtype=float)
+        ends = np.array([end for _, end in stamps], dtype=float)
+        tokens = [re.sub(r"[^\w']", "", text.lower()) for text in texts]
+        vocabulary: Dict[str, int] = {}
+        ids = np.array([vocabulary.setdefault(token, len(vocabulary)) for token in tokens])
+        flaws = []
+
+        # Fillers
+        def token_ids(options):
+            return np.array([vocabulary[option] for option in options if option in vocabulary], dtype=int)
+        gap_before = np.concatenate(([np.inf], starts[1:] - ends[:-1]))
+        gap_after = np.concatenate((gap_before[1:], [np.inf]))
+        comma = np.array([text.endswith(",") for text in texts])
+        previous_comma = np.concatenate(([True], comma[:-1]))
+        set_off = (gap_before >= FILLER_PAUSE_SEC) | (gap_after >= FILLER_PAUSE_SEC) | comma | previous_comma
+        filler = np.isin(ids, token_ids(FILLERS))
+        single = filler | (np.isin(ids, token_ids(AMBIGUOUS_FILLERS)) & set_off)
+        for index in np.flatnonzero(single).tolist():
+            flaws.append(_flaw(starts[index], ends[index], "filler", texts[index], 1.))
+        for first, second in FILLER_PHRASES:
+            if first in vocabulary and second in vocabulary:
+                pairs = np.flatnonzero((ids[:-1] == vocabulary[first]) & (ids[1:] == vocabulary[second])
+                                       & (set_off[:-1] | set_off[1:]))
+                for index in pairs.tolist():
+                    flaws.append(_flaw(starts[index], ends[index + 1], "filler", f"{texts[index]} {texts[index + 1]}", 1.))
+
+        # Repetitions of one word ("I I") and of two-word phrases ("I was I was"); "um um" is two fillers
+        empty = vocabulary.get("", -1)
+        for index in np.flatnonzero((ids[1:] == ids[:-1]) & (ids[1:] != empty) & ~filler[1:]).tolist():
+            flaws.append(_flaw(starts[index], ends[index + 1], "repetition", f"{texts[index]} {texts[index + 1]}", 1.))
+        if len(ids) >= 4:
+            repeated = (ids[:-3] == ids[2:-1]) & (ids[1:-2] == ids[3:]) & (ids[:-3] != ids[1:-2])
+            for index in np.flatnonzero(repeated).tolist():
+                flaws.append(_flaw(starts[index], ends[index + 3], "repetition", " ".join(texts[index:index + 4]), 1.))
+
+        # Prolongations: duration per character, compared with the speaker's usual pace ("um" is drawn out anyway)
+        lengths = np.maximum([len(token) for token in tokens], 1)
+        pace_z = _robust_z((ends - starts) / lengths)
+        for index in np.flatnonzero((pace_z > PROLONGATION_Z) & ~filler).tolist():
+            flaws.append(_flaw(starts[index], ends[index], "prolongation", texts[index], float(pace_z[index])))
+
+        # Hesitations: pauses between consecutive words
+        gaps = gap_before[1:]
+        gap_z = _robust_z(gaps)
+        for index in np.flatnonzero((gaps >= HESITATION_MIN_SEC) & (gap_z > HESITATION_Z)).tolist():
+            flaws.append(_flaw(ends[index], starts[index + 1], "hesitation",
+                               f"{texts[index]} … {texts[index + 1]}", float(gaps[index])))
+
+        # Unclear words
+        if probabilities:
+            probability = np.array([probabilities.get(stamp, 1.) for stamp in stamps], dtype=float)
+            for index in np.flatnonzero(probability < LOW_PROBABILITY).tolist():
+                flaws.append(_flaw(starts[index], ends[index], "unclear", texts[index], float(probability[index])))
+
+        flaws.sort(key=lambda flaw: (flaw["start"], CATEGORIES.index(flaw["category"])))
+        logger.info(f"Found {len(flaws)} disfluencies in {len(items)} words")
+        return flaws
+    except Exception as e:
+        logger.error(f"Error in detect_disfluencies: {e}", exc_info=True)
+        raise
+
+
+def summarize_disfluencies(flaws: List[dict], words: Dict[TimeStamp, str]) -> dict:
+    """Counts per category, and disfluencies per minute of speech."""
+    counts = {category: 0 for category in CATEGORIES}
+    for flaw in flaws:
+        counts[flaw["category"]] += 1
+    if words:
+        times = list(words.keys())
+        minutes = (max(end for _, end in times) - min(start for start, _ in times)) / 60
+    else:
+        minutes = 0.
+    return {"counts": counts, "per_minute": round(len(flaws) / minutes, 2) if minutes > 0 else 0.}
@@ -0,0 +1,187 @@
+import numpy as np
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+from audio_buffer import AudioSource, as_audio_buffer, describe
+import read_volume
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+# "yin" (fast, voicing from loudness) or "pyin" (probabilistic voicing, several times slower)
+PITCH_TRACKER = os.getenv("PITCH_TRACKER", "yin")
+# Range of speaking voices, in Hz
+PITCH_FMIN = float(os.getenv("PITCH_FMIN", "65"))
+PITCH_FMAX = float(os.getenv("PITCH_FMAX", "400"))
+PITCH_FRAME_SEC = 0.064
+PITCH_HOP_SEC = 0.01
+# Frames per call to the pitch tracker, which holds a frame_length x frames matrix in memory
+PITCH_BLOCK_FRAMES = 6000
+# Pitch variability (robust standard deviation, in semitones) at which speech no longer counts as monotone at all
+MONOTONY_REFERENCE_ST = float(os.getenv("MONOTONY_REFERENCE_ST", "4.0"))
+# Windows with fewer voiced frames than this get no statistics
+MIN_VOICED_FRAMES = 10
+
+
+def track_pitch(audio: AudioSource, tracker: Optional[str] = None, fmin: float = PITCH_FMIN,
+                fmax: float = PITCH_FMAX) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Frame-level F0 of the audio, PITCH_HOP_SEC apart.
+
+    Frames are not centered, so frame i covers the same samples as frame i of
+    read_volume.compute_loudness with window PITCH_FRAME_SEC and hop PITCH_HOP_SEC. The audio
+    is tracked in blocks of PITCH_BLOCK_FRAMES frames, reading the buffer's samples in place.
+
+    Returns:
+        tuple: (frame start times including the buffer's offset, F0 in Hz with NaN where
+               unvoiced, frame loudness in dBFS)
+    """
+    import librosa
+    buffer = as_audio_buffer(audio)
+    samples, sample_rate = buffer.samples, buffer.sample_rate
+    frame_length = int(round(PITCH_FRAME_SEC * sample_rate))
+    hop = int(round(PITCH_HOP_SEC * sample_rate))
+    loudness = read_volume.compute_loudness(buffer, {"frames": (PITCH_FRAME_SEC, PITCH_HOP_SEC)}, normalization=None)["frames"]
+    n_frames = len(loudness.times)
+    tracker = tracker or PITCH_TRACKER
+
+    f0 = np.full(n_frames, np.nan)
+    for first in range(0, n_frames, PITCH_BLOCK_FRAMES):
+        count = min(PITCH_BLOCK_FRAMES, n_frames - first)
+        block = samples[first * hop:(first + count - 1) * hop + frame_length]
+        if tracker == "pyin":
+            block_f0, _, _ = librosa.pyin(block, fmin=fmin, fmax=fmax, sr=sample_rate, frame_length=frame_length,
+                                          hop_length=hop, center=False)
+        elif tracker == "yin":
+            block_f0 = librosa.yin(block, fmin=fmin, fmax=fmax, sr=sample_rate, frame_length=frame_length,
+                                   hop_length=hop, center=False)
+        else:
+            raise ValueError(f"Unknown pitch tracker '{tracker}', expected yin or pyin")
+        f0[first:first + len(block_f0)] = block_f0[:count]
+
+    if tracker == "yin":
+        # yin estimates a pitch for every frame: unvoiced frames are the quiet ones (by the same
+        # adaptive threshold as speech_to_text's silence detection) and those pinned to the range's edges
+        floor, speech = np.percentile(loudness.dbfs, [10, 90]) if n_frames else (0., 0.)
+        quiet = loudness.dbfs < floor + 0.3 * (speech - floor)
+        f0[quiet | (f0 <= fmin * 1.01) | (f0 >= fmax * 0.99)] = np.nan
+    return loudness.times, f0, loudness.dbfs
+
+
+def _semitones(f0: np.ndarray, reference: float) -> np.ndarray:
+    return 12 * np.log2(f0 / reference)
+
+
+def _group_percentiles(groups: np.ndarray, values: np.ndarray, n_groups: int, quantiles: List[float]) -> np.ndarray:
+    """Nearest-rank quantiles of values per group in one sort; NaN for empty groups. Shape (len(quantiles), n_groups)."""
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = np.full((len(quantiles), n_groups), np.nan)
+    present = counts > 0
+    for row, quantile in enumerate(quantiles):
+        ranks = offsets + np.floor(quantile * (counts - 1)).astype(int)
+        result[row, present] = sorted_values[ranks[present]]
+    return result
+
+
+def _group_correlations(groups: np.ndarray, x: np.ndarray, y: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Per group: count, and Pearson correlation of x and y, from bincount sums."""
+    def total(weights):
+        return np.bincount(groups, weights=weights, minlength=n_groups)
+    count = np.bincount(groups, minlength=n_groups).astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x, mean_y = total(x) / count, total(y) / count
+        var_x = total(x * x) / count - mean_x ** 2
+        var_y = total(y * y) / count - mean_y ** 2
+        cov = total(x * y) / count - mean_x * mean_y
+        correlation = cov / np.sqrt(np.maximum(var_x, 0.) * np.maximum(var_y, 0.))
+    return count, correlation
+
+
+def _monotony(std_semitones):
+    """1 for a flat pitch, 0 at MONOTONY_REFERENCE_ST of variation or more."""
+    return 1 - np.clip(std_semitones / MONOTONY_REFERENCE_ST, 0., 1.)
+
+
+def _values(array: np.ndarray, digits: int = 3) -> list:
+    """JSON-friendly list: rounded floats, None for NaN."""
+    return [None if np.isnan(value) else round(value, digits) for value in array.tolist()]
+
+
+def analyze_prosody(audio: AudioSource, window_sec: float = read_volume.REPORT_RESOLUTION[0],
+                    tracker: Optional[str] = None) -> Dict[str, object]:
+    """
+    Intonation of a recording: pitch level, range and variability, how monotone it is, and
+    how pitch moves with loudness, overall and per window.
+
+    Windows are the non-overlapping window_sec segments of read_volume's report resolution, so
+    the series line up with volume_points; "pitch_points" uses the same keys. Ranges and
+    variability are in semitones around the speaker's median pitch, so voices of any height
+    compare. energy_pitch_correlation is Pearson's r between loudness (dBFS) and pitch
+    (semitones) over voiced frames: expressive speakers tend to stress words with both.
+    """
+    source = describe(audio)
+    logger.info(f"analyze_prosody called for {source}")
+    try:
+        buffer = as_audio_buffer(audio)
+        times, f0, dbfs = track_pitch(buffer, tracker)
+        n_windows = len(buffer.samples) // int(round(window_sec * buffer.sample_rate))  # as read_volume's windows
+        window_times = buffer.offset_sec + np.arange(n_windows) * window_sec
+
+        voiced = ~np.isnan(f0)
+        groups = ((times[voiced] - buffer.offset_sec + PITCH_FRAME_SEC / 2) // window_sec).astype(int)
+        inside = groups < n_windows
+        groups, voiced_f0, voiced_dbfs = groups[inside], f0[voiced][inside], dbfs[voiced][inside]
+
+        if len(voiced_f0):
+            median_hz = float(np.median(voiced_f0))
+            semitones = _semitones(voiced_f0, median_hz)
+            p10, p90 = np.percentile(semitones, [10, 90])
+            # Robust standard deviation (1.4826 MAD), so octave errors of the tracker barely count
+            std = float(1.4826 * np.median(np.abs(semitones)))
+            correlation = float(np.corrcoef(voiced_dbfs, semitones)[0, 1]) if len(semitones) > 1 else np.nan
+        else:
+            median_hz, semitones = np.nan, voiced_f0
+            p10 = p90 = std = correlation = np.nan
+
+        # Per window: percentiles in one sort each, correlations from bincount sums
+        low, median, high = _group_percentiles(groups, semitones, n_windows, [0.1, 0.5, 0.9])
+        deviation = np.abs(semitones - median[groups]) if len(groups) else semitones
+        window_std = 1.4826 * _group_percentiles(groups, deviation, n_windows, [0.5])[0]
+        count, window_correlation = _group_correlations(groups, voiced_dbfs, semitones, n_windows)
+        too_few = count < MIN_VOICED_FRAMES
+        for series in (low, median, high, window_std, window_correlation):
+            series[too_few] = np.nan
+        window_median_hz = median_hz * 2 ** (median / 12)
+        frames_per_window = window_sec / PITCH_HOP_SEC
+
+        result = {
+            "median_pitch_hz": round(median_hz, 1) if not np.isnan(median_hz) else None,
+            "pitch_range_semitones": round(float(p90 - p10), 2) if len(voiced_f0) else None,
+            "pitch_std_semitones": round(std, 2) if len(voiced_f0) else None,
+            "monotony": round(float(_monotony(std)), 3) if len(voiced_f0) else None,
+            "energy_pitch_correlation": round(correlation, 3) if not np.isnan(correlation) else None,
+            "voiced_fraction": round(float(voiced.mean()), 3) if len(f0) else 0.,
+            "windows": {
+                "times": np.round(window_times, 3).tolist(),
+                "median_hz": _values(window_median_hz, 1),
+                "range_semitones": _values(high - low, 2),
+                "std_semitones": _values(window_std, 2),
+                "monotony": _values(_monotony(window_std)),
+                "energy_pitch_correlation": _values(window_correlation),
+                "voiced_fraction": _values(np.minimum(count / frames_per_window, 1.)),
+            },
+            "pitch_points": {f"{ts:g}": value for ts, value in zip(window_times.tolist(), _values(window_median_hz, 1))},
+        }
+        logger.info(f"Prosody of {source}: median {result['median_pitch_hz']} Hz, monotony {result['monotony']}")
+        return result
+    except Exception as e:
+        logger.error(f"Error in analyze_prosody for {source}: {e}", exc_info=True)
+        raise
@@ -1,6 +1,8 @@
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 from custom_types import TimeStamp
+import numpy as np
 import logging
+import os
 
 logging.basicConfig(
     level=logging.INFO,
@@ -10,26 +12,199 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Sliding windows of the "speech_rate" metrics: length and distance between window starts, in seconds
+RATE_WINDOW_SEC = float(os.getenv("RATE_WINDOW_SEC", "30"))
+RATE_HOP_SEC = float(os.getenv("RATE_HOP_SEC", "5"))
+# Silences between words shorter than this are part of articulation, not pauses
+MIN_PAUSE_SEC = float(os.getenv("MIN_PAUSE_SEC", "0.25"))
+LONG_PAUSE_SEC = float(os.getenv("LONG_PAUSE_SEC", "2.0"))
+# Lower edges of the pause histogram's bins in seconds; the last bin is open ended
+PAUSE_BINS = (0.25, 0.5, 1., 2., 3.)
+
+
+def word_times(words: Dict[TimeStamp, str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end times of the words as arrays, sorted by start time."""
+    times = np.array(list(words.keys()), dtype=float).reshape(-1, 2)
+    order = np.argsort(times[:, 0], kind="stable")
+    return times[order, 0], times[order, 1]
+
+
+def _rates(count: np.ndarray, seconds: np.ndarray) -> np.ndarray:
+    """Words per minute, 0 where there was no time to speak in."""
+    return np.divide(count * 60., seconds, out=np.zeros(len(seconds)), where=seconds > 0)
+
+
+class SpeechRateTracker:
+    """
+    Rate-of-speech metrics over word times that arrive in transcript order, e.g. from
+    speech_to_text.speech_to_words' on_words callback.
+
+    Pauses are the silences of at least MIN_PAUSE_SEC between consecutive words; their
+    histogram, total and the long pauses are updated from each new segment alone. Windows are
+    WPM over window-second spans starting every hop seconds, counting the words whose middle
+    falls inside; a window is final once a word starts after it, and only the windows still
+    open are recomputed by windows(). Articulation rate is the same count over the window's
+    speaking time, i.e. without its pauses.
+    """
+
+    def __init__(self, window: float = RATE_WINDOW_SEC, hop: float = RATE_HOP_SEC,
+                 min_pause: float = MIN_PAUSE_SEC, long_pause: float = LONG_PAUSE_SEC):
+        self.window = window
+        self.hop = hop
+        self.min_pause = min_pause
+        self.long_pause = long_pause
+        self._size = 0
+        self._starts = np.empty(1024)
+        self._ends = np.empty(1024)
+        self._last_end = -np.inf     # latest end time so far; words may overlap
+        self.pause_counts = np.zeros(len(PAUSE_BINS), dtype=int)
+        self.pause_count = 0
+        self.pause_total = 0.
+        self.long_pauses: List[dict] = []
+        # Pause boundaries and the pause time before each, to integrate pauses over any span
+        self._pause_edges: List[np.ndarray] = []
+        self._pause_before: List[np.ndarray] = []
+        self._pause_curve: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._final_windows: List[dict] = []
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self._starts[:self._size]
+
+    @property
+    def ends(self) -> np.ndarray:
+        return self._ends[:self._size]
+
+    def add_words(self, words: Dict[TimeStamp, str]) -> None:
+        if not words:
+            return
+        starts, ends = word_times(words)
+        if self._size and starts[0] < self._starts[self._size - 1]:
+            raise ValueError("Words must be added in transcript order")
+        size = self._size + len(starts)
+        if size > len(self._starts):
+            capacity = max(size, 2 * len(self._starts))
+            self._starts = np.resize(self._starts, capacity)
+            self._ends = np.resize(self._ends, capacity)
+        self._starts[self._size:size] = starts
+        self._ends[self._size:size] = ends
+        self._size = size
+
+        # Gaps to the latest end so far, so an overlapping word never opens a pause
+        latest = np.maximum.accumulate(np.concatenate(([self._last_end], ends)))
+        self._last_end = latest[-1]
+        gaps = starts - latest[:-1]
+        paused = (gaps >= self.min_pause) & np.isfinite(gaps)   # the first word has nothing before it
+        pause_starts, pause_lengths = latest[:-1][paused], gaps[paused]
+        bins = np.searchsorted(PAUSE_BINS, pause_lengths, side="right") - 1
+        self.pause_counts += np.bincount(bins[bins >= 0], minlength=len(PAUSE_BINS))
+        before = self.pause_total + np.concatenate(([0.], np.cumsum(pause_lengths)))
+        if len(pause_lengths):
+            self._pause_edges.append(np.column_stack((pause_starts, pause_starts + pause_lengths)).ravel())
+            self._pause_before.append(np.column_stack((before[:-1], before[1:])).ravel())
+            self._pause_curve = None
+        long = pause_lengths >= self.long_pause
+        self.long_pauses += [{"start": start, "end": start + length, "duration": length}
+                             for start, length in zip(pause_starts[long].tolist(), pause_lengths[long].tolist())]
+        self.pause_count += len(pause_lengths)
+        self.pause_total = float(before[-1])
+        self._finalize_windows()
+
+    def _pause_time(self, times: np.ndarray) -> np.ndarray:
+        """Pause time between the first word and each of the given times."""
+        if not self._pause_edges:
+            return np.zeros(len(times))
+        if self._pause_curve is None:
+            self._pause_curve = np.concatenate(self._pause_edges), np.concatenate(self._pause_before)
+        return np.interp(times, *self._pause_curve)
+
+    def _compute_windows(self, window_starts: np.ndarray) -> List[dict]:
+        starts, ends = self.starts, self.ends
+        middles = (starts + ends) / 2
+        counts = np.searchsorted(middles, window_starts + self.window) - np.searchsorted(middles, window_starts)
+        # Windows only cover the time from the first word to the end of speech so far
+        span_start = np.maximum(window_starts, starts[0])
+        span_end = np.minimum(window_starts + self.window, self._last_end)
+        length = np.maximum(span_end - span_start, 0.)
+        speaking = length - (self._pause_time(span_end) - self._pause_time(span_start))
+        wpm, articulation = _rates(counts, length), _rates(counts, np.maximum(speaking, 0.))
+        return [{"start": start, "wpm": rate, "articulation_wpm": articulation_rate}
+                for start, rate, articulation_rate in zip(window_starts.tolist(), wpm.tolist(), articulation.tolist())]
+
+    def _window_starts(self, first: int, stop: float) -> np.ndarray:
+        count = max(int(np.ceil(stop / self.hop)) - first, 0)
+        return (first + np.arange(count)) * self.hop
+
+    def _finalize_windows(self) -> None:
+        latest_start = self._starts[self._size - 1]
+        done = self._window_starts(len(self._final_windows), latest_start - self.window + 1e-9)
+        if len(done):
+            self._final_windows += self._compute_windows(done)
+
+    def windows(self) -> List[dict]:
+        """{"start", "wpm", "articulation_wpm"} for every window starting before the end of speech."""
+        if not self._size:
+            return []
+        return self._final_windows + self._compute_windows(
+            self._window_starts(len(self._final_windows), self._last_end))
+
+    def pause_histogram(self) -> List[dict]:
+        edges = list(PAUSE_BINS) + [None]
+        return [{"min": low, "max": high, "count": int(count)}
+                for low, high, count in zip(edges, edges[1:], self.pause_counts)]
+
+    def metrics(self) -> dict:
+        """Overall WPM and articulation rate, windows, pause histogram and long pauses."""
+        if not self._size:
+            speaking_time = duration = 0.
+        else:
+            duration = float(self._last_end - self._starts[0])
+            speaking_time = max(duration - self.pause_total, 0.)
+        wpm, articulation = _rates(np.array([self._size] * 2), np.array([duration, speaking_time])).tolist()
+        pauses = self.pause_count
+        return {
+            "words": self._size,
+            "duration": duration,
+            "speaking_time": speaking_time,
+            "wpm": wpm,
+            "articulation_wpm": articulation,
+            "pause_count": pauses,
+            "mean_pause": self.pause_total / pauses if pauses else 0.,
+            "pause_histogram": self.pause_histogram(),
+            "long_pauses": list(self.long_pauses),
+            "windows": self.windows(),
+        }
+
+
+def get_speech_rate_metrics(words: Dict[TimeStamp, str], window: float = RATE_WINDOW_SEC,
+                            hop: float = RATE_HOP_SEC) -> dict:
+    """SpeechRateTracker.metrics for a whole transcript."""
+    logger.info("get_speech_rate_metrics called")
+    try:
+        tracker = SpeechRateTracker(window, hop)
+        tracker.add_words(words)
+        result = tracker.metrics()
+        logger.info(f"{result['wpm']:.0f} WPM, {result['pause_count']} pauses, {len(result['long_pauses'])} long")
+        return result
+    except Exception as e:
+        logger.error(f"Error in get_speech_rate_metrics: {e}", exc_info=True)
+        raise
+
+
 def get_rate_of_speech(words: Dict[TimeStamp, str], interval: float = 10.) -> List[Tuple[float, float]]:
+    """
+    (interval start, words per second) for consecutive intervals from 0 to the last word.
+    Every word counts in the interval containing its middle, so intervals without speech
+    are reported as 0 rather than shifting the words after them.
+    """
     logger.info("get_rate_of_speech called")
     try:
-        result = []
-        wordcount = 0
-        current_time = 0
-
-        sorted_words = sorted(words.items(), key=lambda x: x[0][0])
-
-        for (_, end), _ in sorted_words:
-            wordcount += 1
-            if end > current_time + interval:
-                # Calculate words per minute for this interval
-                words_per_second = (wordcount / interval) 
-                result.append((current_time, words_per_second))
-                current_time += interval
-                wordcount = 0
-        if wordcount > 0:
-            words_per_second = (wordcount / interval)
-            result.append((current_time, words_per_second))
+        if not words:
+            return []
+        starts, ends = word_times(words)
+        buckets = ((starts + ends) / 2 // interval).astype(int)
+        counts = np.bincount(buckets)
+        result = [(index * interval, count / interval) for index, count in enumerate(counts.tolist())]
         logger.info("Successfully calculated rate of speech.")
         return result
     except Exception as e:
@@ -1,5 +1,7 @@
 import numpy as np
-from scipy.io import wavfile
+from math import gcd
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from audio_buffer import AudioSource, as_audio_buffer, describe
 import logging
 
 logging.basicConfig(
@@ -10,39 +12,121 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def get_rms_per_segment(audio_location: str, segment_duration_sec: float=2):
-    logger.info(f"get_rms_per_segment called for {audio_location}")
+# Named (window_sec, hop_sec) resolutions computed by default
+UI_RESOLUTION = (0.05, 0.05)
+REPORT_RESOLUTION = (2.0, 2.0)
+DEFAULT_RESOLUTIONS = {"ui": UI_RESOLUTION, "report": REPORT_RESOLUTION}
+
+DBFS_FLOOR = -120.0
+EPSILON = 1e-8
+
+
+class Loudness(NamedTuple):
+    """Framewise loudness at one resolution; all arrays have one entry per frame."""
+    times: np.ndarray       # frame start, seconds
+    rms: np.ndarray         # linear RMS of float samples in [-1, 1]
+    dbfs: np.ndarray        # 20*log10(rms), floored at DBFS_FLOOR
+    normalized: np.ndarray  # rms divided by the normalization reference
+
+
+def _block_energies(samples: np.ndarray, block: int) -> np.ndarray:
+    """Sum of squares over consecutive blocks of `block` samples (the tail is dropped), in one pass."""
+    n_blocks = len(samples) // block
+    blocks = samples[:n_blocks * block].reshape(n_blocks, block)
+    # einsum squares and sums without materializing a squared copy of the signal
+    return np.einsum('ij,ij->i', blocks, blocks, dtype=np.float64)
+
+
+def normalization_reference(rms: np.ndarray, method: Optional[str] = "median", percentile: float = 95.) -> float:
+    """
+    Reference level that RMS values are divided by.
+
+    Methods: "median" and "percentile" of non-silent frames (robust to a quiet
+    or noisy start), "peak", "first" (legacy: the first frame), None (no normalization).
+    """
+    if method is None or len(rms) == 0:
+        return 1.0
+    if method == "first":
+        reference = rms[0]
+    elif method == "peak":
+        reference = rms.max()
+    elif method in ("median", "percentile"):
+        voiced = rms[rms > EPSILON]
+        if len(voiced) == 0:
+            return 1.0
+        reference = np.median(voiced) if method == "median" else np.percentile(voiced, percentile)
+    else:
+        raise ValueError(f"Unknown normalization method: {method}")
+    return float(reference) if reference > EPSILON else EPSILON
+
+
+def compute_loudness(
+    audio: AudioSource,
+    resolutions: Optional[Dict[str, Tuple[float, float]]] = None,
+    normalization: Optional[str] = "median",
+    percentile: float = 95.,
+) -> Dict[str, Loudness]:
+    """
+    Vectorized RMS/dBFS at several (window_sec, hop_sec) resolutions at once.
+
+    The signal is squared and summed once per block of gcd(window, hop) samples;
+    every window is then a difference of two prefix sums over those blocks, so the
+    cost is a single pass over the audio however many resolutions are requested.
+
+    Args:
+        audio: AudioBuffer, mono samples or WAV path
+        resolutions: Maps a name to (window_sec, hop_sec); defaults to DEFAULT_RESOLUTIONS
+        normalization: See normalization_reference
+        percentile: Percentile used by the "percentile" normalization
+
+    Returns:
+        dict: Loudness per resolution name. Frame times include the buffer's offset.
+    """
+    buffer = as_audio_buffer(audio)
+    samples, sample_rate = buffer.samples, buffer.sample_rate
+    resolutions = resolutions or DEFAULT_RESOLUTIONS
+
+    prefix_sums: Dict[int, np.ndarray] = {}
+    result = {}
+    for name, (window_sec, hop_sec) in resolutions.items():
+        window = int(round(window_sec * sample_rate))
+        hop = int(round(hop_sec * sample_rate))
+        if window <= 0 or hop <= 0:
+            raise ValueError(f"Window and hop must be at least one sample, got {window_sec}s/{hop_sec}s")
+        block = gcd(window, hop)
+        if block not in prefix_sums:
+            prefix_sums[block] = np.concatenate(([0.0], np.cumsum(_block_energies(samples, block))))
+        cumulative = prefix_sums[block]
+
+        window_blocks, hop_blocks = window // block, hop // block
+        starts = np.arange(0, len(cumulative) - window_blocks, hop_blocks)
+        energy = cumulative[starts + window_blocks] - cumulative[starts]
+        rms = np.sqrt(np.maximum(energy, 0.0) / window)
+        dbfs = np.maximum(20 * np.log10(np.maximum(rms, EPSILON)), DBFS_FLOOR)
+        normalized = rms / normalization_reference(rms, normalization, percentile)
+        times = buffer.offset_sec + starts * (block / sample_rate)
+        result[name] = Loudness(times, rms, dbfs, normalized)
+    return result
+
+
+def get_rms_per_segment(audio_location: AudioSource, segment_duration_sec: float=2, normalization: Optional[str]="median") -> List[Tuple[float, float]]:
+    """
+    Normalized RMS per non-overlapping segment, as (segment start, value) pairs.
+    audio_location is an AudioBuffer (e.g. from video_to_vaw.decode_audio) or a WAV path.
+    """
+    source = describe(audio_location)
+    logger.info(f"get_rms_per_segment called for {source}")
     try:
-        sample_rate, data = wavfile.read(audio_location)
-
-        # Convert to mono if stereo
-        if len(data.shape) == 2:
-            data = data.mean(axis=1)
-
-        total_samples = len(data)
-        segment_samples = int(segment_duration_sec * sample_rate)
-        num_segments = total_samples // segment_samples
-
-        results = []
-
-        first_sample = None
-
-        for i in range(num_segments):
-            start = i * segment_samples
-            end = start + segment_samples
-            segment = data[start:end]
-            rms = np.sqrt(np.mean(segment**2))
-            if i == 0:
-                first_sample = rms.item() if rms.item() != 0 else 1e-8  # avoid division by zero
-            timestamp = i * segment_duration_sec
-            normalized_rms = rms.item() / first_sample if first_sample else 0.0
-            results.append((timestamp, normalized_rms))
-        
-        # print("RESULTS FROM READVOLUMEPY:", results)
-        logger.info(f"Successfully calculated RMS for {audio_location}")
+        loudness = compute_loudness(
+            audio_location,
+            {"segments": (segment_duration_sec, segment_duration_sec)},
+            normalization=normalization,
+        )["segments"]
+        results = [(i * segment_duration_sec, value) for i, value in enumerate(loudness.normalized.tolist())]
+        logger.info(f"Successfully calculated RMS for {source}")
         return results
     except Exception as e:
-        logger.error(f"Error in get_rms_per_segment for {audio_location}: {e}", exc_info=True)
+        logger.error(f"Error in get_rms_per_segment for {source}: {e}", exc_info=True)
         raise
 
 # path = "video_audios/scream.wav"
@@ -0,0 +1,148 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+import threading
+import logging
+from typing import Any, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "result_cache")
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1024 ** 3)))  # 1 GiB
+# Eviction goes this far below max_bytes, so a full cache is not rescanned on every write
+RESULT_CACHE_LOW_WATERMARK = 0.9
+# Writes between two full scans of the cache directory, which pick up what other processes wrote
+RESULT_CACHE_RESCAN_PUTS = int(os.getenv("RESULT_CACHE_RESCAN_PUTS", "256"))
+
+
+def make_key(*parts: Any) -> str:
+    """Stable SHA-256 key of JSON-serializable parts (anything else is keyed by its repr)."""
+    payload = json.dumps(parts, sort_keys=True, default=repr, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of per-stage results.
+
+    Each entry is one pickle file named after its key. Reads refresh the file's
+    modification time. Writes keep a running total of the cache's size; once it exceeds
+    max_bytes, the least recently used entries are evicted down to
+    RESULT_CACHE_LOW_WATERMARK of it. The directory is only scanned for that, and every
+    rescan_puts writes to account for entries other processes wrote. Entries are written
+    atomically, so several server processes can share one directory.
+    """
+
+    def __init__(self, root: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 rescan_puts: int = RESULT_CACHE_RESCAN_PUTS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.rescan_puts = rescan_puts
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None   # bytes, as of the last scan plus this process's writes
+        self._puts = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".pkl")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as entry:
+                value = pickle.load(entry)
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+            self.delete(key)
+            return default
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return value
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    @staticmethod
+    def _file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def put(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        replaced = self._file_size(path)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as entry:
+                pickle.dump(value, entry, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._puts += 1
+            rescan = self._size is None or self._puts % self.rescan_puts == 0
+            if self._size is not None:
+                self._size += self._file_size(path) - replaced
+            over = self._size is not None and self._size > self.max_bytes
+        if rescan or over:
+            self.evict()
+
+    def delete(self, key: str) -> None:
+        path = self._path(key)
+        size = self._file_size(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def evict(self) -> None:
+        """Scans the cache and, if it exceeds max_bytes, removes least recently used entries down to the low watermark."""
+        with self._lock:
+            entries = []
+            total = 0
+            for shard in os.scandir(self.root):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".pkl"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+            if total <= self.max_bytes:
+                self._size = total
+                return
+            target = self.max_bytes * RESULT_CACHE_LOW_WATERMARK
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            self._size = total
+            logger.info(f"Evicted result cache down to {total} bytes")
+
+
+result_cache: Optional[ResultCache] = (
+    ResultCache() if os.getenv("RESULT_CACHE", "1") != "0" else None
+)
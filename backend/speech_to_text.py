@@ -1,7 +1,12 @@
-from faster_whisper import WhisperModel
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 from custom_types import TimeStamp
+from audio_buffer import AudioBuffer, AudioSource, as_audio_buffer, describe
+import read_volume
+from model_registry import registry
+import numpy as np
 import logging
+import os
 
 # audio_path = "SoliyevShort.wav"
 
@@ -13,25 +18,211 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-model_size = "large-v3"
-model = WhisperModel(model_size, device="cpu", compute_type="int8")
+# Recordings longer than this are split on silence and transcribed chunk by chunk
+LONG_FORM_MIN_SEC = float(os.getenv("LONG_FORM_MIN_SEC", "120"))
+LONG_FORM_CHUNK_SEC = float(os.getenv("LONG_FORM_CHUNK_SEC", "60"))
+# "energy" (loudness-based, no extra model) or "vad" (faster-whisper's Silero VAD)
+LONG_FORM_SPLITTER = os.getenv("LONG_FORM_SPLITTER", "energy")
 
 
-def speech_to_words(audio_path: str) -> Dict[TimeStamp, str]:
-    logger.info(f"speech_to_words called with audio_path: {audio_path}")
+class WhisperPreset(NamedTuple):
+    model_size: str
+    beam_size: int      # 1 is greedy decoding
+    cpu_threads: int    # threads per model replica; 0 lets CTranslate2 decide
+    num_workers: int    # model replicas; long-form chunks are transcribed concurrently, one per replica
+    compute_type: str = "int8"
+
+
+# Quality/latency trade-offs, selectable per upload ("preset" form field) or with WHISPER_PRESET
+WHISPER_PRESETS: Dict[str, WhisperPreset] = {
+    "fast": WhisperPreset(model_size="base", beam_size=1, cpu_threads=2, num_workers=4),
+    "balanced": WhisperPreset(model_size="medium", beam_size=3, cpu_threads=4, num_workers=2),
+    "accurate": WhisperPreset(model_size="large-v3", beam_size=5, cpu_threads=0, num_workers=int(os.getenv("TRANSCRIBE_WORKERS", "2"))),
+}
+DEFAULT_PRESET = os.getenv("WHISPER_PRESET", "accurate")
+
+
+def get_preset(name: Optional[str] = None) -> WhisperPreset:
+    name = name or DEFAULT_PRESET
+    if name not in WHISPER_PRESETS:
+        raise ValueError(f"Unknown Whisper preset '{name}', expected one of {sorted(WHISPER_PRESETS)}")
+    return WHISPER_PRESETS[name]
+
+
+class Transcript(dict):
+    """
+    Words keyed by (start, end) time, as returned by speech_to_words, with Whisper's
+    probability of each word (0..1) under the same keys, e.g. for predict_flaws.
+    """
+
+    def __init__(self, words=(), probabilities: Optional[Dict[TimeStamp, float]] = None):
+        super().__init__(words)
+        self.probabilities: Dict[TimeStamp, float] = dict(probabilities or {})
+
+    def extend(self, other: Dict[TimeStamp, str]) -> None:
+        self.update(other)
+        self.probabilities.update(word_probabilities(other))
+
+
+def word_probabilities(words: Dict[TimeStamp, str]) -> Dict[TimeStamp, float]:
+    """Whisper's word probabilities of a transcript; empty for plain dicts."""
+    return getattr(words, "probabilities", {})
+
+
+def _whisper_loader(preset: WhisperPreset):
+    def load():
+        from faster_whisper import WhisperModel
+        return WhisperModel(preset.model_size, device="cpu", compute_type=preset.compute_type,
+                            cpu_threads=preset.cpu_threads, num_workers=preset.num_workers)
+    return load
+
+
+# One registry entry per preset, so several tiers can stay loaded side by side;
+# "all" in PRELOAD_MODELS/WARMUP_MODELS only loads the configured WHISPER_PRESET
+for _name, _preset in WHISPER_PRESETS.items():
+    registry.register(f"whisper:{_name}", _whisper_loader(_preset), in_all=_name == DEFAULT_PRESET)
+
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end (exclusive) indices of the runs of True in a boolean array."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def find_silences_by_energy(buffer: AudioBuffer, min_silence_sec: float = 0.3, frame_sec: float = 0.05) -> List[Tuple[float, float]]:
+    """
+    Silent stretches (start, end) in seconds relative to the buffer, from 50 ms loudness frames.
+    The threshold sits 30% of the way from the noise floor to the speech level, so it adapts to the recording.
+    """
+    frames = read_volume.compute_loudness(buffer, {"frames": (frame_sec, frame_sec)}, normalization=None)["frames"]
+    if len(frames.dbfs) == 0:
+        return []
+    floor, speech = np.percentile(frames.dbfs, [10, 90])
+    silent = frames.dbfs < floor + 0.3 * (speech - floor)
+    starts, ends = _runs(silent)
+    keep = (ends - starts) * frame_sec >= min_silence_sec
+    return list(zip((starts[keep] * frame_sec).tolist(), (ends[keep] * frame_sec).tolist()))
+
+
+def find_silences_by_vad(buffer: AudioBuffer, min_silence_sec: float = 0.3) -> List[Tuple[float, float]]:
+    """Gaps between the speech regions detected by faster-whisper's VAD, in seconds relative to the buffer."""
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    speech = get_speech_timestamps(buffer.samples, VadOptions(min_silence_duration_ms=int(min_silence_sec * 1000)))
+    silences = []
+    previous_end = 0.0
+    for region in speech:
+        start, end = region["start"] / buffer.sample_rate, region["end"] / buffer.sample_rate
+        if start > previous_end:
+            silences.append((previous_end, start))
+        previous_end = end
+    if previous_end < buffer.duration:
+        silences.append((previous_end, buffer.duration))
+    return silences
+
+
+def plan_chunks(duration: float, silences: List[Tuple[float, float]], target_sec: float = LONG_FORM_CHUNK_SEC) -> List[Tuple[float, float]]:
+    """
+    Splits [0, duration) into chunks of about target_sec, cutting in the middle of silences.
+    Falls back to a hard cut when no silence lies between half and one and a half target lengths.
+    Chunks that fall entirely inside a silence are dropped.
+    """
+    cuts = np.array([(start + end) / 2 for start, end in silences])
+    chunks = []
+    start = 0.0
+    while duration - start > target_sec * 1.5:
+        lo, hi = np.searchsorted(cuts, [start + target_sec * 0.5, start + target_sec * 1.5])
+        if hi > lo:
+            candidates = cuts[lo:hi]
+            end = float(candidates[np.argmin(np.abs(candidates - (start + target_sec)))])
+        else:
+            end = start + target_sec
+        chunks.append((start, end))
+        start = end
+    chunks.append((start, duration))
+
+    def is_silent(chunk):
+        return any(s <= chunk[0] and chunk[1] <= e for s, e in silences)
+    return [chunk for chunk in chunks if not is_silent(chunk)]
+
+
+def _transcribe(audio, offset: float = 0.0, preset: Optional[str] = None) -> Transcript:
+    model = registry.get(f"whisper:{preset or DEFAULT_PRESET}")
+    segments, _ = model.transcribe(audio, language="en", beam_size=get_preset(preset).beam_size, word_timestamps=True)
+
+    output = Transcript()
+
+    for segment in segments:
+        for word in segment.words or []:
+            start = round(word.start + offset, 2)
+            end = round(word.end + offset, 2)
+            text = word.word.strip()
+            # Only add if text is not empty
+            if text:
+                output[(start, end)] = text
+                output.probabilities[(start, end)] = round(word.probability, 3)
+    return output
+
+
+def _transcribe_buffer(buffer: AudioBuffer, preset: Optional[str] = None) -> Transcript:
+    if buffer.sample_rate != 16000:
+        raise ValueError(f"Whisper needs 16 kHz audio, got {buffer.sample_rate} Hz")
+    return _transcribe(buffer.samples, buffer.offset_sec, preset)
+
+
+def speech_to_words_long(audio: AudioSource, chunk_sec: float = LONG_FORM_CHUNK_SEC,
+                         splitter: str = LONG_FORM_SPLITTER, preset: Optional[str] = None,
+                         on_words: Optional[Callable[[Dict[TimeStamp, str]], None]] = None) -> Transcript:
+    """
+    Long-form transcription: splits the audio on silence into chunks of about chunk_sec and
+    transcribes them concurrently on the preset's model replicas. Word times are stitched back
+    onto the original timeline, so the result has the same shape as speech_to_words.
+    on_words receives each chunk's words in order as soon as that chunk and all earlier ones are done.
+    """
+    workers = get_preset(preset).num_workers
+    buffer = as_audio_buffer(audio)
+    if splitter == "vad":
+        silences = find_silences_by_vad(buffer)
+    else:
+        silences = find_silences_by_energy(buffer)
+    chunks = plan_chunks(buffer.duration, silences, chunk_sec)
+    logger.info(f"Long-form transcription of {buffer!r}: {len(chunks)} chunks on {workers} workers")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="whisper") as pool:
+        output = Transcript()
+        for part in pool.map(lambda chunk: _transcribe_buffer(buffer.slice(*chunk), preset), chunks):
+            output.extend(part)
+            if on_words is not None:
+                on_words(part)
+    return output
+
+
+def speech_to_words(audio_path: AudioSource, long_form: Optional[bool] = None, preset: Optional[str] = None,
+                    on_words: Optional[Callable[[Dict[TimeStamp, str]], None]] = None) -> Transcript:
+    """
+    Transcribes an audio file or a 16 kHz AudioBuffer into words keyed by (start, end) time.
+    Times of a sliced buffer are relative to the original recording. The result also carries
+    each word's probability (Transcript.probabilities).
+
+    long_form: Use speech_to_words_long; by default only for buffers longer than LONG_FORM_MIN_SEC.
+    preset: Name of a WHISPER_PRESETS entry; defaults to WHISPER_PRESET.
+    on_words: Called with the words in transcript order while transcription is still running
+              (per long-form chunk), e.g. to feed rate_of_speech.SpeechRateTracker.
+    """
+    logger.info(f"speech_to_words called with audio_path: {describe(audio_path)}, preset: {preset or DEFAULT_PRESET}")
     try:
-        segments, _ = model.transcribe(audio_path, language="en", beam_size=5, word_timestamps=True)
-
-        output = {}
-
-        for segment in segments:
-            for word in segment.words or []:
-                start = round(word.start, 2)
-                end = round(word.end, 2)
-                text = word.word.strip()
-                # Only add if text is not empty
-                if text:
-                    output[(start, end)] = text
+        get_preset(preset)
+        if isinstance(audio_path, str) and not long_form:
+            output = _transcribe(audio_path, preset=preset)
+        else:
+            buffer = as_audio_buffer(audio_path)
+            if long_form is None:
+                long_form = buffer.duration > LONG_FORM_MIN_SEC
+            if long_form:
+                output = speech_to_words_long(buffer, preset=preset, on_words=on_words)
+            else:
+                output = _transcribe_buffer(buffer, preset)
+        if on_words is not None and not long_form:
+            on_words(output)
 
         # for k, v in output.items():
         #     print(k, v)
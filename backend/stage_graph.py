@@ -0,0 +1,250 @@
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Sequence, Set, Tuple
+from result_cache import ResultCache, make_key
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+StageKind = Literal["thread", "process"]
+THREAD: StageKind = "thread"
+PROCESS: StageKind = "process"
+
+
+class Stage:
+    """
+    One node of the analysis graph.
+
+    ``fn`` is called with the results of ``deps`` as positional arguments, in order.
+    Thread stages suit I/O-bound work and native code that releases the GIL
+    (subprocesses, HTTP calls, CTranslate2, torch); process stages suit
+    CPU-bound Python work and need a picklable, module-level ``fn``.
+
+    With ``cache=True`` the result is stored in the result cache under a key derived
+    from the stage name, its ``version`` and the keys of its dependencies; bump
+    ``version`` whenever the stage's model or settings change. ``cache_if`` can veto
+    storing a result, e.g. the placeholder a stage returns when it failed softly.
+    """
+
+    def __init__(self, name: str, fn: Callable[..., Any], deps: Sequence[str] = (), kind: StageKind = THREAD,
+                 cache: bool = False, version: str = "1", cache_if: Optional[Callable[[Any], bool]] = None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.kind = kind
+        self.cache = cache
+        self.version = version
+        self.cache_if = cache_if
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, deps={self.deps}, kind={self.kind!r})"
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_MISSING = object()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Shared pool for process stages; spawned lazily so importing this module stays cheap."""
+    global _process_pool
+    if _process_pool is None:
+        workers = int(os.getenv("STAGE_PROCESS_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+        # spawn, not fork: the server process is multi-threaded and holds loaded models
+        _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+
+def shutdown_process_pool():
+    """Stops the worker processes, e.g. when the server shuts down; the next process stage starts new ones."""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def _timed_call(fn: Callable[..., Any], args: Tuple[Any, ...]) -> Tuple[Any, float]:
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def _check_graph(stages: Iterable[Stage], initial: Dict[str, Any]) -> Tuple[Dict[str, Stage], List[str]]:
+    """Validates the graph and returns the stages by name and in a topological order."""
+    by_name: Dict[str, Stage] = {}
+    for stage in stages:
+        if stage.name in by_name or stage.name in initial:
+            raise ValueError(f"Duplicate stage name: {stage.name}")
+        by_name[stage.name] = stage
+    for stage in by_name.values():
+        for dep in stage.deps:
+            if dep not in by_name and dep not in initial:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+
+    # Kahn's algorithm
+    order: List[str] = []
+    remaining = {name: {d for d in stage.deps if d in by_name} for name, stage in by_name.items()}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Cycle between stages: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+        order.extend(ready)
+    return by_name, order
+
+
+def _stage_keys(by_name: Dict[str, Stage], order: List[str], input_keys: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    Cache key per stage, chained through the keys of its dependencies, so that a
+    different input or an upstream version bump invalidates everything downstream.
+    Stages depending on an input without a key get None and are never cached.
+    """
+    keys: Dict[str, Optional[str]] = {
+        name: make_key("input", name, value) for name, value in input_keys.items()
+    }
+    for name in order:
+        stage = by_name[name]
+        dep_keys = [keys.get(dep) for dep in stage.deps]
+        keys[name] = None if None in dep_keys else make_key(name, stage.version, dep_keys)
+    return keys
+
+
+def _plan(by_name: Dict[str, Stage], outputs: Iterable[str], cached: Set[str]) -> Tuple[Set[str], Set[str]]:
+    """Stages to run and cached stages to load so that every output is available."""
+    to_run: Set[str] = set()
+    to_load: Set[str] = set()
+    stack = list(outputs)
+    while stack:
+        name = stack.pop()
+        if name not in by_name or name in to_run or name in to_load:
+            continue
+        if name in cached:
+            to_load.add(name)
+        else:
+            to_run.add(name)
+            stack.extend(by_name[name].deps)
+    return to_run, to_load
+
+
+def run_stages(
+    stages: List[Stage],
+    initial: Optional[Dict[str, Any]] = None,
+    on_stage: Optional[Callable[[str, str, Optional[float]], None]] = None,
+    max_threads: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+    input_keys: Optional[Dict[str, Any]] = None,
+    outputs: Optional[Iterable[str]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Runs a dependency graph of stages, starting every stage as soon as all of its
+    dependencies have finished.
+
+    Args:
+        stages: The stages to run.
+        initial: Named inputs that stages may depend on like on finished stages.
+            Stage results are added to this dict as they finish, so callers can
+            still clean up after partial results when a stage fails.
+        on_stage: Called as ``on_stage(name, state, elapsed_sec)`` when a stage starts
+            ("running"), finishes ("done"), raises ("failed"), is loaded from the cache
+            ("cached") or is not needed because everything depending on it was cached ("skipped").
+        max_threads: Size of the thread pool for thread stages (default: one per stage).
+        cache: Result cache for stages created with ``cache=True``.
+        input_keys: Content keys of the initial inputs (e.g. the upload's hash and the
+            settings), which cache keys are derived from.
+        outputs: Stages whose results are wanted (default: all). Other stages only run
+            when a wanted stage missing from the cache needs them.
+
+    Returns:
+        tuple: (results by stage name, wall time in seconds by stage name)
+
+    Raises:
+        The first exception raised by a stage, as soon as it is raised: stages that have not
+        started yet are cancelled and stages still running are not waited for.
+    """
+    results: Dict[str, Any] = initial if initial is not None else {}
+    by_name, order = _check_graph(stages, results)
+    timings: Dict[str, float] = {}
+    running: Dict[Future, Stage] = {}
+
+    def notify(name: str, state: str, elapsed: Optional[float] = None):
+        if on_stage is not None:
+            on_stage(name, state, elapsed)
+
+    keys: Dict[str, Optional[str]] = {}
+    cached: Set[str] = set()
+    if cache is not None:
+        keys = _stage_keys(by_name, order, input_keys or {})
+        cached = {name for name in order if by_name[name].cache and keys[name] and cache.contains(keys[name])}
+    to_run, to_load = _plan(by_name, by_name if outputs is None else outputs, cached)
+
+    for name in order:
+        if name in to_load:
+            value = cache.get(keys[name], _MISSING)
+            if value is _MISSING:
+                # Evicted since the plan was made: fall back to running the stage and whatever it needs
+                to_run.update(_plan(by_name, [name], set())[0] - set(results))
+                continue
+            results[name] = value
+            notify(name, "cached")
+    for name in order:
+        if name not in to_run and name not in results:
+            notify(name, "skipped")
+    pending = {name: by_name[name] for name in order if name in to_run and name not in results}
+
+    def store(stage: Stage):
+        key = keys.get(stage.name)
+        if cache is None or not stage.cache or key is None:
+            return
+        if stage.cache_if is not None and not stage.cache_if(results[stage.name]):
+            return
+        try:
+            cache.put(key, results[stage.name])
+        except Exception as e:
+            logger.warning(f"Could not cache the result of stage {stage.name}: {e}")
+
+    threads = ThreadPoolExecutor(max_workers=max_threads or max(1, len(by_name)), thread_name_prefix="stage")
+
+    def start_ready():
+        for name, stage in list(pending.items()):
+            if all(dep in results for dep in stage.deps):
+                del pending[name]
+                args = tuple(results[dep] for dep in stage.deps)
+                pool = get_process_pool() if stage.kind == PROCESS else threads
+                notify(name, "running")
+                running[pool.submit(_timed_call, stage.fn, args)] = stage
+
+    try:
+        start_ready()
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    results[stage.name], timings[stage.name] = future.result()
+                except Exception:
+                    notify(stage.name, "failed")
+                    logger.error(f"Stage {stage.name} failed; timings so far: {timings}")
+                    raise
+                store(stage)
+                notify(stage.name, "done", timings[stage.name])
+                logger.info(f"Stage {stage.name} finished in {timings[stage.name]:.2f}s")
+            start_ready()
+    except BaseException:
+        # Fail right away: queued stages are dropped and stages still running finish in the background, unused
+        for future in running:
+            future.cancel()
+        threads.shutdown(wait=False, cancel_futures=True)
+        raise
+    threads.shutdown()
+
+    return results, timings
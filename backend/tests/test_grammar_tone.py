@@ -0,0 +1,34 @@
+import pytest
+
+from done_with_some_llm import grammar_tone
+from done_with_some_llm.grammar_tone import OpenRouterBackend
+
+
+class StubClient:
+    """Stands in for openrouter_service, answering every request with the same JSON."""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.requests = 0
+
+    def post_json(self, path, **kwargs):
+        self.requests += 1
+        return self.answer
+
+
+@pytest.mark.parametrize("answer", [{}, {"choices": []}, {"choices": [{"message": {"content": None}}]}])
+def test_malformed_answers_leave_sentences_unchecked(monkeypatch, answer):
+    client = StubClient(answer)
+    monkeypatch.setattr(grammar_tone, "API_KEY", "test-key")
+    monkeypatch.setattr(grammar_tone, "openrouter_service", client)
+    backend = OpenRouterBackend(chunk_chars=20, workers=2)
+    assert backend.sentence_edits(["I goes home.", "She were late."]) == [None, None]
+    assert client.requests == 2
+
+
+def test_corrections_are_located_per_sentence(monkeypatch):
+    content = '"goes" should be "go"\n"were" should be "was"'
+    monkeypatch.setattr(grammar_tone, "API_KEY", "test-key")
+    monkeypatch.setattr(grammar_tone, "openrouter_service", StubClient({"choices": [{"message": {"content": content}}]}))
+    edits = OpenRouterBackend().sentence_edits(["I goes home.", "She were late."])
+    assert edits == [[grammar_tone.Edit(2, 6, "go")], [grammar_tone.Edit(4, 8, "was")]]
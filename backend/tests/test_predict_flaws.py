@@ -0,0 +1,82 @@
+import pytest
+
+from predict_flaws import detect_disfluencies, summarize_disfluencies
+
+
+def _transcript(words, word=0.3, gap=0.05):
+    """Evenly paced words; a (text, seconds) entry lasts that long, a None entry is a 2 s pause."""
+    result, time = {}, 0.
+    for entry in words:
+        if entry is None:
+            time += 2.
+            continue
+        text, length = entry if isinstance(entry, tuple) else (entry, word)
+        result[(round(time, 3), round(time + length, 3))] = text
+        time += length + gap
+    return result
+
+
+def _found(flaws, category):
+    return [flaw["text"] for flaw in flaws if flaw["category"] == category]
+
+
+FLUENT = "so today we are going to talk about the results of our study and what they mean".split()
+
+
+def test_fluent_speech_has_no_disfluencies():
+    assert detect_disfluencies(_transcript(FLUENT)) == []
+
+
+def test_fillers_and_filler_phrases():
+    words = _transcript(["um,"] + FLUENT[:6] + ["uh"] + FLUENT[6:10] + ["you", "know,"] + FLUENT[10:])
+    assert _found(detect_disfluencies(words), "filler") == ["um,", "uh", "you know,"]
+
+
+def test_ambiguous_fillers_need_a_pause_or_comma():
+    words = _transcript(["i", "like", "the", "results,", "like,", "they", "are"] + FLUENT)
+    assert _found(detect_disfluencies(words), "filler") == ["like,"]
+
+
+def test_repeated_words_and_phrases():
+    words = _transcript(["i", "I", "think", "it", "was", "it", "was", "good"] + FLUENT)
+    assert _found(detect_disfluencies(words), "repetition") == ["i I", "it was it was"]
+
+
+def test_repeated_fillers_are_fillers_only():
+    flaws = detect_disfluencies(_transcript(["um", "um"] + FLUENT))
+    assert _found(flaws, "filler") == ["um", "um"] and _found(flaws, "repetition") == []
+
+
+def test_prolonged_word():
+    flaws = detect_disfluencies(_transcript(FLUENT[:4] + [("going", 1.8)] + FLUENT[5:]))
+    assert _found(flaws, "prolongation") == ["going"]
+
+
+def test_unusual_pause_is_a_hesitation():
+    flaws = detect_disfluencies(_transcript(FLUENT[:8] + [None] + FLUENT[8:]))
+    hesitation, = [flaw for flaw in flaws if flaw["category"] == "hesitation"]
+    assert hesitation["text"] == "about … the"
+    assert hesitation["score"] == pytest.approx(2.05)
+
+
+def test_low_probability_words_are_unclear():
+    words = _transcript(FLUENT)
+    stamps = list(words)
+    probabilities = {stamp: 0.9 for stamp in stamps}
+    probabilities[stamps[3]] = 0.2
+    assert _found(detect_disfluencies(words, probabilities), "unclear") == ["are"]
+
+
+def test_results_are_sorted_and_summarized():
+    words = _transcript(["um"] + FLUENT[:8] + [None] + ["the", "the"] + FLUENT[9:])
+    flaws = detect_disfluencies(words)
+    assert [flaw["start"] for flaw in flaws] == sorted(flaw["start"] for flaw in flaws)
+    summary = summarize_disfluencies(flaws, words)
+    assert summary["counts"] == {"filler": 1, "repetition": 1, "prolongation": 0, "hesitation": 1, "unclear": 0}
+    minutes = (max(end for _, end in words) - min(start for start, _ in words)) / 60
+    assert summary["per_minute"] == pytest.approx(3 / minutes, abs=0.01)
+
+
+def test_empty_transcript():
+    assert detect_disfluencies({}) == []
+    assert summarize_disfluencies([], {})["per_minute"] == 0.
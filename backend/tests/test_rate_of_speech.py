@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from rate_of_speech import SpeechRateTracker, get_rate_of_speech, get_speech_rate_metrics
+
+
+def _words(times):
+    return {(start, end): f"w{i}" for i, (start, end) in enumerate(times)}
+
+
+def _steady(count, start=0., word=0.3, gap=0.1):
+    return [(start + i * (word + gap), start + i * (word + gap) + word) for i in range(count)]
+
+
+def test_overall_rates_and_pauses():
+    # 10 words, a 3 s pause, 10 more words
+    times = _steady(10) + _steady(10, start=6.9)
+    metrics = get_speech_rate_metrics(_words(times))
+
+    duration = times[-1][1] - times[0][0]
+    assert metrics["words"] == 20
+    assert metrics["duration"] == pytest.approx(duration)
+    assert metrics["pause_count"] == 1   # gaps of 0.1 s are articulation, not pauses
+    assert metrics["speaking_time"] == pytest.approx(duration - 3.)
+    assert metrics["wpm"] == pytest.approx(20 * 60 / duration)
+    assert metrics["articulation_wpm"] == pytest.approx(20 * 60 / (duration - 3.))
+    assert metrics["long_pauses"] == [pytest.approx({"start": 3.9, "end": 6.9, "duration": 3.})]
+    assert [bin["count"] for bin in metrics["pause_histogram"]] == [0, 0, 0, 0, 1]
+
+
+def test_pause_histogram_bins():
+    starts = np.cumsum([0., 0.5, 0.6, 0.9, 1.5, 2.5, 4.])   # gaps of 0.2 .. 3.5 s after 0.3 s words
+    metrics = get_speech_rate_metrics(_words([(start, start + 0.3) for start in starts]))
+    assert [bin["count"] for bin in metrics["pause_histogram"]] == [1, 1, 1, 1, 1]
+    assert metrics["pause_histogram"][-1]["max"] is None
+    assert metrics["pause_count"] == 5
+
+
+def test_overlapping_words_open_no_pause():
+    metrics = get_speech_rate_metrics(_words([(0., 2.), (0.5, 1.), (1.5, 2.5)]))
+    assert metrics["pause_count"] == 0
+
+
+def test_windows_count_words_by_their_middle():
+    tracker = SpeechRateTracker(window=10., hop=5.)
+    tracker.add_words(_words(_steady(50)))   # 50 words in 20 s
+    windows = tracker.windows()
+    assert [window["start"] for window in windows] == [0., 5., 10., 15.]
+    assert windows[0]["wpm"] == pytest.approx(25 * 6)
+    # The last window is cut at the end of speech, 19.9 s
+    assert windows[-1]["wpm"] == pytest.approx(12 * 60 / 4.9)
+
+
+def test_streamed_segments_match_one_batch():
+    rng = np.random.default_rng(1)
+    starts = np.cumsum(rng.exponential(0.45, 400))
+    times = [(float(start), float(start + length)) for start, length in zip(starts, rng.uniform(0.1, 0.4, 400))]
+    whole = get_speech_rate_metrics(_words(times))
+
+    tracker = SpeechRateTracker()
+    for first in range(0, len(times), 37):
+        tracker.add_words(_words(times[first:first + 37]))
+    streamed = tracker.metrics()
+
+    assert streamed["windows"] == pytest.approx(whole["windows"])
+    for key in ("words", "wpm", "articulation_wpm", "pause_count", "mean_pause", "pause_histogram"):
+        assert streamed[key] == pytest.approx(whole[key])
+
+
+def test_words_must_arrive_in_order():
+    tracker = SpeechRateTracker()
+    tracker.add_words(_words([(5., 5.5)]))
+    with pytest.raises(ValueError):
+        tracker.add_words(_words([(1., 1.5)]))
+
+
+def test_empty_transcript():
+    metrics = get_speech_rate_metrics({})
+    assert metrics["words"] == 0 and metrics["wpm"] == 0. and metrics["windows"] == []
+
+
+def test_rate_of_speech_keeps_silent_intervals():
+    words = _words(_steady(5) + _steady(5, start=25.))
+    assert get_rate_of_speech(words, interval=10.) == [(0., 0.5), (10., 0.), (20., 0.5)]
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from audio_buffer import AudioBuffer
+from read_volume import compute_loudness, get_rms_per_segment, normalization_reference
+
+
+def legacy_rms_per_segment(data, sample_rate, segment_duration_sec=2):
+    """The per-segment loop get_rms_per_segment replaced, normalized by the first segment."""
+    segment_samples = int(segment_duration_sec * sample_rate)
+    results = []
+    first_sample = None
+    for i in range(len(data) // segment_samples):
+        segment = data[i * segment_samples:(i + 1) * segment_samples]
+        rms = np.sqrt(np.mean(segment ** 2))
+        if i == 0:
+            first_sample = rms.item() if rms.item() != 0 else 1e-8
+        results.append((i * segment_duration_sec, rms.item() / first_sample))
+    return results
+
+
+@pytest.fixture
+def speech_like():
+    # 21.3 s of noise whose level changes every second, with a partial segment at the end
+    rng = np.random.default_rng(0)
+    sample_rate = 16000
+    levels = np.repeat(rng.uniform(0.05, 0.8, 22), sample_rate)[:int(21.3 * sample_rate)]
+    return (rng.standard_normal(len(levels)) * levels).astype(np.float32), sample_rate
+
+
+@pytest.mark.parametrize("segment_sec", [2, 0.5, 3])
+def test_matches_the_legacy_loop(speech_like, segment_sec):
+    samples, sample_rate = speech_like
+    expected = legacy_rms_per_segment(samples.astype(np.float64), sample_rate, segment_sec)
+    actual = get_rms_per_segment(AudioBuffer(samples, sample_rate), segment_sec, normalization="first")
+    assert [time for time, _ in actual] == [time for time, _ in expected]
+    np.testing.assert_allclose([value for _, value in actual], [value for _, value in expected], rtol=1e-5)
+
+
+def test_matches_the_legacy_loop_on_an_int16_wav(speech_like, tmp_path):
+    samples, sample_rate = speech_like
+    pcm = np.clip(samples * 32767, -32768, 32767).astype(np.int16)
+    path = str(tmp_path / "speech.wav")
+    wavfile.write(path, sample_rate, pcm)
+    expected = legacy_rms_per_segment(pcm.astype(np.float64), sample_rate)
+    actual = get_rms_per_segment(path, normalization="first")
+    np.testing.assert_allclose([value for _, value in actual], [value for _, value in expected], rtol=1e-5)
+
+
+def test_resolutions_share_one_pass_and_match_direct_rms(speech_like):
+    samples, sample_rate = speech_like
+    result = compute_loudness(AudioBuffer(samples, sample_rate, offset_sec=10.),
+                              {"overlapping": (0.064, 0.01), "report": (2., 2.)}, normalization=None)
+    frames = result["overlapping"]
+    window, hop = int(0.064 * sample_rate), int(0.01 * sample_rate)
+    assert len(frames.times) == (len(samples) - window) // hop + 1
+    for index in (0, 7, len(frames.times) - 1):
+        segment = samples[index * hop:index * hop + window].astype(np.float64)
+        assert frames.rms[index] == pytest.approx(np.sqrt(np.mean(segment ** 2)), rel=1e-5)
+        assert frames.times[index] == pytest.approx(10. + index * 0.01)
+    assert np.array_equal(result["report"].normalized, result["report"].rms)
+
+
+def test_silence_is_floored():
+    loudness = compute_loudness(np.zeros(16000, dtype=np.float32), {"frames": (0.1, 0.1)})["frames"]
+    assert np.all(loudness.dbfs == -120.)
+    assert np.all(loudness.normalized == 0.)
+
+
+def test_normalization_references():
+    rms = np.array([0., 0.1, 0.2, 0.4, 0.8])
+    assert normalization_reference(rms, "first") == pytest.approx(1e-8)  # silent first frame
+    assert normalization_reference(rms, "peak") == 0.8
+    assert normalization_reference(rms, "median") == pytest.approx(0.3)   # of the non-silent frames
+    assert normalization_reference(rms, None) == 1.
+    with pytest.raises(ValueError):
+        normalization_reference(rms, "loudest")
@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+
+from result_cache import ResultCache, make_key
+
+
+def _disk_size(root):
+    return sum(entry.stat().st_size for shard in os.scandir(root) if shard.is_dir()
+               for entry in os.scandir(shard.path) if entry.name.endswith(".pkl"))
+
+
+def _age(cache, key, seconds):
+    """Moves an entry's last use into the past, as mtime resolution may not tell quick writes apart."""
+    path = cache._path(key)
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+def test_make_key_is_stable_and_order_independent_for_dicts():
+    assert make_key("stage", "1", {"a": 1, "b": 2}) == make_key("stage", "1", {"b": 2, "a": 1})
+    assert make_key("stage", "1", ["x"]) != make_key("stage", "2", ["x"])
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = make_key("transcription", "1", "sha")
+    assert cache.get(key) is None
+    assert cache.get(key, "missing") == "missing"
+    assert not cache.contains(key)
+
+    cache.put(key, {"words": [(0.0, 0.5, "hi")]})
+    assert cache.contains(key)
+    assert cache.get(key) == {"words": [(0.0, 0.5, "hi")]}
+    # Another cache on the same directory (another server process) sees the entry
+    assert ResultCache(str(tmp_path)).get(key) == {"words": [(0.0, 0.5, "hi")]}
+
+
+def test_unreadable_entry_is_a_miss_and_dropped(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = make_key("broken")
+    cache.put(key, 1)
+    with open(cache._path(key), "wb") as entry:
+        entry.write(b"not a pickle")
+    assert cache.get(key, "missing") == "missing"
+    assert not cache.contains(key)
+
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=13_000)   # room for four entries
+    keys = [make_key("entry", i) for i in range(4)]
+    for age, key in zip((40, 30, 20, 10), keys):
+        cache.put(key, b"x" * 3000)
+        _age(cache, key, age)
+    cache.get(keys[0])   # the oldest entry is read, so it becomes the most recently used
+
+    cache.put(make_key("entry", 4), b"x" * 3000)
+
+    assert cache.contains(keys[0])
+    assert not cache.contains(keys[1]) and not cache.contains(keys[2])
+    assert cache.contains(keys[3]) and cache.contains(make_key("entry", 4))
+    assert _disk_size(str(tmp_path)) <= 13_000 * 0.9
+
+
+@pytest.mark.parametrize("rescan_puts", [1, 4, 1000])
+def test_running_size_matches_the_directory(tmp_path, rescan_puts):
+    cache = ResultCache(str(tmp_path), max_bytes=20_000, rescan_puts=rescan_puts)
+    for i in range(60):
+        cache.put(make_key("entry", i % 45), b"x" * (100 + 37 * i))   # some writes replace entries
+        if i % 7 == 0:
+            cache.delete(make_key("entry", i // 2))
+        assert cache._size == _disk_size(str(tmp_path))
+        assert cache._size <= 20_000
+
+
+def test_scans_only_when_due_or_full(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_bytes=10 ** 9, rescan_puts=10)
+    scans = []
+    original = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: (scans.append(1), original()))
+    for i in range(25):
+        cache.put(make_key("entry", i), i)
+    assert len(scans) == 3   # the first write, then every tenth
@@ -0,0 +1,165 @@
+import math
+import threading
+import time
+
+import pytest
+
+from result_cache import ResultCache
+from stage_graph import PROCESS, Stage, run_stages
+
+
+class Recorder:
+    """on_stage callback that keeps the (name, state) events in order."""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, name, state, elapsed):
+        with self._lock:
+            self.events.append((name, state))
+
+    def states(self, name):
+        return [state for stage, state in self.events if stage == name]
+
+    def index(self, name, state):
+        return self.events.index((name, state))
+
+
+def test_dependencies_finish_first_and_results_are_passed_in_order():
+    recorder = Recorder()
+    stages = [
+        Stage("sum", lambda a, b: a + b, deps=["double", "square"]),
+        Stage("double", lambda x: 2 * x, deps=["x"]),
+        Stage("square", lambda x: x * x, deps=["x"]),
+        Stage("describe", lambda total, x: f"{x} -> {total}", deps=["sum", "x"]),
+    ]
+    results, timings = run_stages(stages, {"x": 3}, on_stage=recorder)
+
+    assert results == {"x": 3, "double": 6, "square": 9, "sum": 15, "describe": "3 -> 15"}
+    assert set(timings) == {"double", "square", "sum", "describe"}
+    for stage in stages:
+        assert recorder.states(stage.name) == ["running", "done"]
+        for dep in stage.deps:
+            if dep != "x":
+                assert recorder.index(dep, "done") < recorder.index(stage.name, "running")
+
+
+def test_independent_stages_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def meet(x):
+        barrier.wait()   # raises BrokenBarrierError if the other stage never runs alongside
+        return x
+
+    results, _ = run_stages([Stage("a", meet, deps=["x"]), Stage("b", meet, deps=["x"])], {"x": 1})
+    assert results["a"] == results["b"] == 1
+
+
+def test_process_stage():
+    results, _ = run_stages([Stage("root", math.sqrt, deps=["x"], kind=PROCESS),
+                             Stage("twice", lambda root: 2 * root, deps=["root"])], {"x": 16.})
+    assert results["twice"] == 8.
+
+
+def test_failure_propagates_and_dependents_never_run():
+    recorder = Recorder()
+    ran = []
+
+    def fail(x):
+        raise RuntimeError("decoder crashed")
+
+    def slow(x):
+        time.sleep(0.2)
+        return x
+
+    stages = [
+        Stage("audio", fail, deps=["x"]),
+        Stage("transcription", lambda audio: ran.append("transcription"), deps=["audio"]),
+        Stage("video", slow, deps=["x"]),
+    ]
+    initial = {"x": 1}
+    with pytest.raises(RuntimeError, match="decoder crashed"):
+        run_stages(stages, initial, on_stage=recorder)
+
+    assert recorder.states("audio") == ["running", "failed"]
+    assert recorder.states("transcription") == []
+    assert ran == []
+    # Results are added to the caller's dict as they finish, so partial results can be cleaned up
+    assert "audio" not in initial
+
+
+def test_failure_does_not_wait_for_running_stages():
+    release = threading.Event()
+    ran = []
+
+    def fail(x):
+        time.sleep(0.05)
+        raise RuntimeError("decoder crashed")
+
+    stages = [
+        Stage("audio", fail, deps=["x"]),
+        Stage("video", lambda x: release.wait(5), deps=["x"]),
+        Stage("face", lambda video: ran.append("face"), deps=["video"]),
+    ]
+    started = time.perf_counter()
+    try:
+        with pytest.raises(RuntimeError, match="decoder crashed"):
+            run_stages(stages, {"x": 1})
+        assert time.perf_counter() - started < 2
+    finally:
+        release.set()
+    time.sleep(0.1)
+    # The abandoned stage finished, but nothing is started after the failure
+    assert ran == []
+
+
+@pytest.mark.parametrize("stages, message", [
+    ([Stage("a", abs, deps=["missing"])], "unknown stage"),
+    ([Stage("a", abs, deps=["x"]), Stage("a", abs, deps=["x"])], "Duplicate"),
+    ([Stage("x", abs)], "Duplicate"),
+    ([Stage("a", abs, deps=["b"]), Stage("b", abs, deps=["a"])], "Cycle"),
+])
+def test_invalid_graphs_are_rejected(stages, message):
+    with pytest.raises(ValueError, match=message):
+        run_stages(stages, {"x": 1})
+
+
+def test_cached_stages_are_loaded_and_their_inputs_skipped(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    calls = []
+
+    def stages(version="1"):
+        return [
+            Stage("decode", lambda x: calls.append("decode") or x * 10, deps=["x"]),
+            Stage("analyze", lambda audio: calls.append("analyze") or audio + 1, deps=["decode"],
+                  cache=True, version=version),
+            Stage("report", lambda result: calls.append("report") or f"result {result}", deps=["analyze"]),
+        ]
+
+    first, _ = run_stages(stages(), {"x": 1}, cache=cache, input_keys={"x": "sha-1"})
+    assert first["report"] == "result 11" and calls == ["decode", "analyze", "report"]
+
+    calls.clear()
+    recorder = Recorder()
+    second, _ = run_stages(stages(), {"x": 1}, on_stage=recorder, cache=cache, input_keys={"x": "sha-1"},
+                           outputs=["report"])
+    assert second["report"] == "result 11" and calls == ["report"]
+    assert recorder.states("analyze") == ["cached"]
+    assert recorder.states("decode") == ["skipped"]
+
+    # A new input or a version bump misses the cache
+    for input_key, version in (("sha-2", "1"), ("sha-1", "2")):
+        calls.clear()
+        run_stages(stages(version), {"x": 1}, cache=cache, input_keys={"x": input_key})
+        assert calls == ["decode", "analyze", "report"]
+
+
+def test_cache_if_vetoes_storing(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    calls = []
+    stage = Stage("grammar", lambda x: calls.append(x) or {"error": "unreachable"}, deps=["x"],
+                  cache=True, cache_if=lambda result: "error" not in result)
+    for _ in range(2):
+        run_stages([stage], {"x": 1}, cache=cache, input_keys={"x": "sha"})
+    assert calls == [1, 1]
@@ -0,0 +1,133 @@
+import random
+
+import timestamped_punctuation
+from timestamped_punctuation import (ALIGN_BAND, AlignedWord, align_tokens, align_words_to_text, spans_to_times,
+                                     text_word_spans, timestamp_punctuation_to_index)
+
+
+def _transcript(words, step=0.5):
+    return {(i * step, (i + 1) * step): word for i, word in enumerate(words)}
+
+
+def test_text_word_spans_strip_punctuation_and_keep_contractions():
+    text = "Well, I don't know... 3.5 times?"
+    assert [text[start:end] for start, end in text_word_spans(text)] == ["Well", "I", "don't", "know", "3.5", "times"]
+
+
+def test_identical_tokens_align_one_to_one():
+    tokens = ["we", "can", "do", "it"]
+    assert align_tokens(tokens, ["We", "can,", "do", "it."]) == [0, 1, 2, 3]
+
+
+def test_inserted_target_tokens_are_skipped():
+    assert align_tokens(["a", "b", "c"], ["a", "uh", "b", "c"]) == [0, 2, 3]
+
+
+def test_dropped_source_tokens_align_to_none():
+    assert align_tokens(["a", "b", "c", "d"], ["a", "c", "d"]) == [0, None, 1, 2]
+
+
+def test_empty_inputs():
+    assert align_tokens([], ["a"]) == []
+    assert align_tokens(["a", "b"], []) == [None, None]
+
+
+def test_hyphenated_word_maps_to_the_piece_it_starts():
+    # The punctuation model joined "well known"; the transcript split "so-called"
+    text = "Well-known facts are so called facts."
+    aligned = align_words_to_text(_transcript(["well", "known", "facts", "are", "so-called", "facts"]), text)
+    by_time = {word.start_time: text[word.start:word.end] for word in aligned}
+    assert by_time == {0.0: "Well-known", 1.0: "facts", 1.5: "are", 2.0: "so", 2.5: "facts"}
+
+
+def test_contraction_and_inserted_filler():
+    text = "Uh, we don't really care."
+    aligned = align_words_to_text(_transcript(["we", "dont", "care"]), text)
+    assert [text[word.start:word.end] for word in aligned] == ["we", "don't", "care"]
+    assert [word.start_time for word in aligned] == [0.0, 0.5, 1.0]
+
+
+def test_narrow_band_is_widened_until_it_matches_the_full_alignment():
+    source = [f"w{i}" for i in range(200)]
+    # 60 inserted words up front push the text far off the diagonal of a 4-word band
+    target = [f"x{i}" for i in range(60)] + source[:100] + source[130:]
+    assert align_tokens(source, target, band=4) == align_tokens(source, target, band=10_000)
+
+
+def _edited(source, rng, edits):
+    """source with random insertions, deletions and substitutions, sometimes shifted or with a long insertion."""
+    target = list(source)
+    for _ in range(edits):
+        position = rng.randrange(len(target) + 1)
+        edit = rng.random()
+        if edit < 0.4:
+            target.insert(position, f"new{rng.randrange(100)}")
+        elif edit < 0.7 and position < len(target):
+            del target[position]
+        elif position < len(target):
+            target[position] = "changed"
+    shape = rng.random()
+    if shape < 0.2:
+        target = ["inserted"] * rng.randrange(60) + target
+    elif shape < 0.4:
+        shift = rng.randrange(30)
+        target = ["inserted"] * shift + target[:len(target) - shift]
+    return target
+
+
+def _cost(source, target, alignment):
+    normalize = timestamped_punctuation._normalize
+    matched = [index for index in alignment if index is not None]
+    cost = timestamped_punctuation._GAP * (len(source) + len(target) - 2 * len(matched))
+    for token, index in zip(source, alignment):
+        if index is not None and normalize(token) != normalize(target[index]):
+            same_initial = normalize(token)[:1] == normalize(target[index])[:1]
+            cost += timestamped_punctuation._NEAR_SUBSTITUTION if same_initial else timestamped_punctuation._SUBSTITUTION
+    return cost
+
+
+def test_banded_alignment_is_as_good_as_the_full_matrix():
+    rng = random.Random(7)
+    for _ in range(100):
+        source = [rng.choice("abcdefghij") + str(rng.randrange(20)) for _ in range(rng.randrange(50, 200))]
+        target = _edited(source, rng, rng.randrange(len(source) // 10 + 1))
+        banded = align_tokens(source, target, band=rng.choice([1, 2, 4, 8, 16]))
+        full = align_tokens(source, target, band=10_000)
+        assert _cost(source, target, banded) == _cost(source, target, full)
+
+
+def test_scattered_substitutions_keep_the_initial_band(monkeypatch):
+    bands = []
+    banded_alignment = timestamped_punctuation._banded_alignment
+
+    def spy(*args):
+        bands.append(args[-1])
+        return banded_alignment(*args)
+
+    monkeypatch.setattr(timestamped_punctuation, "_banded_alignment", spy)
+    rng = random.Random(3)
+    source = [f"w{rng.randrange(3000)}" for _ in range(20_000)]
+    # A corrected text: 2% of the words replaced, and a filler every 500 words
+    target = ["x" + word if rng.random() < 0.02 else word for word in source]
+    for position in range(0, len(target), 500):
+        target.insert(position, "uh")
+    alignment = align_tokens(source, target)
+    assert bands == [ALIGN_BAND]
+    assert sum(index is not None and target[index] == word for word, index in zip(source, alignment)) > 19_000
+
+
+def test_timestamp_punctuation_to_index_leaves_out_dropped_words():
+    text = "Hello world."
+    indices = timestamp_punctuation_to_index(_transcript(["hello", "um", "world"]), text)
+    assert indices == {(0.0, 0.5): (0, 4), (1.0, 1.5): (6, 10)}
+
+
+def test_spans_to_times():
+    aligned = [AlignedWord(0.0, 0.5, 0, 5), AlignedWord(1.0, 1.5, 6, 11), AlignedWord(2.0, 2.5, 12, 16)]
+    assert spans_to_times([(0, 11), (6, 16), (11, 12), (20, 22)], aligned) == [
+        (0.0, 1.5),   # the words it covers
+        (1.0, 2.5),
+        (1.5, 2.0),   # between two words: the gap
+        (2.5, 2.5),   # after the last word
+    ]
+    assert spans_to_times([(0, 3)], []) == [None]
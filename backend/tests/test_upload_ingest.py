@@ -0,0 +1,59 @@
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+import upload_ingest
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A server with api_server's upload handling, writing job directories under tmp_path."""
+    monkeypatch.setattr(upload_ingest, "make_job_dir", lambda: upload_ingest.tempfile.mkdtemp(prefix="job_", dir=tmp_path))
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        try:
+            ingested = await upload_ingest.ingest_upload(request, max_bytes=1000)
+        except upload_ingest.UploadRejected as e:
+            return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+        with open(ingested.path, "rb") as video:
+            return {"size": ingested.size, "content": video.read().decode(), "fields": ingested.fields}
+
+    return TestClient(app)
+
+
+def _part(name, content, filename=None):
+    disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+    return f"--zzz\r\nContent-Disposition: {disposition}\r\n\r\n{content}\r\n".encode()
+
+
+def _post(client, body):
+    return client.post("/upload", content=body, headers={"content-type": "multipart/form-data; boundary=zzz"})
+
+
+def test_video_and_fields_are_ingested(client):
+    response = _post(client, _part("preset", "fast") + _part("file", "frames", "talk.mp4") + b"--zzz--\r\n")
+    assert response.status_code == 200
+    assert response.json() == {"size": 6, "content": "frames", "fields": {"preset": "fast"}}
+
+
+@pytest.mark.parametrize("body", [
+    b"garbage",
+    # The video part has started, so a partial file is on disk when the parser fails
+    _part("file", "frames", "talk.mp4") + b"--zzz\r\nnot a header\r\n\r\n",
+])
+def test_malformed_body_is_rejected_and_cleaned_up(client, tmp_path, body):
+    response = _post(client, body)
+    assert response.status_code == 400
+    assert "Malformed multipart body" in response.json()["error"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_missing_video_and_oversized_video(client, tmp_path):
+    assert _post(client, _part("preset", "fast") + b"--zzz--\r\n").status_code == 400
+    assert _post(client, _part("file", "x" * 2000, "talk.mp4") + b"--zzz--\r\n").status_code == 413
+    assert os.listdir(tmp_path) == []
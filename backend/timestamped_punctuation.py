@@ -1,8 +1,165 @@
-from typing import Dict
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import os
 import re
+import numpy as np
 from custom_types import TimeStamp, WordBoundary
-def timestamp_punctuation_to_index( timestamped_transcript: Dict[TimeStamp, str], 
-        punctuated_text: str
+from nlp_document import NlpDocument
+
+# Half-width of the band of the alignment matrix around its diagonal, in words: how far the
+# text may drift from the transcript (merged, split, inserted or dropped words) before the
+# alignment has to be retried with a wider band.
+ALIGN_BAND = int(os.getenv("ALIGN_BAND", "64"))
+
+_INFINITY = np.iinfo(np.int32).max // 2
+_DIAGONAL, _UP, _LEFT = 0, 1, 2
+# Edit costs: inserting or dropping a word, replacing it, replacing it with one that starts alike
+_GAP, _SUBSTITUTION, _NEAR_SUBSTITUTION = 2, 3, 1
+# Signs that the texts drift further apart than the band allows: the best path coming this
+# close to the edge of the band, in words, or at least this many (and at least the band's
+# width) words in a row not matching
+_EDGE_MARGIN = 4
+_MISMATCH_RUN = 8
+
+
+class AlignedWord(NamedTuple):
+    """A transcribed word and where it ended up in the text."""
+    start_time: float
+    end_time: float
+    start: int  # [start, end) character span in the text
+    end: int
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r'\W', '', word).lower()
+
+
+def text_word_spans(text: str, document: Optional[NlpDocument] = None) -> List[WordBoundary]:
+    """
+    [start, end) of every word of a text without leading or trailing punctuation, keeping
+    contractions and numbers like "don't" or "3.5" in one piece, as Whisper does. The job's
+    NlpDocument is used when it annotates this very text.
+    """
+    if document is not None and document.text == text:
+        return document.words()
+    spans = []
+    for match in re.finditer(r'\S+', text):
+        inner = re.search(r'\w(?:.*\w)?', match.group(0))
+        if inner is not None:
+            spans.append((match.start() + inner.start(), match.start() + inner.end()))
+    return spans
+
+
+def align_tokens(source: List[str], target: List[str], band: int = ALIGN_BAND) -> List[Optional[int]]:
+    """
+    Index of the target token each source token is aligned to, or None for source tokens
+    the target dropped.
+
+    Minimum edit distance over normalized tokens, computed only in a band of +-band words
+    around the diagonal of the matrix, so time and memory grow linearly with the transcript.
+    Each row is one numpy pass; insertions within a row are resolved with a running minimum.
+    When the best path inside the band shows signs of drifting further than the band allows
+    (it runs along the band's edge, or through more mismatched words in a row than the band
+    is wide, as a shifted text does), the band is doubled and the alignment repeated.
+    Scattered substitutions, as in a corrected text, keep the initial band.
+
+    Substituted tokens are aligned to each other, and substitutions of tokens starting with
+    the same character are cheaper, so a word the punctuation model split or merged ("don't"
+    and "do not", "well-known" and "well known") maps to the piece it starts.
+    """
+    n, m = len(source), len(target)
+    if n == 0 or m == 0:
+        return [None] * n
+    vocabulary: Dict[str, int] = {}
+    source_tokens = [_normalize(token) for token in source]
+    target_tokens = [_normalize(token) for token in target]
+    source_ids = np.array([vocabulary.setdefault(token, len(vocabulary)) for token in source_tokens])
+    target_ids = np.array([vocabulary.setdefault(token, len(vocabulary)) for token in target_tokens])
+    source_initials = np.array([ord(token[:1] or " ") for token in source_tokens])
+    target_initials = np.array([ord(token[:1] or " ") for token in target_tokens])
+    band = max(band, 1)
+    while True:
+        alignment, drifting = _banded_alignment(source_ids, target_ids, source_initials, target_initials, band)
+        if not drifting or band >= max(n, m):
+            return alignment
+        band *= 2
+
+
+def _banded_alignment(source_ids: np.ndarray, target_ids: np.ndarray, source_initials: np.ndarray,
+                      target_initials: np.ndarray, band: int) -> Tuple[List[Optional[int]], bool]:
+    """The best alignment inside the band, and whether its path shows signs of drifting out of it."""
+    n, m = len(source_ids), len(target_ids)
+    full = band >= max(n, m)
+    # Row i covers target positions lows[i]..highs[i] around the diagonal j = i * m / n
+    centers = np.rint(np.arange(n + 1) * (m / n)).astype(int)
+    lows = np.zeros(n + 1, dtype=int) if full else np.maximum(centers - band, 0)
+    highs = np.full(n + 1, m) if full else np.minimum(centers + band, m)
+    moves: List[np.ndarray] = [np.full(highs[0] + 1, _LEFT, dtype=np.int8)]
+    previous = np.arange(highs[0] + 1, dtype=np.int64) * _GAP
+    for i in range(1, n + 1):
+        low, high, previous_low, previous_high = lows[i], highs[i], lows[i - 1], highs[i - 1]
+        columns = np.arange(low, high + 1)
+
+        up = np.full(len(columns), _INFINITY, dtype=np.int64)
+        inside = (columns >= previous_low) & (columns <= previous_high)
+        up[inside] = previous[columns[inside] - previous_low] + _GAP
+
+        diagonal = np.full(len(columns), _INFINITY, dtype=np.int64)
+        inside = (columns - 1 >= previous_low) & (columns - 1 <= previous_high)
+        targets = columns[inside] - 1
+        diagonal[inside] = previous[targets - previous_low] + np.where(
+            target_ids[targets] == source_ids[i - 1], 0,
+            np.where(target_initials[targets] == source_initials[i - 1], _NEAR_SUBSTITUTION, _SUBSTITUTION))
+
+        row = np.minimum(diagonal, up)
+        move = np.where(diagonal <= up, _DIAGONAL, _UP).astype(np.int8)
+        # Insertions: row[j] = min over k <= j of row[k] + (j - k) * _GAP
+        left = np.minimum.accumulate(row - columns * _GAP) + columns * _GAP
+        move[left < row] = _LEFT
+        row = np.minimum(row, left)
+        moves.append(move)
+        previous = row
+
+    if previous[m - lows[n]] >= _INFINITY:
+        return [None] * n, True   # the band is too narrow to connect the corners
+    margin = max(1, min(_EDGE_MARGIN, band // 4))
+    longest_run = max(_MISMATCH_RUN, band)
+    alignment: List[Optional[int]] = [None] * n
+    drifting = False
+    mismatches = 0
+    i, j = n, m
+    while i > 0:
+        drifting = drifting or (0 < lows[i] > j - margin) or (m > highs[i] < j + margin)
+        move = moves[i][j - lows[i]]
+        if move == _DIAGONAL:
+            alignment[i - 1] = j - 1
+            mismatches = mismatches + 1 if target_ids[j - 1] != source_ids[i - 1] else 0
+            drifting = drifting or mismatches >= longest_run
+            i, j = i - 1, j - 1
+        elif move == _UP:
+            i -= 1
+        else:
+            j -= 1
+    return alignment, drifting and not full
+
+
+def align_words_to_text(timestamped_transcript: Dict[TimeStamp, str], text: str,
+                        document: Optional[NlpDocument] = None, band: int = ALIGN_BAND) -> List[AlignedWord]:
+    """
+    Aligns the transcribed words to the words of a punctuated or corrected text.
+
+    Returns:
+        list: AlignedWord for every transcribed word found in the text, in time order.
+    """
+    stamps = sorted(timestamped_transcript.items(), key=lambda item: item[0][0])
+    spans = text_word_spans(text, document)
+    alignment = align_tokens([word for _, word in stamps], [text[start:end] for start, end in spans], band)
+    return [AlignedWord(stamp[0], stamp[1], *spans[index])
+            for (stamp, _), index in zip(stamps, alignment) if index is not None]
+
+
+def timestamp_punctuation_to_index( timestamped_transcript: Dict[TimeStamp, str],
+        punctuated_text: str, document: Optional[NlpDocument] = None
 ) -> Dict[TimeStamp, WordBoundary]:
     """
     Match each word from a timestamped transcript to its character indices in a punctuated text.
@@ -10,22 +167,38 @@ def timestamp_punctuation_to_index( timestamped_transcript: Dict[TimeStamp, str]
     Args:
         timestamped_transcript (dict): Maps (start_time, end_time) to a word (str).
         punctuated_text (str): The full text with punctuation.
+        document (NlpDocument): The job's annotation of punctuated_text; its words keep
+              contractions and numbers like "don't" or "3.5" in one piece, as Whisper does.
 
     Returns:
-        dict: Maps each (start_time, end_time) to a (start_idx, end_idx) character range 
-              in the punctuated text (end_idx is inclusive).
-
-    Raises:
-        ValueError: If the number of words doesn't match or words can't be aligned.
-    """
-    word_spans = [match.span() for match in re.finditer(r'\b\w+\b', punctuated_text)]
-    timestamped_items = list(timestamped_transcript.items())
-    result = {}
-    if len(word_spans) != len(timestamped_items):
-        raise ValueError(f"Word count mismatch: {len(word_spans)} spans vs {len(timestamped_items)} timestamps")
-    for (timestamp, word), (start, end) in zip(timestamped_items, word_spans):
-        if punctuated_text[start:end].lower().strip() != word.lower().strip():
-            raise ValueError(f"Mismatch between '{word}' and '{punctuated_text[start:end]}'")
-        result[timestamp] = (start, end-1)
-
-    return result
+        dict: Maps each (start_time, end_time) to a (start_idx, end_idx) character range
+              in the punctuated text (end_idx is inclusive). Words the punctuation model
+              dropped are left out.
+    """
+    return {(word.start_time, word.end_time): (word.start, word.end - 1)
+            for word in align_words_to_text(timestamped_transcript, punctuated_text, document)}
+
+
+def _span_to_time(span: WordBoundary, aligned: List[AlignedWord], starts: List[int], ends: List[int]) -> Optional[TimeStamp]:
+    if not aligned:
+        return None
+    start, end = span
+    first = bisect_right(ends, start)                     # first word ending after the span starts
+    last = bisect_left(starts, max(end, start + 1)) - 1   # last word starting before it ends
+    if first <= last:
+        return aligned[first].start_time, max(word.end_time for word in aligned[first:last + 1])
+    before = aligned[last] if last >= 0 else None
+    after = aligned[first] if first < len(aligned) else None
+    return (before.end_time if before else after.start_time,
+            after.start_time if after else before.end_time)
+
+
+def spans_to_times(spans: List[WordBoundary], aligned: List[AlignedWord]) -> List[Optional[TimeStamp]]:
+    """
+    (start_time, end_time) of each [start, end) character span of the aligned text, e.g. of
+    the grammar corrections, from the words it overlaps. A span between words (an inserted
+    word) gets the gap between its neighbours. None when no word could be aligned at all.
+    """
+    starts = [word.start for word in aligned]
+    ends = [word.end for word in aligned]
+    return [_span_to_time(span, aligned, starts, ends) for span in spans]
@@ -0,0 +1,257 @@
+import re
+import math
+import numpy as np
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from nlp_document import NlpDocument
+from timestamped_punctuation import AlignedWord, spans_to_times
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+# Offline, lexicon-based tone analysis. Results use Sapling's format: [score, label, emoji]
+# triples sorted by score, whose scores sum to 1 together with "neutral".
+
+
+class Tone(NamedTuple):
+    label: str
+    emoji: str
+    valence: float  # -1 (negative) .. 1 (positive); drives the VADER-style scores
+    words: Tuple[str, ...]
+
+
+TONES: List[Tone] = [
+    Tone("confident", "💪", 1.0, ("confident", "certain", "sure", "definitely", "clearly", "absolutely", "proven",
+                                  "strong", "strength", "believe", "guarantee", "undoubtedly", "determined")),
+    Tone("optimistic", "🌞", 1.0, ("hope", "hopeful", "hoping", "optimistic", "bright", "future", "better", "improve",
+                                   "opportunity", "opportunities", "possible", "promising", "forward", "positive", "progress")),
+    Tone("excited", "🤩", 1.0, ("excited", "exciting", "amazing", "awesome", "incredible", "thrill", "thrilled",
+                                "wow", "fantastic", "can't wait", "electric", "energy", "passionate", "eager")),
+    Tone("joyful", "😊", 1.0, ("happy", "glad", "joy", "enjoy", "love", "fun", "delighted", "wonderful", "great",
+                               "smile", "laugh", "nice", "beautiful", "pleased", "cheerful")),
+    Tone("grateful", "🙏", 1.0, ("thank", "thanks", "grateful", "thankful", "appreciate", "appreciated", "gratitude")),
+    Tone("admiring", "😍", 1.0, ("admire", "brilliant", "impressive", "impressed", "inspiring", "respect",
+                                 "talented", "remarkable", "outstanding", "excellent", "favorite", "genius")),
+    Tone("curious", "🤔", 0.0, ("wonder", "curious", "why", "what if", "question", "explore", "interesting",
+                                "discover", "imagine")),
+    Tone("confused", "😕", -0.5, ("confused", "confusing", "unclear", "unsure", "don't know", "puzzled", "strange",
+                                  "weird", "lost", "maybe", "guess")),
+    Tone("sad", "😢", -1.0, ("sad", "unhappy", "cry", "tears", "lonely", "miss", "loss", "grief", "depressed",
+                             "hurt", "heartbroken", "sorrow")),
+    Tone("annoyed", "😒", -1.0, ("annoyed", "annoying", "bugging", "bother", "irritating", "tired", "ugh",
+                                 "whatever", "boring", "fed up", "come on")),
+    Tone("angry", "😠", -1.0, ("angry", "mad", "furious", "hate", "outrageous", "rage", "unacceptable",
+                               "ridiculous", "stupid", "terrible", "awful")),
+    Tone("fearful", "😨", -1.0, ("afraid", "scared", "fear", "worried", "worry", "anxious", "nervous", "risk",
+                                 "danger", "dangerous", "panic", "threat")),
+    Tone("disappointed", "😞", -1.0, ("disappointed", "disappointing", "letdown", "let down", "failed", "fail",
+                                      "wrong", "unfortunately", "wasted", "useless", "disaster", "bad", "worse")),
+    Tone("apologetic", "😔", -0.5, ("sorry", "apologize", "apologies", "regret", "my fault", "excuse", "forgive")),
+]
+NEUTRAL = ("neutral", "😐")
+
+NEGATIONS = {"not", "no", "never", "nothing", "none", "nobody", "neither", "nor", "cannot", "without",
+             "don't", "doesn't", "didn't", "isn't", "aren't", "wasn't", "weren't", "won't", "wouldn't",
+             "can't", "couldn't", "shouldn't", "haven't", "hasn't", "hadn't"}
+INTENSIFIERS = {"very": 1.3, "really": 1.3, "so": 1.2, "extremely": 1.5, "incredibly": 1.5, "totally": 1.4,
+                "absolutely": 1.4, "super": 1.3, "truly": 1.3, "completely": 1.4, "quite": 1.1,
+                "slightly": 0.6, "somewhat": 0.7, "barely": 0.5, "kind of": 0.7, "a bit": 0.7}
+NEGATION_WINDOW = 3      # words before a tone word that can negate it
+NEGATED_WEIGHT = 0.74    # VADER's damping of negated words
+# Neutral mass of a text: NEUTRAL_BASE plus NEUTRAL_PER_WORD for every word, so a single tone
+# word weighs less in a long sentence than in a short one
+NEUTRAL_BASE = 1.0
+NEUTRAL_PER_WORD = 0.05
+MIN_SCORE = 0.01
+
+_LABELS = [tone.label for tone in TONES]
+_NEGATIVE_FALLBACK = _LABELS.index("disappointed")  # where negated positive words count ("not happy")
+_TOKEN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+_SENTENCE = re.compile(r'\S.*?(?:[.!?]+(?=\s)|$)', re.DOTALL)
+
+
+def _build_lexicon() -> Tuple[Dict[str, int], Dict[Tuple[str, str], int]]:
+    words, phrases = {}, {}
+    for index, tone in enumerate(TONES):
+        for entry in tone.words:
+            parts = entry.split()
+            if len(parts) == 1:
+                words.setdefault(entry, index)
+            else:
+                phrases.setdefault(tuple(parts), index)
+    return words, phrases
+
+
+_WORDS, _PHRASES = _build_lexicon()
+_PHRASE_INTENSIFIERS = {tuple(key.split()): value for key, value in INTENSIFIERS.items() if " " in key}
+
+
+def _lookup(token: str) -> Optional[int]:
+    """Tone index of a word, trying a few inflections ("hoped" -> "hope", "thanks" -> "thank")."""
+    if token in _WORDS:
+        return _WORDS[token]
+    for suffix, replacement in (("s", ""), ("es", ""), ("ed", ""), ("ed", "e"), ("ing", ""), ("ing", "e"), ("ly", "")):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            stem = token[:-len(suffix)] + replacement
+            if stem in _WORDS:
+                return _WORDS[stem]
+    return None
+
+
+class ToneScores(NamedTuple):
+    """Raw tone evidence for one text."""
+    weights: np.ndarray   # one weight per entry of TONES
+    words: int            # number of words, which sets the neutral mass
+
+
+def _score_tokens(tokens: List[str], text: str) -> Tuple[np.ndarray, int]:
+    weights = np.zeros(len(TONES))
+    boost = 1.0
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        pair = tuple(tokens[i:i + 2])
+        if pair in _PHRASE_INTENSIFIERS:
+            boost, i = _PHRASE_INTENSIFIERS[pair], i + 2
+            continue
+        if token in INTENSIFIERS:
+            boost, i = INTENSIFIERS[token], i + 1
+            continue
+        if pair in _PHRASES:
+            index, width = _PHRASES[pair], 2
+        else:
+            index, width = _lookup(token), 1
+        if index is not None:
+            negated = any(previous in NEGATIONS for previous in tokens[max(0, i - NEGATION_WINDOW):i])
+            if not negated:
+                weights[index] += boost
+            elif TONES[index].valence > 0:
+                weights[_NEGATIVE_FALLBACK] += boost * NEGATED_WEIGHT
+            # a negated negative word ("not bad") only adds to neutral
+        boost = 1.0
+        i += width
+    exclamations = min(text.count("!"), 3)
+    if exclamations:
+        weights *= 1 + 0.1 * exclamations
+    if "?" in text:
+        weights[_LABELS.index("curious")] += 0.5
+    return weights, len(tokens)
+
+
+def score_texts(texts: List[str]) -> List[ToneScores]:
+    """Tone evidence for a batch of texts."""
+    results = []
+    for text in texts:
+        weights, words = _score_tokens(_TOKEN.findall(text.lower()), text)
+        results.append(ToneScores(weights, words))
+    return results
+
+
+def to_sapling_format(scores: ToneScores) -> List[list]:
+    """[score, label, emoji] triples like Sapling's "overall", highest first."""
+    neutral = NEUTRAL_BASE + NEUTRAL_PER_WORD * scores.words
+    total = scores.weights.sum() + neutral
+    triples = [[round(float(neutral / total), 3), NEUTRAL[0], NEUTRAL[1]]]
+    for tone, weight in zip(TONES, scores.weights):
+        if weight / total >= MIN_SCORE:
+            triples.append([round(float(weight / total), 3), tone.label, tone.emoji])
+    return sorted(triples, key=lambda triple: -triple[0])
+
+
+def get_tones(texts: List[str]) -> List[List[list]]:
+    """Batched get_tone."""
+    return [to_sapling_format(scores) for scores in score_texts(texts)]
+
+
+def get_tone(text: str) -> list:
+    """Offline drop-in for sapling.get_tone: the overall tone of a text as [score, label, emoji] triples."""
+    logger.info("tone_analyzer.get_tone called")
+    try:
+        return get_tones([text])[0]
+    except Exception as e:
+        logger.error(f"Error in tone_analyzer.get_tone: {e}", exc_info=True)
+        raise
+
+
+def split_sentences(text: str) -> List[str]:
+    return [match.group(0).strip() for match in _SENTENCE.finditer(text)]
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """[start, end) character span of every sentence of a text, by regex."""
+    return [match.span() for match in _SENTENCE.finditer(text)]
+
+
+def get_tone_timeline(aligned: List[AlignedWord], punctuated_text: str, document: Optional[NlpDocument] = None) -> List[dict]:
+    """
+    Tone of every sentence of the punctuated transcript, with the sentence's start and end
+    time taken from the transcribed words aligned to it.
+
+    aligned is timestamped_punctuation.align_words_to_text of the punctuated text, so words
+    the punctuation model merged, split or dropped do not shift the sentences after them.
+    Sentences come from the job's NlpDocument when given, else from a regex.
+    """
+    logger.info("get_tone_timeline called")
+    try:
+        if document is not None:
+            spans = list(document.sentences)
+        else:
+            spans = sentence_spans(punctuated_text)
+        sentences = [punctuated_text[start:end].strip() for start, end in spans]
+        timeline = []
+        for sentence, tones, times in zip(sentences, get_tones(sentences), spans_to_times(spans, aligned)):
+            if not sentence or times is None:
+                continue
+            timeline.append({
+                "start": times[0],
+                "end": times[1],
+                "text": sentence,
+                "tones": tones,
+            })
+        return timeline
+    except Exception as e:
+        logger.error(f"Error in get_tone_timeline: {e}", exc_info=True)
+        raise
+
+
+# --- VADER-style interface used by goldenbek_main ---
+
+def analyze_tone(text: str) -> Dict[str, float]:
+    """"pos", "neu" and "neg" proportions and a "compound" score in [-1, 1], as in VADER."""
+    scores = score_texts([text])[0]
+    valences = np.array([tone.valence for tone in TONES])
+    positive = float(scores.weights[valences > 0].sum())
+    negative = float(-(scores.weights * np.minimum(valences, 0)).sum())
+    neutral = NEUTRAL_BASE + NEUTRAL_PER_WORD * scores.words
+    total = positive + negative + neutral
+    valence = positive - negative
+    return {
+        "compound": valence / math.sqrt(valence * valence + 15),  # VADER's normalization
+        "pos": positive / total,
+        "neu": neutral / total,
+        "neg": negative / total,
+    }
+
+
+def get_tone_description(compound: float) -> str:
+    if compound >= 0.5:
+        return "Very Positive"
+    if compound >= 0.05:
+        return "Positive"
+    if compound > -0.05:
+        return "Neutral"
+    if compound > -0.5:
+        return "Negative"
+    return "Very Negative"
+
+
+def analyze_text_segments(text: str, sentences_per_segment: int = 3) -> List[Tuple[str, Dict[str, float]]]:
+    """analyze_tone of consecutive groups of sentences, to follow how the tone changes through a text."""
+    sentences = split_sentences(text)
+    segments = [" ".join(sentences[i:i + sentences_per_segment]) for i in range(0, len(sentences), sentences_per_segment)]
+    return [(segment, analyze_tone(segment)) for segment in segments]
@@ -0,0 +1,182 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import logging
+from typing import Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool # type: ignore
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.exceptions import MultipartParseError  # type: ignore
+    from multipart.multipart import MultipartParser, parse_options_header  # type: ignore
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='api_server.log',
+    filemode='a'
+)
+logger = logging.getLogger(__name__)
+
+UPLOAD_ROOT = os.getenv("UPLOAD_ROOT", "uploaded_videos")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(2 * 1024 ** 3)))  # 2 GiB
+MAX_FIELD_BYTES = 64 * 1024
+
+class UploadRejected(Exception):
+    """Raised when an upload is malformed or exceeds the size cap."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class IngestedUpload:
+    """A video streamed into its own job directory, plus the plain form fields sent with it."""
+
+    def __init__(self, job_dir: str):
+        self.job_dir = job_dir
+        self.path: Optional[str] = None
+        self.filename: Optional[str] = None
+        self.size = 0
+        self.sha256: Optional[str] = None
+        self.fields: Dict[str, str] = {}
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+
+
+def make_job_dir(root: str = UPLOAD_ROOT) -> str:
+    """Creates a fresh, uniquely named working directory for one upload."""
+    os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix="job_", dir=root)
+
+
+def _safe_extension(filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if ext[1:].isalnum() and len(ext) <= 6 else ".mp4"
+
+
+class _FormStreamer:
+    """python-multipart callbacks that write the file part straight to disk, hashing as it goes."""
+
+    def __init__(self, upload: IngestedUpload, file_field: str, max_bytes: int):
+        self.upload = upload
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.hasher = hashlib.sha256()
+        self.out = None
+        self.in_file = False  # whether the current part is the video
+        self.field_name: Optional[str] = None
+        self.field_value = bytearray()
+        self.header_field = bytearray()
+        self.header_value = bytearray()
+        self.headers: Dict[bytes, bytes] = {}
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": lambda data, start, end: self.header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self.header_value.extend(data[start:end]),
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self.headers = {}
+        self.field_name = None
+        self.field_value = bytearray()
+        self.in_file = False
+
+    def on_header_end(self):
+        self.headers[bytes(self.header_field).lower()] = bytes(self.header_value)
+        self.header_field = bytearray()
+        self.header_value = bytearray()
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        self.field_name = options.get(b"name", b"").decode("latin-1")
+        filename = options.get(b"filename")
+        if self.field_name == self.file_field and self.out is not None:
+            raise UploadRejected(f"Form field '{self.file_field}' was sent more than once.")
+        if self.field_name == self.file_field and filename is not None:
+            self.in_file = True
+            self.upload.filename = os.path.basename(filename.decode("utf-8", "replace"))
+            self.upload.path = os.path.join(self.upload.job_dir, "video" + _safe_extension(self.upload.filename))
+            self.out = open(self.upload.path, "wb")
+
+    def on_part_data(self, data, start, end):
+        chunk = data[start:end]
+        if self.in_file:
+            self.upload.size += len(chunk)
+            if self.upload.size > self.max_bytes:
+                raise UploadRejected(f"Upload exceeds the limit of {self.max_bytes} bytes.", status_code=413)
+            self.out.write(chunk)
+            self.hasher.update(chunk)
+        else:
+            self.field_value.extend(chunk)
+            if len(self.field_value) > MAX_FIELD_BYTES:
+                raise UploadRejected(f"Form field '{self.field_name}' is too large.")
+
+    def on_part_end(self):
+        if self.in_file:
+            self.out.close()
+            self.upload.sha256 = self.hasher.hexdigest()
+        elif self.field_name:
+            self.upload.fields[self.field_name] = self.field_value.decode("utf-8", "replace")
+
+    def close(self):
+        if self.out is not None and not self.out.closed:
+            self.out.close()
+
+
+async def ingest_upload(request, file_field: str = "file", max_bytes: int = MAX_UPLOAD_BYTES) -> IngestedUpload:
+    """
+    Streams a multipart/form-data request body into a new job directory.
+
+    The video part is written chunk by chunk as it arrives from the socket and hashed
+    in the same pass, so it is never spooled or copied before analysis. Parsing and disk
+    writes run in the thread pool, so a slow disk never stalls the event loop.
+
+    Args:
+        request: The incoming Starlette/FastAPI request.
+        file_field: Name of the form field holding the video.
+        max_bytes: Size cap for the video.
+
+    Returns:
+        IngestedUpload: Where the video was written, its size and SHA-256, and other form fields.
+
+    Raises:
+        UploadRejected: If the body is not valid multipart, has no video or more than one, or is too large.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected("Expected a multipart/form-data upload.")
+
+    upload = IngestedUpload(await run_in_threadpool(make_job_dir))
+    streamer = _FormStreamer(upload, file_field, max_bytes)
+    parser = MultipartParser(params[b"boundary"], streamer.callbacks())
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(parser.write, chunk)
+        await run_in_threadpool(parser.finalize)
+        streamer.close()
+        if upload.path is None or upload.sha256 is None:
+            raise UploadRejected(f"No video found in form field '{file_field}'.")
+    except MultipartParseError as e:
+        streamer.close()
+        await run_in_threadpool(upload.cleanup)
+        raise UploadRejected(f"Malformed multipart body: {e}") from e
+    except Exception:
+        streamer.close()
+        await run_in_threadpool(upload.cleanup)
+        raise
+
+    logger.info(f"Ingested {upload.filename} ({upload.size} bytes, sha256 {upload.sha256}) into {upload.job_dir}")
+    return upload
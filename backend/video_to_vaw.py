@@ -1,7 +1,10 @@
 import os
-from moviepy.editor import VideoFileClip
+import shutil
+import subprocess
 import logging
+import numpy as np
 from typing import Optional
+from audio_buffer import AudioBuffer
 
 logging.basicConfig(
     level=logging.INFO,
@@ -11,12 +14,89 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def convert_video_to_wav(video_path: str) -> Optional[str]:
-    """Convert a video file to WAV format and save in video_audios/ folder."""
+SAMPLE_RATE = 16000  # what Whisper expects; every audio analyzer works at this rate
+# ffmpeg is killed after this many seconds, so a stalled decode cannot hold a job forever
+FFMPEG_TIMEOUT_SEC = float(os.getenv("FFMPEG_TIMEOUT_SEC", "600"))
+
+
+def get_ffmpeg_binary() -> str:
+    """FFMPEG_BINARY if set, else ffmpeg on PATH, else the binary bundled with imageio-ffmpeg (a moviepy dependency)."""
+    binary = os.getenv("FFMPEG_BINARY") or shutil.which("ffmpeg")
+    if binary:
+        return binary
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except ImportError:
+        return "ffmpeg"
+
+
+def decode_audio(video_path: str, sample_rate: int = SAMPLE_RATE, mmap_path: Optional[str] = None,
+                 timeout: float = FFMPEG_TIMEOUT_SEC) -> Optional[AudioBuffer]:
+    """
+    Decode the audio track of a video once, straight to mono float32 PCM at sample_rate.
+
+    ffmpeg does the demuxing, downmixing and resampling and streams raw samples over a pipe,
+    so no intermediate WAV is written.
+
+    Args:
+        video_path: Path to the video file
+        sample_rate: Output sample rate in Hz
+        mmap_path: If given, the samples are written to this raw float32 file and returned
+            as a read-only memory map, so that several processes can share them
+        timeout: Seconds after which ffmpeg is killed and decoding counts as failed
+
+    Returns:
+        AudioBuffer: Read-only samples in [-1, 1], or None if there is no audio track or decoding failed or timed out
+    """
+    logger.info(f"decode_audio called with video_path: {video_path}")
+    command = [
+        get_ffmpeg_binary(), '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-i', video_path,
+        '-vn', '-sn', '-dn',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        '-f', 'f32le', '-acodec', 'pcm_f32le',
+        mmap_path or 'pipe:1',
+    ]
+    if mmap_path:
+        command.insert(1, '-y')
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.error(f"ffmpeg timed out after {timeout:.0f}s decoding audio from {video_path}")
+        return None
+    except OSError as e:
+        logger.error(f"Could not run ffmpeg: {e}", exc_info=True)
+        return None
+
+    if process.returncode != 0:
+        # ffmpeg fails with "does not contain any stream" when the video has no audio track
+        logger.error(f"ffmpeg could not decode audio from {video_path}: {process.stderr.decode(errors='replace').strip()}")
+        return None
+
+    if mmap_path:
+        if os.path.getsize(mmap_path) == 0:
+            logger.error(f"No audio samples decoded from {video_path}")
+            return None
+        samples = np.memmap(mmap_path, dtype=np.float32, mode='r')
+    else:
+        samples = np.frombuffer(process.stdout, dtype=np.float32)
+    if samples.size == 0:
+        logger.error(f"No audio samples decoded from {video_path}")
+        return None
+
+    logger.info(f"Decoded {samples.size / sample_rate:.1f}s of audio from {video_path}")
+    return AudioBuffer(samples, sample_rate)
+
+def convert_video_to_wav(video_path: str, output_dir: str = 'video_audios') -> Optional[str]:
+    """Convert a video file to WAV format and save in output_dir (video_audios/ by default)."""
     logger.info(f"convert_video_to_wav called with video_path: {video_path}")
-    os.makedirs('video_audios', exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
 
     try:
+        # moviepy is slow to import, so only load it when a WAV file is really needed
+        from moviepy.editor import VideoFileClip
         video = VideoFileClip(video_path)
 
         if video.audio is None:
@@ -26,7 +106,7 @@ def convert_video_to_wav(video_path: str) -> Optional[str]:
  
         # Generate output path
         filename = os.path.splitext(os.path.basename(video_path))[0] + '.wav'
-        output_path = os.path.join('video_audios', filename)
+        output_path = os.path.join(output_dir, filename)
 
         # Write the audio to a WAV file
         video.audio.write_audiofile(
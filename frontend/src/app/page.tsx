@@ -50,6 +50,10 @@ interface AnalysisResults {
   all_aus_sum: number;
 }
 
+// How often the job's result is polled, and how long to wait for it before giving up
+const POLL_INTERVAL_MS = 2000;
+const MAX_WAIT_MS = 30 * 60 * 1000;
+
 /**
  * The main Home component for the Speech Analyzer application, styled as a SaaS landing page.
  * Handles video uploads, displays upload status, errors, and analysis results.
@@ -60,6 +64,28 @@ export default function App() {
   const fileInputRef = useRef<HTMLInputElement>(null);
   const router = useRouter();
 
+  /**
+   * Polls the backend until the analysis job has finished and returns its results.
+   * Gives up with an error when the job is unknown (e.g. the server restarted) or
+   * has not finished within MAX_WAIT_MS.
+   * @param {string} jobId - The id returned by the upload endpoint.
+   */
+  const waitForResults = async (jobId: string): Promise<AnalysisResults | { error: string }> => {
+    const deadline = Date.now() + MAX_WAIT_MS;
+    while (Date.now() < deadline) {
+      const res = await fetch(`http://localhost:8000/api/jobs/${jobId}/result`);
+      if (res.status === 404) {
+        return { error: "The analysis job was not found. Please upload the video again." };
+      }
+      if (res.status !== 202) {
+        const data = await res.json().catch(() => ({ error: `Analysis failed (HTTP ${res.status})` }));
+        return res.ok ? data : { error: data.error || `Analysis failed (HTTP ${res.status})` };
+      }
+      await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+    }
+    return { error: "The analysis is taking too long. Please try again later." };
+  };
+
   /**
    * Handles the video file upload process.
    * @param {React.FormEvent | React.ChangeEvent} e - The form or change event.
@@ -85,7 +111,12 @@ export default function App() {
         setError(err.error || "Upload failed");
         return;
       }
-      const data: AnalysisResults = await res.json();
+      const job: { job_id: string } = await res.json();
+      const data = await waitForResults(job.job_id);
+      if ("error" in data) {
+        setError(data.error || "Analysis failed");
+        return;
+      }
       sessionStorage.setItem('analysisResults', JSON.stringify(data));
       router.push('/results');
     } catch (_err) {